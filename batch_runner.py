@@ -0,0 +1,497 @@
+import argparse
+import json
+import os
+import traceback
+import warnings
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import matplotlib
+matplotlib.use('Agg')  # Пакетный режим: без окон matplotlib
+
+import pandas as pd
+
+from common_dates import CommonDates, required_columns
+from ee_backend import BACKENDS, make_backend, set_backend
+from ee_session import EE_PROJECT, set_default_project
+from excel_manager import GROUND_CHUNK_ROWS, ExcelManager, print_rejected
+from fetch_planner import MAX_ELEMENTS, FetchPlanner
+from landsat_data import LANDSAT_COLLECTIONS, LandsatDataManager
+from modis_data import ModisDataManager
+from outlier_filters import FilterChain, ground_filters, match_filters
+from output_maker import CSV_COMPRESSION, EXPORT_FORMATS, TableExporter
+from plot_data import plot_data, plot_tolerance_sweep
+from report import create_pdf_report
+from result_store import STORE_PATH, ResultStore
+from satellite_cache import SatelliteCache
+from satellite_data import FULL_BANDS
+from stream_matching import StreamingMatcher
+import tracing
+from validation_stats import GroupedStats, match_statistics
+warnings.filterwarnings('ignore')
+
+
+def load_jobs(job_file):
+    # Файл заданий: {"output": ..., "defaults": {...}, "jobs": [{...}, ...]} или просто список заданий
+    with open(job_file, encoding='utf-8') as f:
+        spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {'jobs': spec}
+
+    defaults = spec.get('defaults', {})
+    base_dir = os.path.dirname(os.path.abspath(job_file))
+    jobs = []
+    for index, job in enumerate(spec.get('jobs', [])):
+        job = {**defaults, **job}
+        if 'file' not in job or 'coordinates' not in job:
+            raise ValueError(f"Job #{index + 1} must define 'file' and 'coordinates'.")
+        if not os.path.isabs(job['file']):
+            job['file'] = os.path.join(base_dir, job['file'])
+        job.setdefault('name', os.path.splitext(os.path.basename(job['file']))[0])
+        job.setdefault('runs', [{'satellite': 'modis', 'product': 'aqua', 'time_of_day': 'day'}])
+        jobs.append(job)
+    return spec.get('output', 'Batch'), jobs
+
+
+def job_managers(job):
+    # Все MODIS-прогоны задания обслуживаются одним запросом по нужным платформам;
+    # запрашиваются только колонки, нужные прогонам ("bands": "full" - все колонки)
+    managers = {}
+    modis_platforms = set()
+    landsat_missions = set()
+    columns = defaultdict(set)
+    for run in job['runs']:
+        satellite, product, time_of_day = normalize_run(job, run)[:3]
+        if satellite == 'modis':
+            if product not in ('aqua', 'terra'):
+                raise ValueError("Invalid satellite_product. Please select 'aqua' or 'terra'.")
+            modis_platforms.add(product)
+        elif satellite == 'landsat':
+            if product not in LANDSAT_COLLECTIONS:
+                raise ValueError("Invalid Landsat mission. Please select 'landsat8' or 'landsat9'.")
+            landsat_missions.add(product)
+        else:
+            raise ValueError("Invalid satellite_name. Please select 'modis' or 'landsat'.")
+        columns[satellite].update(required_columns(satellite, time_of_day))
+    full = job.get('bands') == FULL_BANDS
+    # "neighborhood": радиус окна в пикселях вокруг станции (статистики окна в таблице)
+    neighborhood = job.get('neighborhood')
+    if 'landsat' in columns:
+        managers['landsat'] = LandsatDataManager(landsat_missions, None if full else columns['landsat'],
+                                                 neighborhood)
+    if modis_platforms:
+        managers['modis'] = ModisDataManager(modis_platforms, None if full else columns['modis'], neighborhood)
+    return managers
+
+
+def run_label(satellite, product, time_of_day):
+    return '_'.join(part for part in (satellite, product, time_of_day) if part)
+
+
+def normalize_run(job, run):
+    satellite = run['satellite'].lower()
+    product = run.get('product')
+    product = product.lower() if product else None
+    if satellite == 'landsat' and product is None:
+        # Как платформа MODIS, миссия Landsat задаёт отбор строк: без неё Landsat 8 и 9 смешались бы в одном прогоне
+        product = LandsatDataManager.missions[0]
+    time_of_day = run.get('time_of_day')
+    time_of_day = time_of_day.lower() if time_of_day else None
+    default_tolerance = job.get('tolerance') if satellite == 'modis' else None
+    return satellite, product, time_of_day, run.get('tolerance', default_tolerance)
+
+
+def prefetch_stations(jobs, project=EE_PROJECT, fetch_options=None):
+    # Все станции одного продукта запрашиваются одним многоточечным sampleRegions,
+    # результат раскладывается по станциям в кэш, откуда его берут рабочие процессы
+    set_default_project(project)
+    stations = defaultdict(dict)
+    managers = {}
+    date_ranges = {}
+    for job in jobs:
+        excel_manager = ExcelManager(job['file'])
+        if not excel_manager.read_excel():
+            continue
+        date_start = excel_manager.date_start.strftime('%Y-%m-%d')
+        date_end = excel_manager.date_end.strftime('%Y-%m-%d')
+        for manager in job_managers(job).values():
+            # Продукт - коллекция и набор колонок: под этим ключом таблицы ищут рабочие процессы
+            product = (manager.collection_id, tuple(manager.columns), manager.neighborhood)
+            # Станции с одинаковыми координатами (например, 1М и 1МL) запрашиваются один раз
+            stations[product].setdefault(tuple(job['coordinates']), job['name'])
+            managers[product] = manager
+            known_start, known_end = date_ranges.get(product, (date_start, date_end))
+            date_ranges[product] = (min(known_start, date_start), max(known_end, date_end))
+
+    planner = FetchPlanner(**(fetch_options or {}))
+    satellite_cache = SatelliteCache(fetch=planner.fetch, fetch_stations=planner.fetch_stations)
+    for product, points in stations.items():
+        date_start, date_end = date_ranges[product]
+        station_list = [(name, list(coordinates)) for coordinates, name in points.items()]
+        satellite_cache.get_station_dataframes(managers[product], station_list, date_start, date_end)
+        print(f"Prefetched {product[0]} ({len(product[1])} columns): {len(station_list)} stations, "
+              f"{date_start} - {date_end}")
+
+
+def _init_worker(project, backend=None, recordings=None):
+    # Earth Engine инициализируется при первом запросе, который не закрыл кэш
+    set_default_project(project)
+    if backend is not None:
+        set_backend(make_backend(backend, recordings))
+
+
+def stored_results(job, store):
+    # Новых наземных данных нет: метрики и пары берутся из хранилища без запросов и сопоставления
+    metrics = []
+    stats = GroupedStats()
+    for run in job['runs']:
+        satellite, product, time_of_day, time_interval_minutes = normalize_run(job, run)
+        station, satellite, platform, time_of_day = store.combination_key(job['name'], satellite, product,
+                                                                          time_of_day)
+        matches = store.matches(station=station, satellite=satellite, platform=platform, time_of_day=time_of_day,
+                                time_interval_minutes=time_interval_minutes)
+        metrics.append({'station': job['name'], 'run': run_label(satellite, product, time_of_day),
+                        'tolerance': time_interval_minutes, **match_statistics(matches)})
+        stats.update(matches, station=job['name'])
+    return metrics, stats
+
+
+def resume_window(job, store, ground_end):
+    # Начало окна пересчёта задания: самое раннее среди прогонов; None - пересчитать всё,
+    # False - все прогоны уже учли наземные данные до ground_end
+    starts = []
+    for run in job['runs']:
+        satellite, product, time_of_day, time_interval_minutes = normalize_run(job, run)
+        start = store.resume_from(job['name'], satellite, product, time_of_day, time_interval_minutes, ground_end)
+        if start is None:
+            return None
+        if start is not False:
+            starts.append(start)
+    return min(starts) if starts else False
+
+
+def run_job(job, output_dir, use_cache=True, fetch_options=None, store_path=None, incremental=False):
+    if job.get('stream'):
+        if store_path:
+            raise ValueError("Streaming jobs do not use the result store; remove 'stream' or --store.")
+        return run_streaming_job(job, output_dir, use_cache, fetch_options)
+    job_dir = os.path.join(output_dir, job['name'])
+    os.makedirs(job_dir, exist_ok=True)
+
+    excel_manager = ExcelManager(job['file'])
+    if not excel_manager.read_excel():
+        raise ValueError(f"Could not read ground data from {job['file']}")
+    excel_data = excel_manager.data
+    save_rejected(job_dir, excel_manager.rejected)
+    date_start = excel_manager.date_start.strftime('%Y-%m-%d')
+    date_end = excel_manager.date_end.strftime('%Y-%m-%d')
+
+    # Хранилище результатов: в инкрементном режиме запрашиваются и сопоставляются только пролёты
+    # после последнего учтённого наземного измерения (с запасом на допуск)
+    if store_path and job.get('neighborhood'):
+        raise ValueError("The result store keeps point samples only; remove 'neighborhood' or --store.")
+    store = ResultStore(store_path) if store_path else None
+    since = None
+    # Конец учтённого периода: пролёты запрашиваются до date_end не включительно
+    ground_end = min(excel_data['datetime'].max(), pd.Timestamp(date_end))
+    if store is not None and incremental:
+        since = resume_window(job, store, ground_end)
+        if since is False:
+            print(f"[{job['name']}] no new ground data since the last run")
+            try:
+                return stored_results(job, store)
+            finally:
+                store.close()
+        if since is not None:
+            date_start = max(date_start, since.strftime('%Y-%m-%d'))
+
+    planner, satellite_frames = fetch_satellite_frames(job, date_start, date_end, use_cache, fetch_options)
+    exporter = job_exporter(job, job_dir)
+
+    # Наземные данные очищаются один раз и переиспользуются всеми прогонами
+    prepared = None
+    metrics = []
+    stats = GroupedStats()
+    filter_reports = []
+    # Пороги фильтров задаются в задании: "ground_filters": {"low": -40, ...}, "match_filters": {"n_sigma": 3}
+    ground_filter_chain = ground_filters(**job.get('ground_filters', {}))
+    match_filter_chain = match_filters(**job.get('match_filters', {}))
+    # С хранилищем пары сохраняются до фильтра выбросов, фильтр проходит по всем парам комбинации
+    pair_filter_chain = FilterChain([]) if store is not None else match_filter_chain
+    for run in job['runs']:
+        satellite, product, time_of_day, time_interval_minutes = normalize_run(job, run)
+        label = run_label(satellite, product, time_of_day)
+        # Цель сопоставления: "target": "daily" и т.п. в прогоне или задании (по умолчанию instant)
+        target = run.get('target', job.get('target', 'instant'))
+        if target != 'instant':
+            if store is not None:
+                raise ValueError("The result store keeps instant matches only; remove 'target' or --store.")
+            label = f'{label}_{target}'
+        df = satellite_frames[satellite]
+
+        if prepared is None:
+            common_dates = prepared = CommonDates(df, excel_data, satellite, product, time_of_day,
+                                                  ground_filter_chain=ground_filter_chain,
+                                                  match_filter_chain=pair_filter_chain,
+                                                  window_value=job.get('window_value', 'center'),
+                                                  min_valid_fraction=job.get('min_valid_fraction'),
+                                                  max_window_std=job.get('max_window_std'))
+        else:
+            common_dates = prepared.for_satellite(df, satellite, product, time_of_day)
+        if job.get('sweep'):
+            # Подбор промежутка: метрики для списка допусков за один проход
+            sweep = common_dates.sweep_tolerances(job['sweep'])
+            sweep.to_csv(os.path.join(job_dir, f'sweep_{label}.csv'), index=False)
+            plot_tolerance_sweep(sweep, satellite, save_path=os.path.join(job_dir, f'sweep_{label}.png'),
+                                 show=False)
+        matches, daily_averages = common_dates.match_data(time_interval_minutes, target)
+        match_report = common_dates.match_report
+        if store is not None:
+            if not filter_reports:
+                store.replace_ground(job['name'], common_dates.excel_data, since)
+            store.replace_satellite(job['name'], satellite, product, time_of_day, common_dates._satellite_frame(),
+                                    since)
+            store.replace_matches(job['name'], satellite, product, time_of_day, time_interval_minutes, matches,
+                                  since, ground_end)
+            matches, match_report = store.apply_filters(job['name'], satellite, product, time_of_day,
+                                                        time_interval_minutes, match_filter_chain)
+        if not filter_reports:
+            filter_reports.append(common_dates.ground_report.assign(run='ground'))
+        filter_reports.append(match_report.assign(run=label))
+
+        metrics.append({'station': job['name'], 'run': label, 'tolerance': time_interval_minutes,
+                        **match_statistics(matches)})
+        stats.update(matches, station=job['name'])
+        if store is not None:
+            store.store_metrics(job['name'], satellite, product, time_of_day, time_interval_minutes, metrics[-1])
+        save_run(job, job_dir, label, run, df, matches, date_start, date_end, exporter)
+
+    pd.DataFrame(metrics).to_csv(os.path.join(job_dir, 'metrics.csv'), index=False)
+    if prepared is not None:
+        # Суточные агрегаты и суточный ход очищенного наземного ряда
+        aggregates = prepared.ground_aggregates()
+        aggregates.daily.to_csv(os.path.join(job_dir, 'ground_daily.csv'))
+        aggregates.diurnal.to_csv(os.path.join(job_dir, 'ground_diurnal.csv'))
+    save_job_tables(job_dir, stats, filter_reports, planner, exporter)
+    if store is not None:
+        store.close()
+    return metrics, stats
+
+
+def fetch_satellite_frames(job, date_start, date_end, use_cache=True, fetch_options=None):
+    # Один запрос к Earth Engine на спутник: все платформы и Day/Night используют общую таблицу
+    planner = FetchPlanner(**(fetch_options or {}))
+    satellite_cache = SatelliteCache(fetch=planner.fetch, fetch_stations=planner.fetch_stations) \
+        if use_cache else None
+    satellite_frames = {}
+    for satellite, manager in job_managers(job).items():
+        if satellite_cache is not None:
+            satellite_frames[satellite] = satellite_cache.get_dataframe(manager, job['coordinates'], date_start,
+                                                                        date_end)
+        else:
+            satellite_frames[satellite] = planner.fetch(manager, job['coordinates'], date_start, date_end)
+    return planner, satellite_frames
+
+
+def job_exporter(job, job_dir):
+    # Дополнительные форматы пар: "export": ["parquet", "excel"], "compression": "gzip" (для CSV)
+    return TableExporter(job_dir, job.get('compression'), stamp=False)
+
+
+def save_run(job, job_dir, label, run, df, matches, date_start, date_end, exporter):
+    # Пары, график и PDF прогона
+    satellite, product, time_of_day, time_interval_minutes = normalize_run(job, run)
+    display_frame = matches.display_frame()
+    display_frame.to_csv(os.path.join(job_dir, f'matches_{label}.csv'), index=False)
+    export_formats = job.get('export', [])
+    for export_format in [export_formats] if isinstance(export_formats, str) else export_formats:
+        exporter.export(display_frame, f'matches_{label}', export_format)
+    plot_path = os.path.join(job_dir, f'plot_{label}.png')
+    plot_data(satellite, matches, time_interval_minutes, product, time_of_day, save_path=plot_path, show=False,
+              headless=True)
+    create_pdf_report(df, matches, satellite, date_start, date_end, job['coordinates'], time_interval_minutes,
+                      product, time_of_day, pdf_file_name=os.path.join(job_dir, f'report_{label}.pdf'),
+                      graphics_dir=job_dir, plot_images=[plot_path])
+
+
+def save_rejected(job_dir, rejected):
+    # Строки наземного файла, которые не вошли в ряд: номер строки, исходные ячейки, причина
+    if len(rejected):
+        rejected.to_csv(os.path.join(job_dir, 'rejected_rows.csv'), index=False)
+
+
+def save_job_tables(job_dir, stats, filter_reports, planner, exporter):
+    stats.table(['satellite', 'platform', 'time_of_day', 'month']).to_csv(
+        os.path.join(job_dir, 'metrics_monthly.csv'), index=False)
+    if filter_reports:
+        pd.concat(filter_reports, ignore_index=True).to_csv(os.path.join(job_dir, 'filters.csv'), index=False)
+    if planner.timings:
+        planner.timing_table().to_csv(os.path.join(job_dir, 'fetch_timings.csv'), index=False)
+    if exporter.records:
+        exporter.timing_table().to_csv(os.path.join(job_dir, 'exports.csv'), index=False)
+
+
+# Ключи задания, которым нужен весь наземный ряд в памяти
+IN_MEMORY_OPTIONS = ('sweep', 'target', 'window_value', 'min_valid_fraction', 'max_window_std')
+
+
+def run_streaming_job(job, output_dir, use_cache=True, fetch_options=None):
+    # Многолетние высокочастотные ряды: наземный файл читается частями (StreamingMatcher),
+    # все прогоны задания сопоставляются за один проход по ряду, память не растёт с длиной записи
+    unsupported = [option for option in IN_MEMORY_OPTIONS
+                   if job.get(option) or any(run.get(option) for run in job['runs'])]
+    if unsupported:
+        raise ValueError(f"Streaming jobs do not support {unsupported}; remove them or 'stream'.")
+    job_dir = os.path.join(output_dir, job['name'])
+    os.makedirs(job_dir, exist_ok=True)
+
+    matcher = StreamingMatcher.from_file(job['file'], job.get('chunk_rows', GROUND_CHUNK_ROWS),
+                                         ground_filter_chain=ground_filters(**job.get('ground_filters', {})),
+                                         match_filter_chain=match_filters(**job.get('match_filters', {})))
+    matcher.prepare()
+    if not matcher.rows:
+        raise ValueError(f"Could not read ground data from {job['file']}")
+    print_rejected(matcher.rejected)
+    save_rejected(job_dir, matcher.rejected)
+    date_start = matcher.date_start.strftime('%Y-%m-%d')
+    date_end = matcher.date_end.strftime('%Y-%m-%d')
+    planner, satellite_frames = fetch_satellite_frames(job, date_start, date_end, use_cache, fetch_options)
+    exporter = job_exporter(job, job_dir)
+
+    runs = [normalize_run(job, run) for run in job['runs']]
+    results = matcher.match_runs([(satellite_frames[satellite], satellite, product, time_of_day, tolerance)
+                                  for satellite, product, time_of_day, tolerance in runs])
+    metrics = []
+    stats = GroupedStats()
+    filter_reports = [matcher.ground_report.assign(run='ground')]
+    for run, (satellite, product, time_of_day, tolerance), (matches, match_report) in zip(job['runs'], runs, results):
+        label = run_label(satellite, product, time_of_day)
+        filter_reports.append(match_report.assign(run=label))
+        metrics.append({'station': job['name'], 'run': label, 'tolerance': tolerance, **match_statistics(matches)})
+        stats.update(matches, station=job['name'])
+        save_run(job, job_dir, label, run, satellite_frames[satellite], matches, date_start, date_end, exporter)
+
+    pd.DataFrame(metrics).to_csv(os.path.join(job_dir, 'metrics.csv'), index=False)
+    save_job_tables(job_dir, stats, filter_reports, planner, exporter)
+    return metrics, stats
+
+
+def _run_job_safe(job, output_dir, use_cache=True, fetch_options=None, trace=False, store_path=None,
+                  incremental=False):
+    # Рабочий процесс возвращает аккумуляторы, а не пары: сводка по всем станциям не держит их в памяти;
+    # при трассировке - ещё участки задания (трасса задания сохраняется в trace.json)
+    tracer = tracing.enable(trace == 'memory', job=job['name']) if trace else None
+    try:
+        with tracing.span('job', job=job['name']):
+            metrics, stats = run_job(job, output_dir, use_cache, fetch_options, store_path, incremental)
+        result = job['name'], metrics, stats, None
+    except Exception:
+        result = job['name'], [], None, traceback.format_exc()
+    if tracer is None:
+        return result + ([],)
+    tracing.disable()
+    tracer.export(os.path.join(output_dir, job['name'], 'trace.json'))
+    return result + (tracer.spans,)
+
+
+def run_batch(jobs, output_dir, workers=None, project=EE_PROJECT, use_cache=True, prefetch=False,
+              fetch_options=None, backend=None, recordings=None, trace=False, store_path=None, incremental=False):
+    os.makedirs(output_dir, exist_ok=True)
+    _init_worker(project, backend, recordings)
+    if prefetch and use_cache:
+        prefetch_stations(jobs, project, fetch_options)
+    summary = []
+    stats = GroupedStats()
+    failures = {}
+    spans = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(project, backend, recordings)) as executor:
+        futures = [executor.submit(_run_job_safe, job, output_dir, use_cache, fetch_options, trace, store_path,
+                                   incremental) for job in jobs]
+        for future in as_completed(futures):
+            name, metrics, job_stats, error, job_spans = future.result()
+            spans.extend(job_spans)
+            if error:
+                failures[name] = error
+                print(f"[{name}] ошибка:\n{error}")
+            else:
+                summary.extend(metrics)
+                stats.merge(job_stats)
+                print(f"[{name}] готово, прогонов: {len(metrics)}")
+
+    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    summary_path = os.path.join(output_dir, f'summary_{current_time}.csv')
+    pd.DataFrame(summary).to_csv(summary_path, index=False)
+    print(f"Summary saved to {summary_path}")
+    # Метрики по всем станциям: по платформе и времени суток, по сезонам
+    stats.table(['satellite', 'platform', 'time_of_day']).to_csv(
+        os.path.join(output_dir, f'metrics_{current_time}.csv'), index=False)
+    stats.table(['satellite', 'platform', 'time_of_day', 'season']).to_csv(
+        os.path.join(output_dir, f'metrics_seasonal_{current_time}.csv'), index=False)
+    if trace:
+        # Где прошло время всех заданий: шаги по суммарному времени
+        trace_summary = tracing.summarize(spans)
+        trace_summary.to_csv(os.path.join(output_dir, f'trace_summary_{current_time}.csv'), index=False)
+        print(trace_summary.to_string(index=False))
+    return summary, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная валидация наземных станций без диалогов")
+    parser.add_argument('job_file', help="JSON-файл с заданиями")
+    parser.add_argument('--output', help="Папка результатов (по умолчанию из файла заданий или Batch)")
+    parser.add_argument('--workers', type=int, default=None, help="Число процессов")
+    parser.add_argument('--project', default=EE_PROJECT, help="Проект Earth Engine")
+    parser.add_argument('--no-cache', action='store_true', help="Не использовать локальный кэш спутниковых данных")
+    parser.add_argument('--prefetch', action='store_true',
+                        help="Заранее загрузить все станции одним запросом на продукт")
+    parser.add_argument('--window-elements', type=int, default=MAX_ELEMENTS,
+                        help="Максимум строк в одном запросе getInfo")
+    parser.add_argument('--fetch-threads', type=int, default=4, help="Параллельных запросов на процесс")
+    parser.add_argument('--backend', choices=BACKENDS, default=None,
+                        help="Источник данных Earth Engine: live, record (запись ответов), replay "
+                             "(воспроизведение записей), synthetic (без сети)")
+    parser.add_argument('--recordings', default=None, help="Папка записанных ответов Earth Engine")
+    parser.add_argument('--trace', nargs='?', const='memory', choices=tracing.TRACE_MODES,
+                        help="Записать время, строки, размер ответов и пик памяти шагов (trace.json заданий); "
+                             "time - без памяти")
+    parser.add_argument('--full-bands', action='store_true',
+                        help="Запрашивать все колонки спутниковых таблиц, а не только нужные сопоставлению")
+    parser.add_argument('--store', nargs='?', const=STORE_PATH, default=None,
+                        help="Сохранять пары и метрики в хранилище результатов SQLite")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Сопоставлять только наземные данные, появившиеся после прошлого запуска (нужен --store)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Читать наземные файлы частями: память не растёт с длиной многолетних рядов")
+    parser.add_argument('--chunk-rows', type=int, default=GROUND_CHUNK_ROWS,
+                        help="Строк наземного файла в одной части (--stream)")
+    parser.add_argument('--export', nargs='+', choices=EXPORT_FORMATS, default=None,
+                        help="Дополнительно сохранить пары прогонов в этих форматах (parquet, feather, excel, csv)")
+    parser.add_argument('--compression', choices=list(CSV_COMPRESSION), default=None,
+                        help="Сжатие CSV-выгрузок --export")
+    args = parser.parse_args()
+    if args.incremental and not args.store:
+        args.store = STORE_PATH
+
+    output_dir, jobs = load_jobs(args.job_file)
+    if args.full_bands:
+        jobs = [{**job, 'bands': FULL_BANDS} for job in jobs]
+    if args.export:
+        jobs = [{**job, 'export': args.export, 'compression': job.get('compression', args.compression)}
+                for job in jobs]
+    if args.stream:
+        jobs = [{**job, 'stream': True, 'chunk_rows': job.get('chunk_rows', args.chunk_rows)} for job in jobs]
+    summary, failures = run_batch(jobs, args.output or output_dir, args.workers, args.project,
+                                   use_cache=not args.no_cache, prefetch=args.prefetch,
+                                   fetch_options={'max_elements': args.window_elements,
+                                                  'max_workers': args.fetch_threads},
+                                   backend=args.backend, recordings=args.recordings,
+                                   trace=tracing.trace_mode(args.trace), store_path=args.store,
+                                   incremental=args.incremental)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
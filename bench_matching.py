@@ -0,0 +1,99 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from common_dates import match_nearest
+
+
+def make_ground_data(years, step_minutes=10, seed=0):
+    rng = np.random.default_rng(seed)
+    periods = int(years * 365 * 24 * 60 / step_minutes)
+    times = pd.date_range('2020-01-01', periods=periods, freq=f'{step_minutes}min')
+    hours = times.hour.to_numpy() + times.minute.to_numpy() / 60
+    values = 15 + 10 * np.sin((hours - 9) / 24 * 2 * np.pi) + rng.normal(0, 1.5, periods)
+    return pd.DataFrame({'value': np.round(values, 1), 'datetime': times})
+
+
+def make_satellite_data(years, seed=1):
+    # Таблица в формате MODIS: дата и время пролёта строками
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2020-01-01', periods=int(years * 365), freq='D')
+    view_hours = rng.uniform(12.5, 14.5, len(days))
+    view_times = [f'{int(h):02d}:{int((h - int(h)) * 60):02d}:00' for h in view_hours]
+    values = 25 + rng.normal(0, 3, len(days))
+    return pd.DataFrame({
+        'date': days.strftime('%Y-%m-%d'),
+        'Day_view_time': view_times,
+        'LST_Day_1km': [f'{v:6.2f}' for v in values],
+    })
+
+
+def legacy_match(satellite_df, excel_data, time_interval_minutes=None):
+    # Прежний путь: iterrows + strptime + argsort по всей наземной таблице на каждый пролёт
+    matches = []
+    for _, row in satellite_df.iterrows():
+        satellite_datetime = datetime.strptime(row['date'] + ' ' + row['Day_view_time'], '%Y-%m-%d %H:%M:%S')
+        matching_rows = excel_data.iloc[(excel_data['datetime'] - satellite_datetime).abs().argsort()[:1]]
+        for _, match_row in matching_rows.iterrows():
+            ground_datetime = match_row['datetime']
+            if time_interval_minutes is None or \
+                    abs(ground_datetime - satellite_datetime) <= timedelta(minutes=time_interval_minutes):
+                matches.append((satellite_datetime, float(row['LST_Day_1km']),
+                                ground_datetime, float(match_row['value'])))
+    return matches
+
+
+def vectorized_match(satellite_df, excel_data, time_interval_minutes=None):
+    satellite = pd.DataFrame({
+        'datetime': pd.to_datetime(satellite_df['date'] + ' ' + satellite_df['Day_view_time'],
+                                   format='%Y-%m-%d %H:%M:%S'),
+        'value': pd.to_numeric(satellite_df['LST_Day_1km'], errors='coerce')
+    })
+    paired = match_nearest(satellite, excel_data, time_interval_minutes)
+    return list(zip(paired['datetime'], paired['value'], paired['ground_datetime'], paired['ground_value']))
+
+
+def timed(func, *args, repeat=1):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение прежнего и векторного сопоставления по времени")
+    parser.add_argument('--years', type=float, default=1.0)
+    parser.add_argument('--step', type=int, default=10, help="Шаг наземного логгера, минуты")
+    parser.add_argument('--tolerance', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    ground = make_ground_data(args.years, args.step)
+    satellite = make_satellite_data(args.years)
+    print(f"Ground rows: {len(ground)}, overpasses: {len(satellite)}, tolerance: {args.tolerance} min")
+
+    new_time, new_matches = timed(vectorized_match, satellite, ground, args.tolerance, repeat=args.repeat)
+    print(f"merge_asof: {new_time:.4f} s, matches: {len(new_matches)}")
+
+    if not args.skip_legacy:
+        old_time, old_matches = timed(legacy_match, satellite, ground, args.tolerance)
+        print(f"legacy:     {old_time:.4f} s, matches: {len(old_matches)}")
+        print(f"speedup:    {old_time / new_time:.1f}x")
+        # При равноудалённых наземных отсчётах прежний argsort выбирал любой из двух,
+        # поэтому сравниваем модуль разницы во времени, а не сам наземный отсчёт
+        same = len(old_matches) == len(new_matches) and all(
+            o[0] == n[0] and abs(o[2] - o[0]) == abs(n[2] - n[0]) and np.isclose(o[1], n[1])
+            for o, n in zip(old_matches, new_matches))
+        print(f"equivalent: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Модули, которые не должны загружаться при старте main.py
+HEAVY_MODULES = ['ee', 'geemap', 'matplotlib', 'scipy', 'reportlab', 'pandas', 'numpy', 'tkinter']
+# Модули отдельных шагов: время их импорта показывает, сколько стоит каждый шаг
+STAGE_MODULES = ['excel_manager', 'satellite_cache', 'fetch_planner', 'modis_data', 'common_dates', 'plot_data',
+                 'report', 'map_viewer']
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_python(code):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return elapsed, result.stdout.strip()
+
+
+def median_time(code, repeat):
+    return statistics.median(run_python(code)[0] for _ in range(repeat))
+
+
+def loaded_heavy_modules(module):
+    code = (f"import sys, {module}; "
+            f"print(' '.join(m for m in {HEAVY_MODULES!r} "
+            f"if m in sys.modules and getattr(sys.modules[m], '__spec__', None) is not None "
+            f"and type(sys.modules[m]).__name__ != '_LazyModule'))")
+    return run_python(code)[1].split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время запуска main.py и импорта модулей по шагам")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.3,
+                        help="Допустимое время импорта main сверх пустого интерпретатора, с")
+    parser.add_argument('--stages', action='store_true', help="Показать время импорта модулей шагов")
+    args = parser.parse_args()
+
+    baseline = median_time('pass', args.repeat)
+    startup = median_time('import main', args.repeat)
+    overhead = startup - baseline
+    print(f"interpreter: {baseline:.3f} s, import main: {startup:.3f} s, overhead: {overhead:.3f} s")
+
+    heavy = loaded_heavy_modules('main')
+    print(f"heavy modules loaded at startup: {', '.join(heavy) if heavy else 'none'}")
+
+    if args.stages:
+        for module in STAGE_MODULES:
+            try:
+                elapsed = median_time(f'import {module}', args.repeat) - baseline
+                print(f"  {module:<16} {elapsed:.3f} s")
+            except RuntimeError as e:
+                print(f"  {module:<16} failed: {str(e).splitlines()[-1]}")
+
+    if heavy or overhead > args.budget:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,100 @@
-import ee
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from collections import defaultdict
-import matplotlib.pyplot as plt
+from ground_aggregates import GROUND_TARGETS, GroundAggregates
+from match_table import MatchTable
+from outlier_filters import ground_filters, match_filters
+from rsme_mbe import calculate_rmse_mbe
+from tracing import span
+
+MODIS_COMBINATIONS = [('aqua', 'day'), ('aqua', 'night'), ('terra', 'day'), ('terra', 'night')]
+MODIS_COLUMNS = {'day': ('LST_Day_1km', 'Day_view_time'), 'night': ('LST_Night_1km', 'Night_view_time')}
+# Значение спутника в режиме окрестности: центральный пиксель или среднее окна
+WINDOW_VALUES = ('center', 'mean')
+
+
+def required_columns(satellite, time_of_day=None):
+    # Колонки спутниковой таблицы, которые нужны сопоставлению (для проекции в менеджерах);
+    # без времени суток - дневные и ночные
+    if satellite == 'modis':
+        times = [time_of_day] if time_of_day else list(MODIS_COLUMNS)
+        return [column for time in times for column in MODIS_COLUMNS[time]]
+    if satellite == 'landsat':
+        return ['ST_B10']
+    raise ValueError("Invalid satellite_name. Please select 'modis' or 'landsat'.")
+
+
+def match_nearest(satellite, ground, time_interval_minutes=None, keep=()):
+    # Сопоставление каждого пролёта с ближайшим наземным измерением за один проход
+    # по отсортированным рядам (merge_asof) вместо полного перебора наземной таблицы.
+    # Ключи merge_asof должны совпадать по разрешению (pandas может отдавать us и ns);
+    # keep - дополнительные колонки пролётов (метки миссии), переносятся в пары
+    left = satellite[['datetime', 'value', *keep]].dropna(subset=['datetime'])
+    left = left.assign(datetime=left['datetime'].astype('datetime64[ns]'))
+    left = left.sort_values('datetime', kind='mergesort')
+    right = ground[['datetime', 'value']].dropna(subset=['datetime'])
+    right = right.assign(datetime=right['datetime'].astype('datetime64[ns]'))
+    right = right.rename(columns={'datetime': 'ground_datetime', 'value': 'ground_value'})
+    if not right['ground_datetime'].is_monotonic_increasing:
+        right = right.sort_values('ground_datetime', kind='mergesort')
+
+    tolerance = None
+    if time_interval_minutes is not None:
+        tolerance = pd.Timedelta(minutes=time_interval_minutes)
+
+    paired = pd.merge_asof(left, right, left_on='datetime', right_on='ground_datetime',
+                           direction='nearest', tolerance=tolerance)
+    return paired.dropna(subset=['ground_datetime']).reset_index(drop=True)
+
+
+def tolerance_sweep(satellite, ground, tolerances):
+    # Ближайший наземный отсчёт для каждого пролёта ищется один раз, пары сортируются по |dt|;
+    # метрики для любого допуска берутся из накопленных сумм по первым k парам
+    paired = match_nearest(satellite, ground)
+    delta = ((paired['ground_datetime'] - paired['datetime']).abs() / pd.Timedelta(minutes=1)).to_numpy()
+    errors = (paired['value'] - paired['ground_value']).to_numpy(dtype=np.float64)
+    order = np.argsort(delta, kind='mergesort')
+    delta, errors = delta[order], errors[order]
+    cumulative = {
+        'error': np.concatenate([[0.0], np.cumsum(errors)]),
+        'abs_error': np.concatenate([[0.0], np.cumsum(np.abs(errors))]),
+        'sq_error': np.concatenate([[0.0], np.cumsum(errors ** 2)]),
+    }
+
+    tolerances = np.sort(np.asarray(tolerances, dtype=np.float64))
+    # merge_asof включает границу допуска, поэтому side='right'
+    counts = np.searchsorted(delta, tolerances, side='right')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            'tolerance': tolerances,
+            'matches': counts,
+            'rmse': np.sqrt(cumulative['sq_error'][counts] / counts),
+            'mbe': cumulative['error'][counts] / counts,
+            'mae': cumulative['abs_error'][counts] / counts,
+        })
+
 
 class CommonDates:
-    def __init__(self, df, excel_data, satellite, satellite_product=None, time_of_day=None):
+    def __init__(self, df, excel_data, satellite, satellite_product=None, time_of_day=None, ground_prepared=False,
+                 ground_filter_chain=None, match_filter_chain=None, window_value='center', min_valid_fraction=None,
+                 max_window_std=None):
+        self.df = df
         self.excel_data = excel_data
         self.satellite_name = satellite
         self.satellite_product = satellite_product
         self.time_of_day = time_of_day
+        self.ground_prepared = ground_prepared
+        self.aggregates = None
+        self.ground_filter_chain = ground_filter_chain or ground_filters()
+        self.match_filter_chain = match_filter_chain or match_filters()
+        self.ground_report = None
+        self.match_report = None
+        # Таблица менеджера с окрестностью (neighborhood): пролёты с малой долей валидных пикселей
+        # или неоднородным окном отбрасываются, значением может служить среднее окна
+        if window_value not in WINDOW_VALUES:
+            raise ValueError(f"Invalid window_value {window_value!r}. Please select 'center' or 'mean'.")
+        self.window_value = window_value
+        self.min_valid_fraction = min_valid_fraction
+        self.max_window_std = max_window_std
 
         if satellite == 'modis':
             if satellite_product == 'aqua':
@@ -27,8 +111,18 @@ class CommonDates:
         else:
             raise ValueError("Invalid satellite_name. Please select 'modis' or 'landsat'.")
 
+        # Статистики окна канала (satellite_data.window_statistics) нужны только в режиме окрестности
+        valid_fraction_column = f'{self.satellite_column}_valid_fraction'
+        window_std_column = f'{self.satellite_column}_std'
+        window_columns = []
+        if valid_fraction_column in df.columns or window_value == 'mean' or min_valid_fraction is not None \
+                or max_window_std is not None:
+            window_columns = [valid_fraction_column, window_std_column]
+        if window_value == 'mean':
+            self.satellite_column = f'{self.satellite_column}_mean'
+
         # Проверка наличия необходимых колонок
-        required_columns = ['date', self.satellite_column]
+        required_columns = ['date', self.satellite_column, *window_columns]
         if self.view_time_column:
             required_columns.append(self.view_time_column)
 
@@ -36,128 +130,197 @@ class CommonDates:
         if missing_columns:
             raise KeyError(f"One or more columns {missing_columns} are missing from the DataFrame")
 
+        # Общая таблица MODIS (Landsat 8/9) содержит несколько платформ: оставляем строки выбранной
+        if satellite_product and 'platform' in df.columns:
+            df = df[df['platform'] == satellite_product]
+
+        if self.view_time_column:
+            self.selected_column = df[['date', self.satellite_column, self.view_time_column, *window_columns]]
+        else:
+            self.selected_column = df[['date', self.satellite_column, *window_columns]]
+        if window_columns:
+            # Центральный пиксель окна может быть маскирован, хотя соседние валидны
+            keep = self.selected_column[self.satellite_column].notna()
+            if min_valid_fraction is not None:
+                keep &= self.selected_column[valid_fraction_column] >= min_valid_fraction
+            if max_window_std is not None:
+                keep &= self.selected_column[window_std_column] <= max_window_std
+            self.selected_column = self.selected_column[keep]
+
+    def for_satellite(self, df, satellite, satellite_product=None, time_of_day=None):
+        # Новая комбинация спутник/продукт/время суток с уже очищенными наземными данными
+        self.prepare_ground()
+        common_dates = CommonDates(df, self.excel_data, satellite, satellite_product, time_of_day,
+                                   ground_prepared=True, ground_filter_chain=self.ground_filter_chain,
+                                   match_filter_chain=self.match_filter_chain, window_value=self.window_value,
+                                   min_valid_fraction=self.min_valid_fraction, max_window_std=self.max_window_std)
+        common_dates.aggregates = self.ground_aggregates()
+        common_dates.ground_report = self.ground_report
+        return common_dates
+
+    def _parse_dates(self):
+        # Менеджеры отдают готовые datetime64: момент пролёта MODIS в колонке времени обзора,
+        # дату и время съёмки Landsat в колонке date
         if self.view_time_column:
-            self.selected_column = df[['date', self.satellite_column, self.view_time_column]]
+            return pd.to_datetime(self.selected_column[self.view_time_column], errors='coerce')
+        return pd.to_datetime(self.selected_column['date'], errors='coerce')
+
+    def _satellite_frame(self):
+        satellite = pd.DataFrame({
+            'datetime': self._parse_dates(),
+            # float32 из менеджера -> float64 с прежней точностью в два знака
+            'value': pd.to_numeric(self.selected_column[self.satellite_column], errors='coerce')
+            .astype('float64').round(2)
+        })
+        return satellite.dropna(subset=['datetime'])
+
+    def ground_aggregates(self):
+        # Часовые, суточные агрегаты и суточный ход очищенного ряда, общие для всех комбинаций
+        if self.aggregates is None:
+            self.aggregates = GroundAggregates(self.prepare_ground())
+        return self.aggregates
+
+    def prepare_ground(self):
+        if self.ground_prepared:
+            return self.excel_data
+
+        # Фильтры работают по отсортированному ряду: шаг между соседними отсчётами имеет смысл
+        # только во времени. Строки отбираются масками, дубликаты значений не теряются
+        excel_data = self.excel_data.sort_values('datetime', kind='mergesort')
+        self.excel_data, self.ground_report = self.ground_filter_chain.apply(excel_data)
+        self.ground_prepared = True
+        return self.excel_data
+
+    def sweep_tolerances(self, tolerances):
+        # Пары до фильтрации выбросов: пороги сигма-фильтров зависят от набора пар
+        self.prepare_ground()
+        return tolerance_sweep(self._satellite_frame(), self.excel_data, tolerances)
+
+    def match_data(self, time_interval_minutes=None, target='instant', statistic='mean'):
+        # target: instant - ближайшее наземное измерение, hourly/daily/window - агрегат наземного ряда
+        # (statistic: mean, min, max) для суточных продуктов вроде MOD11A1
+        if target not in GROUND_TARGETS:
+            raise ValueError(f"Invalid target {target!r}. Please select one of {', '.join(GROUND_TARGETS)}.")
+        with span('match_data', satellite=self.satellite_name, product=self.satellite_product,
+                  time_of_day=self.time_of_day, target=target) as s:
+            self.prepare_ground()
+            aggregates = self.ground_aggregates()
+
+            if target == 'instant':
+                paired = match_nearest(self._satellite_frame(), self.excel_data, time_interval_minutes)
+            else:
+                paired = aggregates.pair(self._satellite_frame(), target, time_interval_minutes, statistic)
+
+            # Выбросы удаляются парами, чтобы спутниковое и наземное значения не разъединялись
+            paired['abs_difference'] = (paired['value'] - paired['ground_value']).abs()
+            paired, self.match_report = self.match_filter_chain.apply(paired)
+
+            matches = MatchTable.from_paired(paired, self.satellite_name, self.satellite_product, self.time_of_day)
+            s.set(rows=len(matches))
+            return matches, aggregates.daily
+
+
+def match_modis_all(df, excel_data, time_interval_minutes=None, target='instant', window_value='center',
+                    min_valid_fraction=None):
+    # Все комбинации Aqua/Terra x Day/Night из одной таблицы ModisDataManager;
+    # очистка наземных данных и сортировка выполняются один раз
+    platforms = set(df['platform'].astype(str)) if 'platform' in df.columns else set()
+    prepared = None
+    results = {}
+    comparison = []
+    for satellite_product, time_of_day in MODIS_COMBINATIONS:
+        if satellite_product not in platforms:
+            continue
+        if prepared is None:
+            prepared = CommonDates(df, excel_data, 'modis', satellite_product, time_of_day,
+                                   window_value=window_value, min_valid_fraction=min_valid_fraction)
+            common_dates = prepared
         else:
-            self.selected_column = df[['date', self.satellite_column]]
+            common_dates = prepared.for_satellite(df, 'modis', satellite_product, time_of_day)
+        matches, daily_averages = common_dates.match_data(time_interval_minutes, target)
+        results[(satellite_product, time_of_day)] = matches
+        rmse, mbe = calculate_rmse_mbe(matches) if matches else (np.nan, np.nan)
+        comparison.append({'Platform': satellite_product.capitalize(), 'Time of Day': time_of_day.capitalize(),
+                           'Matches': len(matches), 'RMSE': rmse, 'MBE': mbe})
+    return results, pd.DataFrame(comparison)
+
 
-    def _parse_date(self, date_string, time_string):
-        if time_string:
-            return datetime.strptime(date_string + ' ' + time_string, '%Y-%m-%d %H:%M:%S')
+def sweep_modis_all(df, excel_data, tolerances):
+    # Кривые допуска для всех комбинаций Aqua/Terra x Day/Night из одной таблицы
+    platforms = set(df['platform'].astype(str)) if 'platform' in df.columns else set()
+    prepared = None
+    tables = []
+    for satellite_product, time_of_day in MODIS_COMBINATIONS:
+        if satellite_product not in platforms:
+            continue
+        if prepared is None:
+            prepared = CommonDates(df, excel_data, 'modis', satellite_product, time_of_day)
+            common_dates = prepared
         else:
-            return datetime.strptime(date_string, '%Y-%m-%d %H:%M:%S')
-
-    def _find_matching_rows(self, satellite_datetime):
-        matching_rows = self.excel_data.iloc[(self.excel_data['datetime'] - satellite_datetime).abs().argsort()[:1]]
-        return matching_rows
-
-    def _calculate_daily_average(self):
-        daily_averages = defaultdict(list)
-        for index, row in self.excel_data.iterrows():
-            date = row['datetime'].date()
-            daily_averages[date].append(row['value'])
-        for date, values in daily_averages.items():
-            daily_averages[date] = sum(values) / len(values)
-        return daily_averages
-
-    def _remove_outliers(self, data):
-        mean = np.mean(data)
-        std_dev = np.std(data)
-        filtered_data = [x for x in data if (mean - 3 * std_dev) <= x <= (mean + 3 * std_dev)]
-        return filtered_data
-
-    def _remove_obvious_outliers(self, data):
-        filtered_data = [x for x in data if 0 <= x <= 50]  # Допустимый диапазон температур
-        filtered_data = [filtered_data[i] for i in range(len(filtered_data) - 1) if
-                         abs(filtered_data[i] - filtered_data[i + 1]) <= 10]
-        return filtered_data
-
-    def _remove_matches_outliers(self, matches):
-        values = [float(match['value']) for match in matches]
-        mean = np.mean(values)
-        std_dev = np.std(values)
-        cleaned_matches = [match for match in matches if
-                           (mean - 3 * std_dev) <= float(match['value']) <= (mean + 3 * std_dev)]
-        return cleaned_matches
-
-    def _remove_matches_based_on_difference(self, matches):
-        differences = []
-        for i in range(0, len(matches), 2):
-            diff = abs(float(matches[i]['value']) - float(matches[i + 1]['value']))
-            differences.append(diff)
-
-        std_dev = np.std(differences)
-        threshold = 3 * std_dev
-
-        cleaned_matches = []
-        for i in range(0, len(matches), 2):
-            if abs(float(matches[i]['value']) - float(matches[i + 1]['value'])) <= threshold:
-                cleaned_matches.extend([matches[i], matches[i + 1]])
-
-        return cleaned_matches
-
-    def match_data(self, time_interval_minutes=None):
-        matches = []
-
-        # Сначала удаляем явные выбросы
-        cleaned_values = self._remove_obvious_outliers(self.excel_data['value'].tolist())
-        removed_values = set(self.excel_data['value']) - set(cleaned_values)
-        self.excel_data = self.excel_data[self.excel_data['value'].isin(cleaned_values)]
-
-        # Затем применяем стандартное удаление выбросов через 3 сигмы
-        cleaned_values = self._remove_outliers(self.excel_data['value'].tolist())
-        removed_values = set(self.excel_data['value']) - set(cleaned_values)
-        self.excel_data = self.excel_data[self.excel_data['value'].isin(cleaned_values)]
-
-        daily_averages = self._calculate_daily_average()
-
-        for index, row in self.selected_column.iterrows():
-            satellite_date = row['date']
-            satellite_time = None
-            if self.view_time_column:
-                satellite_time = row[self.view_time_column]
-            satellite_datetime = self._parse_date(satellite_date, satellite_time)
-            matching_rows = self._find_matching_rows(satellite_datetime)
-
-            if matching_rows.empty:
-                continue
-
-            for _, match_row in matching_rows.iterrows():
-                ground_datetime = match_row['datetime']
-                if time_interval_minutes is not None:
-                    time_diff = abs(ground_datetime - satellite_datetime)
-                    if time_diff <= timedelta(minutes=time_interval_minutes):
-                        if self.satellite_product:
-                            satellite_product_str = self.satellite_product.capitalize()
-                        else:
-                            satellite_product_str = ''
-                        if self.time_of_day:
-                            time_of_day_str = self.time_of_day.capitalize()
-                        else:
-                            time_of_day_str = ''
-                        source = f'Satellite - {self.satellite_name} {satellite_product_str} {time_of_day_str}'
-                        value = row[self.satellite_column]
-                        matches.append({'source': source, 'datetime': satellite_datetime, 'value': float(value)})
-                        matches.append({'source': 'Ground', 'datetime': ground_datetime, 'value': float(match_row['value'])})
-                else:
-                    if self.satellite_product:
-                        satellite_product_str = self.satellite_product.capitalize()
-                    else:
-                        satellite_product_str = ''
-                    if self.time_of_day:
-                        time_of_day_str = self.time_of_day.capitalize()
-                    else:
-                        time_of_day_str = ''
-                    source = f'Satellite - {self.satellite_name} {satellite_product_str} {time_of_day_str}'
-                    value = row[self.satellite_column]
-                    matches.append({'source': source, 'datetime': satellite_datetime, 'value': float(value)})
-                    matches.append({'source': 'Ground', 'datetime': ground_datetime, 'value': float(match_row['value'])})
-
-        # Удаление выбросов из matches
-        matches = self._remove_matches_outliers(matches)
-
-        # Удаление выбросов на основе разницы значений
-        matches = self._remove_matches_based_on_difference(matches)
-
-        return matches, daily_averages
+            common_dates = prepared.for_satellite(df, 'modis', satellite_product, time_of_day)
+        table = common_dates.sweep_tolerances(tolerances)
+        table.insert(0, 'Time of Day', time_of_day.capitalize())
+        table.insert(0, 'Platform', satellite_product.capitalize())
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+
+def match_missions(tagged, excel_data, tolerances=None, target='instant', ground_filter_chain=None,
+                   match_filter_chain=None, window_value='center', min_valid_fraction=None, max_window_std=None):
+    # Таблица mission_fetch.tag_missions (колонки satellite и platform): пролёты всех миссий и времени суток
+    # сопоставляются одним merge_asof, допуск - свой для каждого спутника ({'modis': 30, 'landsat': None});
+    # выбросы удаляются отдельно в каждой комбинации, как в match_data
+    if target not in GROUND_TARGETS:
+        raise ValueError(f"Invalid target {target!r}. Please select one of {', '.join(GROUND_TARGETS)}.")
+    tolerances = tolerances or {}
+    prepared = None
+    frames = []
+    combinations = []
+    for (satellite, platform), rows in tagged.groupby(['satellite', 'platform'], sort=True, observed=True):
+        for time_of_day in (['day', 'night'] if satellite == 'modis' else [None]):
+            if prepared is None:
+                prepared = CommonDates(rows, excel_data, satellite, platform, time_of_day,
+                                       ground_filter_chain=ground_filter_chain,
+                                       match_filter_chain=match_filter_chain, window_value=window_value,
+                                       min_valid_fraction=min_valid_fraction, max_window_std=max_window_std)
+                common_dates = prepared
+            else:
+                common_dates = prepared.for_satellite(rows, satellite, platform, time_of_day)
+            tolerance = tolerances.get(satellite)
+            combinations.append((satellite, platform, time_of_day or ''))
+            frames.append(common_dates._satellite_frame().assign(
+                satellite=satellite, platform=platform, time_of_day=time_of_day or '',
+                tolerance=np.inf if tolerance is None else float(tolerance)))
+    if prepared is None:
+        return {}, pd.DataFrame(columns=['Satellite', 'Platform', 'Time of Day', 'Matches', 'RMSE', 'MBE'])
+
+    tags = ['satellite', 'platform', 'time_of_day']
+    if target == 'instant':
+        with span('match_missions.merge', rows=sum(len(frame) for frame in frames)):
+            paired = match_nearest(pd.concat(frames, ignore_index=True), prepared.prepare_ground(),
+                                   keep=tags + ['tolerance'])
+        delta = (paired['ground_datetime'] - paired['datetime']).abs() / pd.Timedelta(minutes=1)
+        paired = paired[delta.to_numpy() <= paired['tolerance'].to_numpy()]
+    else:
+        # Агрегаты наземного ряда общие, пары - для каждой комбинации со своим допуском
+        aggregates = prepared.ground_aggregates()
+        paired = pd.concat([
+            aggregates.pair(frame, target, tolerances.get(satellite)).assign(
+                satellite=satellite, platform=platform, time_of_day=time_of_day)
+            for frame, (satellite, platform, time_of_day) in zip(frames, combinations)], ignore_index=True)
+    paired = paired.assign(abs_difference=(paired['value'] - paired['ground_value']).abs())
 
+    chain = prepared.match_filter_chain
+    results = {}
+    comparison = []
+    groups = paired.groupby(tags, sort=False).indices
+    for satellite, platform, time_of_day in combinations:
+        rows = groups.get((satellite, platform, time_of_day), [])
+        group, report = chain.apply(paired.iloc[rows].reset_index(drop=True))
+        matches = MatchTable.from_paired(group, satellite, platform, time_of_day or None)
+        results[(satellite, platform, time_of_day or None)] = matches
+        rmse, mbe = calculate_rmse_mbe(matches) if matches else (np.nan, np.nan)
+        comparison.append({'Satellite': satellite, 'Platform': platform.capitalize(),
+                           'Time of Day': time_of_day.capitalize(), 'Matches': len(matches), 'RMSE': rmse,
+                           'MBE': mbe})
+    return results, pd.DataFrame(comparison)
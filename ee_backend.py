@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import zlib
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from ee_session import ensure_initialized
+
+BACKEND_ENV = 'VALIDATE_EE_BACKEND'
+RECORDINGS_ENV = 'VALIDATE_EE_RECORDINGS'
+RECORDINGS_DIRECTORY = os.path.join(os.getcwd(), 'Cache', 'ee_recordings')
+BACKENDS = ('live', 'record', 'replay', 'synthetic')
+
+# Запросы к Earth Engine описываются словарём (операция, коллекция, колонки, точки, даты);
+# backend.call(request, fn) либо выполняет fn() - построение графа и getInfo, либо отвечает сам
+
+
+def request_key(request):
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class LiveBackend:
+    name = 'live'
+    # Пространство имён кэша спутниковых таблиц: None - данные Earth Engine
+    cache_namespace = None
+
+    def call(self, request, fn):
+        ensure_initialized()
+        return fn()
+
+
+class RecordBackend(LiveBackend):
+    name = 'record'
+
+    def __init__(self, directory=RECORDINGS_DIRECTORY):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def call(self, request, fn):
+        response = super().call(request, fn)
+        path = os.path.join(self.directory, f'{request_key(request)}.json')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'request': request, 'response': response}, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+        return response
+
+
+class ReplayBackend:
+    name = 'replay'
+    cache_namespace = None
+
+    def __init__(self, directory=RECORDINGS_DIRECTORY):
+        self.directory = directory
+
+    def call(self, request, fn):
+        path = os.path.join(self.directory, f'{request_key(request)}.json')
+        if not os.path.exists(path):
+            raise LookupError(f"No recorded Earth Engine response for {request} in {self.directory}")
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)['response']
+
+
+# Синтетические таблицы в формате getInfo: исходные DN, как их отдаёт sampleRegions
+MODIS_PLATFORMS = {'MODIS/061/MYD11A1': 'aqua', 'MODIS/061/MOD11A1': 'terra'}
+# Местное солнечное время пролёта, ч: (день, ночь)
+MODIS_VIEW_HOURS = {'aqua': (13.5, 1.5), 'terra': (10.5, 22.5)}
+# Миссия и сдвиг первого пролёта, сут: Landsat 8 и 9 проходят со сдвигом 8 суток
+LANDSAT_MISSIONS = {'LANDSAT/LC08/C02/T1_L2': ('landsat8', 0), 'LANDSAT/LC09/C02/T1_L2': ('landsat9', 8)}
+LANDSAT_REVISIT_DAYS = 16
+# Начало цикла повторной съёмки: даты пролётов не зависят от запрошенного интервала
+LANDSAT_EPOCH = date(2013, 4, 11)
+# Режим окрестности: разброс DN соседних пикселей и доля маскированных (облака, край снимка)
+WINDOW_NOISE_DN = {'LST_Day_1km': 40, 'LST_Night_1km': 25, 'ST_B10': 250}
+WINDOW_MASKED_FRACTION = 0.1
+SYNTHETIC_VERSION = 2
+
+
+def _dates(date_start, date_end):
+    start, end = date.fromisoformat(str(date_start)[:10]), date.fromisoformat(str(date_end)[:10])
+    days = max(0, (end - start).days)
+    return [start + timedelta(days=offset) for offset in range(days)]
+
+
+def _epoch_ms(day, hours=0.0):
+    moment = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(hours=hours)
+    return int(moment.timestamp() * 1000)
+
+
+def _revisit_dates(date_start, date_end, phase_days):
+    # Пролёты Landsat раз в 16 суток от общей эпохи: тот же день попадает в любой поддиапазон
+    days = _dates(date_start, date_end)
+    return [day for day in days if (day - LANDSAT_EPOCH).days % LANDSAT_REVISIT_DAYS == phase_days]
+
+
+def _surface_temperature(days, noise, mean=8.0, amplitude=18.0):
+    # Годовой ход температуры поверхности, °C; noise - отклонения дней
+    day_of_year = np.array([day.timetuple().tm_yday for day in days])
+    return mean + amplitude * np.sin(2 * np.pi * (day_of_year - 110) / 365.25) + noise
+
+
+def _uniform_integers(uniform, low, high):
+    return low + np.floor(uniform * (high - low)).astype(np.int64)
+
+
+class SyntheticBackend:
+    name = 'synthetic'
+
+    def __init__(self, seed=0, clear_fraction=0.7):
+        self.seed = seed
+        self.clear_fraction = clear_fraction
+        # Версия генератора в пространстве имён: таблицы прежней версии в кэше не используются
+        self.cache_namespace = f'synthetic:{SYNTHETIC_VERSION}:{seed}'
+
+    def _rng(self, *parts):
+        key = zlib.crc32(json.dumps(parts, default=str).encode('utf-8'))
+        return np.random.default_rng([self.seed, key])
+
+    def _daily_draws(self, collection, coordinates, days, normals, uniforms):
+        # Случайные величины каждого дня - от генератора (коллекция, станция, день), поэтому значения дня
+        # не зависят от того, каким окном FetchPlanner или поддиапазоном кэша он запрошен
+        coordinates = [round(float(c), 6) for c in coordinates]
+        z = np.empty((len(days), normals))
+        u = np.empty((len(days), uniforms))
+        for row, day in enumerate(days):
+            rng = self._rng(collection, coordinates, day.isoformat())
+            z[row] = rng.standard_normal(normals)
+            u[row] = rng.random(uniforms)
+        return z, u
+
+    def _points(self, request):
+        if request.get('stations'):
+            return [(station_id, coordinates) for station_id, coordinates in request['stations']]
+        return [(None, request['coordinates'])]
+
+    def _modis_features(self, request, station_id, coordinates):
+        features = []
+        for collection in request['collection'].split('+'):
+            platform = MODIS_PLATFORMS[collection]
+            days = _dates(request['date_start'], request['date_end'])
+            n = len(days)
+            z, u = self._daily_draws(collection, coordinates, days, 2, 7)
+            day_lst = _surface_temperature(days, 2.5 * z[:, 0])
+            night_lst = day_lst - 9 + 1.5 * z[:, 1]
+            day_hours, night_hours = MODIS_VIEW_HOURS[platform]
+            # Колонки генерируются целиком, затем из безоблачных дней собираются свойства точек
+            columns = {
+                'LST_Day_1km': np.rint((day_lst + 273.15) / 0.02),
+                'QC_Day': np.zeros(n),
+                'Day_view_time': np.rint((day_hours + 2 * u[:, 0] - 1) / 0.1),
+                'Day_view_angle': _uniform_integers(u[:, 1], 0, 130),
+                'LST_Night_1km': np.rint((night_lst + 273.15) / 0.02),
+                'QC_Night': np.zeros(n),
+                'Night_view_time': np.rint((night_hours + 2 * u[:, 2] - 1) % 24 / 0.1),
+                'Night_view_angle': _uniform_integers(u[:, 3], 0, 130),
+                'Emis_31': np.full(n, round((0.98 - 0.49) / 0.002)),
+                'Emis_32': np.full(n, round((0.985 - 0.49) / 0.002)),
+                'Clear_day_cov': _uniform_integers(u[:, 4], 1000, 2000),
+                'Clear_night_cov': _uniform_integers(u[:, 5], 1000, 2000),
+                'system:time_start': np.array([_epoch_ms(day) for day in days], dtype=np.int64),
+            }
+            clear = u[:, 6] < self.clear_fraction
+            self._neighborhood(columns, request.get('sampling'), collection, coordinates, days)
+            features.extend(self._rows(columns, clear, request['columns'], platform=platform))
+        return features
+
+    def _landsat_features(self, request, station_id, coordinates):
+        features = []
+        for collection in request['collection'].split('+'):
+            mission, phase_days = LANDSAT_MISSIONS[collection]
+            days = _revisit_dates(request['date_start'], request['date_end'], phase_days)
+            n = len(days)
+            z, u = self._daily_draws(collection, coordinates, days, 1, 10)
+            surface = _surface_temperature(days, 2.5 * z[:, 0], mean=10.0)
+            columns = {
+                # Пролёт около 11:00 местного времени (time_offset_hours = 7)
+                'system:time_start': np.array([_epoch_ms(day, 4) for day in days], dtype=np.int64) +
+                                     _uniform_integers(u[:, 0], 0, 720_000),
+                'ST_B10': np.rint((surface + 273.15 - 149) / 0.00341802),
+                'ST_ATRAN': _uniform_integers(u[:, 1], 6000, 9000),
+                'ST_CDIST': _uniform_integers(u[:, 2], 0, 3000),
+                'ST_DRAD': _uniform_integers(u[:, 3], 500, 2500),
+                'ST_EMIS': _uniform_integers(u[:, 4], 9600, 9900),
+                'ST_EMSD': _uniform_integers(u[:, 5], 0, 200),
+                'ST_QA': _uniform_integers(u[:, 6], 100, 400),
+                'ST_TRAD': _uniform_integers(u[:, 7], 7000, 10000),
+                'ST_URAD': _uniform_integers(u[:, 8], 800, 3500),
+            }
+            clear = u[:, 9] < self.clear_fraction
+            self._neighborhood(columns, request.get('sampling'), collection, coordinates, days)
+            features.extend(self._rows(columns, clear, request['columns'], platform=mission))
+        return features
+
+    def _neighborhood(self, columns, sampling, collection, coordinates, days):
+        # Каналы окна -> массивы (2r+1)x(2r+1) DN вокруг значения в точке, как у neighborhoodToArray;
+        # маскированные пиксели приходят значением заполнения 0
+        if not sampling:
+            return
+        radius = sampling['neighborhood']
+        size = 2 * radius + 1
+        bands = [band for band in WINDOW_NOISE_DN if band in columns]
+        z, u = self._daily_draws(f'{collection}:window', coordinates, days, len(bands) * size * size,
+                                 len(bands) * size * size)
+        z = z.reshape(len(days), len(bands), size, size)
+        u = u.reshape(len(days), len(bands), size, size)
+        for position, band in enumerate(bands):
+            centre = columns[band]
+            windows = np.rint(centre[:, None, None] + WINDOW_NOISE_DN[band] * z[:, position])
+            windows[u[:, position] < WINDOW_MASKED_FRACTION] = 0
+            windows[:, radius, radius] = centre
+            columns[band] = windows
+
+    def _rows(self, columns, clear, requested, **constants):
+        # Только запрошенные колонки, целые DN как в ответе getInfo
+        names = [name for name in columns if name in requested]
+        values = [columns[name][clear].astype(np.int64).tolist() for name in names]
+        constants = {name: value for name, value in constants.items() if name in requested}
+        return [{**dict(zip(names, row)), **constants} for row in zip(*values)]
+
+    def _features(self, request):
+        features = []
+        for station_id, coordinates in self._points(request):
+            if request['collection'].startswith('LANDSAT'):
+                properties = self._landsat_features(request, station_id, coordinates)
+            else:
+                properties = self._modis_features(request, station_id, coordinates)
+            for item in properties:
+                if station_id is not None:
+                    item['station_id'] = station_id
+                features.append({'type': 'Feature', 'geometry': None, 'properties': item})
+        return features
+
+    def call(self, request, fn):
+        operation = request['op']
+        if operation in ('features', 'station_features'):
+            return self._features(request)
+        if operation == 'size':
+            if request['collection'].startswith('LANDSAT'):
+                return sum(len(_revisit_dates(request['date_start'], request['date_end'],
+                                              LANDSAT_MISSIONS[collection][1]))
+                           for collection in request['collection'].split('+'))
+            return len(_dates(request['date_start'], request['date_end'])) * len(request['collection'].split('+'))
+        if operation == 'map_sizes':
+            return {name: 1 for name in request['layers']}
+        if operation == 'layer_url':
+            return f"synthetic://{request['collection']}/{{z}}/{{x}}/{{y}}"
+        raise ValueError(f"Synthetic backend cannot answer {operation!r}")
+
+
+def make_backend(name=None, directory=None, seed=0):
+    name = (name or os.environ.get(BACKEND_ENV) or 'live').lower()
+    directory = directory or os.environ.get(RECORDINGS_ENV) or RECORDINGS_DIRECTORY
+    if name == 'live':
+        return LiveBackend()
+    if name == 'record':
+        return RecordBackend(directory)
+    if name == 'replay':
+        return ReplayBackend(directory)
+    if name == 'synthetic':
+        return SyntheticBackend(seed)
+    raise ValueError(f"Unknown Earth Engine backend {name!r}. Please select one of {', '.join(BACKENDS)}.")
+
+
+_backend = None
+
+
+def get_backend():
+    # По умолчанию backend берётся из переменной окружения VALIDATE_EE_BACKEND (live, если не задана)
+    global _backend
+    if _backend is None:
+        _backend = make_backend()
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = make_backend(backend) if isinstance(backend, str) or backend is None else backend
+    return _backend
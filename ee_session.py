@@ -0,0 +1,77 @@
+import functools
+import importlib.util
+import sys
+import threading
+
+EE_PROJECT = 'ee-kosinova'
+
+_initialized_project = None
+_init_lock = threading.Lock()
+_default_project = EE_PROJECT
+
+
+class MissingModule:
+    # Неустановленный пакет: ошибка при первом обращении к нему, а не при импорте модуля, поэтому
+    # synthetic и replay работают без earthengine-api и geemap
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        raise ModuleNotFoundError(f"No module named '{self._name}'", name=self._name)
+
+
+def lazy_import(name):
+    # Модуль загружается при первом обращении к его атрибуту, а не при импорте
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return MissingModule(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+ee = lazy_import('ee')
+
+
+@functools.lru_cache(maxsize=None)
+def ee_exceptions(*errors):
+    # Кортеж для except: EEException только если earthengine-api установлен, иначе обработчик
+    # пропускает исходное исключение (LookupError replay и т.п.) вместо ModuleNotFoundError
+    if isinstance(ee, MissingModule):
+        return errors
+    return (ee.EEException, *errors)
+
+
+def set_default_project(project):
+    # Проект для отложенной инициализации (рабочие процессы, CLI)
+    global _default_project
+    _default_project = project
+
+
+def initialize_ee(project=None):
+    # Повторная инициализация в том же процессе не нужна
+    global _initialized_project
+    project = project or _default_project
+    # Запросы из нескольких потоков (окна FetchPlanner, слои карты) инициализируют один раз
+    with _init_lock:
+        if _initialized_project != project:
+            ee.Initialize(project=project)
+            _initialized_project = project
+
+
+def ensure_initialized(project=None):
+    # Вызывается перед первым запросом к Earth Engine; если учётных данных нет - вход через браузер
+    try:
+        initialize_ee(project)
+    except ee_exceptions():
+        authenticate_ee(project)
+
+
+def authenticate_ee(project=None):
+    ee.Authenticate()
+    initialize_ee(project)
@@ -1,37 +1,392 @@
+import hashlib
+import json
+import os
+import re
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
 import pandas as pd
-import tkinter as tk
-from tkinter import filedialog
+
+from tracing import span
+
+GROUND_CACHE_DIRECTORY = os.path.join(os.getcwd(), 'Cache', 'ground')
+# Меняется вместе с форматом таблицы наземных данных и правилами разбора дат
+GROUND_CACHE_FORMAT = 3
+SUMMARY_ROWS = 5
+# Строк листа в одной части при потоковом чтении
+GROUND_CHUNK_ROWS = 200_000
+# Разных форматов даты в одной колонке и строк выборки, по которой они выводятся
+MAX_DATE_FORMATS = 4
+FORMAT_SAMPLE_SIZE = 100
+# Начало суток для времени 'HH:MM:SS', разобранного как дата
+TIME_ORIGIN = pd.Timestamp('1900-01-01')
+
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_number(value):
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return True
+    try:
+        float(str(value).replace(',', '.'))
+        return True
+    except ValueError:
+        return False
+
+
+def _read_xlsx_columns(file_path):
+    # Потоковое чтение листа без загрузки всей книги в память
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = [row for row in workbook.worksheets[0].iter_rows(values_only=True)
+                if row and any(cell is not None for cell in row)]
+    finally:
+        workbook.close()
+    return _transpose(rows)
+
+
+def _read_columns(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in ('.xlsx', '.xlsm'):
+        return _read_xlsx_columns(file_path)
+    if extension == '.csv':
+        df = pd.read_csv(file_path, header=None, sep=None, engine='python', dtype=str, skip_blank_lines=True)
+    else:
+        df = pd.read_excel(file_path, header=None)
+    return [df[column].tolist() for column in df.columns]
+
+
+def _csv_separator(file_path):
+    # Разделитель по началу файла, как sep=None у pandas, но без чтения всего файла
+    import csv
+    with open(file_path, encoding='utf-8', errors='replace', newline='') as f:
+        sample = f.read(64 * 1024)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t').delimiter
+    except csv.Error:
+        return ','
+
+
+def iter_ground_chunks(file_path, chunk_rows=GROUND_CHUNK_ROWS, rejected=None):
+    # Наземный ряд частями по chunk_rows строк листа (CSV и xlsx читаются потоково, xls - целиком);
+    # каждая часть - таблица build_ground_frame. rejected очищается в начале прохода и собирает
+    # неразобранные строки всего файла
+    if rejected is not None:
+        rejected.clear()
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        reader = pd.read_csv(file_path, header=None, sep=_csv_separator(file_path), dtype=str,
+                             skip_blank_lines=True, chunksize=chunk_rows)
+        first_row = 1
+        for chunk in reader:
+            yield build_ground_frame([chunk[column].tolist() for column in chunk.columns], rejected, first_row,
+                                     None if first_row == 1 else False)
+            first_row += len(chunk)
+    elif extension in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = []
+            first_row = 1
+            for row in workbook.worksheets[0].iter_rows(values_only=True):
+                if row and any(cell is not None for cell in row):
+                    rows.append(row)
+                if len(rows) >= chunk_rows:
+                    yield build_ground_frame(_transpose(rows), rejected, first_row, None if first_row == 1 else False)
+                    first_row += len(rows)
+                    rows = []
+            if rows:
+                yield build_ground_frame(_transpose(rows), rejected, first_row, None if first_row == 1 else False)
+        finally:
+            workbook.close()
+    else:
+        df = build_ground_frame(_read_columns(file_path), rejected)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows].reset_index(drop=True)
+
+
+def _transpose(rows):
+    width = max((len(row) for row in rows), default=0)
+    return [list(column) for column in zip(*(tuple(row) + (None,) * (width - len(row)) for row in rows))]
+
+
+def _date_format(text):
+    # Формат строки даты: год впереди - ISO, иначе день впереди (дд.мм.гггг, дд/мм/гггг);
+    # порядок дня и месяца не угадывается по каждой ячейке отдельно
+    from pandas.tseries.api import guess_datetime_format
+    return guess_datetime_format(text, dayfirst=not re.match(r'\d{4}', text))
+
+
+def _time_format(text):
+    match = re.fullmatch(r'\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?', text)
+    if match is None:
+        return None
+    return '%H:%M:%S.%f' if match.group(2) else '%H:%M:%S' if match.group(1) else '%H:%M'
+
+
+def _parse_strings(strings, infer_format, parse, dtype):
+    # Формат выводится один раз на колонку - самый частый по выборке строк - и применяется ко всей колонке;
+    # строки, которые ему не соответствуют (время без секунд), разбираются следующими по частоте форматами.
+    # Даты и время в записях логгеров повторяются: разбираются только уникальные строки
+    codes, uniques = pd.factorize(strings.to_numpy(dtype=object))
+    parsed = pd.Series(pd.NaT, index=range(len(uniques)), dtype=dtype)
+    pending = pd.Series(uniques, dtype=object)
+    for stripped in (False, True):
+        if stripped:
+            # Пробелы по краям
+            pending = pending.str.strip()
+            pending = pending[pending != '']
+        if pending.empty:
+            break
+        sample = pending.iloc[np.unique(np.linspace(0, len(pending) - 1, FORMAT_SAMPLE_SIZE).astype(int))]
+        formats = pd.Series([infer_format(text.strip()) for text in sample], dtype=object).value_counts()
+        for string_format in formats.index[:MAX_DATE_FORMATS]:
+            converted = parse(pending, string_format)
+            parsed[converted.index] = converted
+            pending = pending[converted.isna()]
+            if pending.empty:
+                break
+    return parsed.to_numpy()[codes]
+
+
+def _parse_date(strings, date_format):
+    return pd.to_datetime(strings, format=date_format, errors='coerce')
+
+
+def _parse_time(strings, time_format):
+    return pd.to_datetime(strings, format=time_format, errors='coerce') - TIME_ORIGIN
+
+
+def _cells_of(kinds, types, exclude=()):
+    # Типы ячеек проверяются по уникальным типам колонки, а не по каждой ячейке
+    matching = [kind for kind in kinds.unique() if issubclass(kind, types) and not issubclass(kind, exclude)]
+    return kinds.isin(matching).to_numpy()
+
+
+def _parse_dates(cells):
+    # Ячейки datetime/date из Excel используются как есть, строки разбираются по формату колонки
+    cells = pd.Series(cells, dtype=object)
+    parsed = pd.Series(pd.NaT, index=cells.index, dtype='datetime64[ns]')
+    kinds = cells.map(type)
+    native = _cells_of(kinds, date)
+    if native.any():
+        parsed[native] = pd.to_datetime(cells[native].tolist(), errors='coerce').to_numpy(dtype='datetime64[ns]')
+    strings = _cells_of(kinds, str)
+    if strings.any():
+        parsed[strings] = _parse_strings(cells[strings], _date_format, _parse_date, 'datetime64[ns]')
+    return parsed
+
+
+def _parse_times(cells):
+    # Время суток: time, datetime (время Excel с датой 1899-12-30), timedelta, доля суток или 'HH:MM[:SS]'
+    cells = pd.Series(cells, dtype=object)
+    offsets = pd.Series(pd.NaT, index=cells.index, dtype='timedelta64[ns]')
+    kinds = cells.map(type)
+    times = _cells_of(kinds, time)
+    if times.any():
+        codes, uniques = pd.factorize(cells[times].to_numpy())
+        seconds = np.array([cell.hour * 3600 + cell.minute * 60 + cell.second + cell.microsecond / 1e6
+                            for cell in uniques])
+        offsets[times] = pd.to_timedelta(seconds[codes], unit='s').to_numpy(dtype='timedelta64[ns]')
+    moments = _cells_of(kinds, datetime)
+    if moments.any():
+        stamps = pd.DatetimeIndex(pd.to_datetime(cells[moments].tolist()))
+        offsets[moments] = (stamps - stamps.normalize()).to_numpy(dtype='timedelta64[ns]')
+    deltas = _cells_of(kinds, timedelta)
+    if deltas.any():
+        offsets[deltas] = pd.to_timedelta(cells[deltas].tolist()).to_numpy(dtype='timedelta64[ns]')
+    numbers = _cells_of(kinds, (int, float, np.number), bool)
+    if numbers.any():
+        fractions = cells[numbers].astype(np.float64)
+        offsets[numbers] = pd.to_timedelta(fractions.where((fractions >= 0) & (fractions < 1)), unit='D')
+    strings = _cells_of(kinds, str)
+    if strings.any():
+        offsets[strings] = _parse_strings(cells[strings], _time_format, _parse_time, 'timedelta64[ns]')
+    return offsets
+
+
+def _parse_values(cells):
+    # Числа из Excel используются как есть, строки - с десятичной запятой или точкой
+    cells = pd.Series(cells, dtype=object)
+    values = np.full(len(cells), np.nan)
+    kinds = cells.map(type)
+    numbers = _cells_of(kinds, (int, float, np.number), bool)
+    if numbers.any():
+        values[numbers] = cells[numbers].to_numpy(dtype=np.float64)
+    strings = _cells_of(kinds, str)
+    if strings.any():
+        text = cells[strings]
+        parsed = pd.to_numeric(text, errors='coerce')
+        failed = text[parsed.isna()]
+        if not failed.empty:
+            # Десятичная запятая: повторный разбор только неразобранных строк
+            parsed[failed.index] = pd.to_numeric(failed.str.replace(',', '.', regex=False), errors='coerce')
+        values[strings] = parsed.to_numpy(dtype=np.float64)
+    return values
+
+
+def build_ground_frame(columns, rejected=None, first_row=1, header=None):
+    # Колонки листа: дата, время, значение или дата-время, значение; строка заголовка необязательна.
+    # Строки с неразобранной датой, временем или значением не попадают в ряд; если передан список
+    # rejected, в него добавляется таблица этих строк (номер строки листа, исходные ячейки, причина).
+    # header=None - заголовок определяется по первой строке, False - его нет (следующие части файла)
+    columns = [column for column in columns if any(cell is not None and cell == cell for cell in column)]
+    if len(columns) >= 3:
+        date_cells, time_cells, value_cells = columns[:3]
+    elif len(columns) == 2:
+        date_cells, value_cells = columns
+        time_cells = None
+    else:
+        raise ValueError("Expected columns: date, time, value (or datetime, value).")
+    if header is None:
+        header = bool(value_cells) and not _is_number(value_cells[0])
+    if header:
+        date_cells, value_cells = date_cells[1:], value_cells[1:]
+        time_cells = time_cells[1:] if time_cells is not None else None
+        first_row += 1
+
+    dates = _parse_dates(date_cells)
+    datetimes = dates
+    if time_cells is not None:
+        # Дата может содержать 00:00
+        datetimes = dates.dt.normalize() + _parse_times(time_cells)
+    values = _parse_values(value_cells)
+
+    df = pd.DataFrame({'value': values,
+                       'datetime': datetimes.astype('datetime64[ns]').to_numpy()})
+    valid = df.notna().all(axis=1).to_numpy()
+    if rejected is not None and not valid.all():
+        # Причина по первой неразобранной ячейке строки: дата, затем время, затем значение
+        reason = np.where(dates.isna(), 'date', np.where(datetimes.isna(), 'time', 'value'))
+        cells = {'date': date_cells, 'time': time_cells, 'value': value_cells}
+        rejected.append(pd.DataFrame({
+            'row': np.flatnonzero(~valid) + first_row,
+            **{name: pd.Series(column, dtype=object).astype(str).to_numpy()[~valid]
+               for name, column in cells.items() if column is not None},
+            'reason': reason[~valid],
+        }))
+    return df[valid].reset_index(drop=True)
+
+
+def rejected_table(rejected):
+    columns = ['row', 'date', 'time', 'value', 'reason']
+    rejected = [df for df in rejected if len(df)]
+    return pd.concat(rejected, ignore_index=True).reindex(columns=columns) if rejected \
+        else pd.DataFrame(columns=columns)
+
+
+def print_rejected(rejected, rows=SUMMARY_ROWS):
+    if len(rejected):
+        counts = ', '.join(f'{reason}: {count}' for reason, count in rejected['reason'].value_counts().items())
+        print(f"Skipped {len(rejected)} ground rows that could not be parsed ({counts}):")
+        print(rejected.head(rows).to_string(index=False))
+
+
+class GroundCache:
+    def __init__(self, cache_directory=GROUND_CACHE_DIRECTORY):
+        self.cache_directory = cache_directory
+
+    def _paths(self, file_path):
+        key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_directory, key)
+        return f'{base}.parquet', f'{base}.json'
+
+    def load(self, file_path):
+        # Таблица и неразобранные строки файла или None
+        data_path, meta_path = self._paths(file_path)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != GROUND_CACHE_FORMAT:
+                return None
+            stat = os.stat(file_path)
+            if (meta.get('mtime_ns'), meta.get('size')) != (stat.st_mtime_ns, stat.st_size):
+                # Файл переписан или скопирован: сверяем содержимое
+                if meta.get('sha1') != file_hash(file_path):
+                    return None
+                meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                self._write_meta(meta_path, meta)
+            return pd.read_parquet(data_path), rejected_table([pd.DataFrame(meta.get('rejected', []))])
+        except (OSError, ValueError, ImportError):
+            return None
+
+    def _write_meta(self, meta_path, meta):
+        tmp_path = f'{meta_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def store(self, file_path, df, rejected):
+        data_path, meta_path = self._paths(file_path)
+        try:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            stat = os.stat(file_path)
+            tmp_path = f'{data_path}.{os.getpid()}.tmp'
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, data_path)
+            self._write_meta(meta_path, {
+                'format': GROUND_CACHE_FORMAT,
+                'source': os.path.abspath(file_path),
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'sha1': file_hash(file_path),
+                'rejected': rejected.astype({'row': int}).to_dict(orient='records'),
+            })
+        except (OSError, ValueError, ImportError) as e:
+            print("Could not cache ground data:", e)
+
 
 class ExcelManager:
-    def __init__(self):
-        self.file_path = None
+    def __init__(self, file_path=None, use_cache=True, cache_directory=GROUND_CACHE_DIRECTORY):
+        self.file_path = file_path
         self.data = None
         self.date_start = None
         self.date_end = None
+        self.from_cache = False
+        # Строки файла, в которых не разобраны дата, время или значение
+        self.rejected = rejected_table([])
+        self.cache = GroundCache(cache_directory) if use_cache else None
 
     def select_excel_file(self):
+        import tkinter as tk
+        from tkinter import filedialog
         root = tk.Tk()
         root.withdraw()
-        self.file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx;*.xls")])
+        self.file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx;*.xls"),
+                                                               ("CSV files", "*.csv")])
         return self.file_path
 
     def read_excel(self):
         if self.file_path:
             try:
-                df = pd.read_excel(self.file_path, names=['date', 'time', 'value'])
-
-                df['date'] = df['date'].astype(str)
-                df['time'] = df['time'].astype(str)
-
-                df['datetime'] = df['date'] + ' ' + df['time']
-
-                df['datetime'] = pd.to_datetime(df['datetime'], format='%Y-%m-%d %H:%M:%S')
+                with span('ground.read_excel', bytes=os.path.getsize(self.file_path)) as s:
+                    cached = self.cache.load(self.file_path) if self.cache is not None else None
+                    self.from_cache = cached is not None
+                    if cached is None:
+                        rejected = []
+                        df = build_ground_frame(_read_columns(self.file_path), rejected)
+                        self.rejected = rejected_table(rejected)
+                        if self.cache is not None:
+                            self.cache.store(self.file_path, df, self.rejected)
+                    else:
+                        df, self.rejected = cached
+                    s.set(rows=len(df), from_cache=self.from_cache, rejected=len(self.rejected))
+                print_rejected(self.rejected)
+                if df.empty:
+                    raise ValueError("no rows with a valid date, time and value")
 
                 self.date_start = df['datetime'].min()
                 self.date_end = df['datetime'].max()
 
-                df.drop(['date', 'time'], axis=1, inplace=True)
-
                 self.data = df
 
                 return True
@@ -42,9 +397,17 @@ class ExcelManager:
             print("No Excel file selected.")
             return False
 
-    def print_data(self):
+    def print_data(self, rows=SUMMARY_ROWS):
+        # Краткая сводка вместо вывода всей таблицы
         if self.data is not None:
-            print("Data from Excel:")
-            print(self.data.to_string(index=False))
+            source = 'cache' if self.from_cache else 'file'
+            print(f"Data from Excel ({source}): {len(self.data)} rows, {self.date_start} - {self.date_end}")
+            print(self.data['value'].describe().to_string())
+            if len(self.data) > 2 * rows:
+                print(self.data.head(rows).to_string(index=False))
+                print('...')
+                print(self.data.tail(rows).to_string(index=False, header=False))
+            else:
+                print(self.data.to_string(index=False))
         else:
             print("No data available.")
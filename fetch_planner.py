@@ -0,0 +1,106 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pandas as pd
+
+from ee_session import ee_exceptions
+from satellite_cache import fetch_dataframe, fetch_station_dataframes
+from satellite_data import normalize_stations
+
+# getInfo возвращает не более 5000 элементов коллекции, оставляем запас
+MAX_ELEMENTS = 4000
+
+
+class FetchPlanner:
+    def __init__(self, max_elements=MAX_ELEMENTS, max_workers=4, retries=3, backoff_seconds=2.0):
+        self.max_elements = max_elements
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def estimate_images(self, manager, coordinates, date_start, date_end):
+        return manager.count_images(coordinates, date_start, date_end)
+
+    def plan(self, date_start, date_end, image_count, points=1):
+        # Окна одинаковой длины, чтобы в каждое попадало не больше max_elements строк
+        start, end = date.fromisoformat(str(date_start)[:10]), date.fromisoformat(str(date_end)[:10])
+        days = (end - start).days
+        if days <= 0:
+            return []
+        windows = max(1, math.ceil(image_count * points / self.max_elements))
+        window_days = max(1, math.ceil(days / windows))
+        plan = []
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + timedelta(days=window_days), end)
+            plan.append((window_start.isoformat(), window_end.isoformat()))
+            window_start = window_end
+        return plan
+
+    def _fetch_window(self, fetch, manager, target, window_start, window_end):
+        started = time.perf_counter()
+        for attempt in range(1, self.retries + 2):
+            try:
+                result = fetch(manager, target, window_start, window_end)
+                break
+            except ee_exceptions(ConnectionError, TimeoutError) as e:
+                if attempt > self.retries:
+                    raise
+                delay = self.backoff_seconds * 2 ** (attempt - 1)
+                print(f"Window {window_start} - {window_end} failed ({e}), retrying in {delay:.0f} s")
+                time.sleep(delay)
+        if isinstance(result, dict):
+            rows = sum(len(df) for df in result.values())
+        else:
+            rows = 0 if result is None else len(result)
+        with self._lock:
+            self.timings.append({
+                'collection': manager.collection_id,
+                'window_start': window_start,
+                'window_end': window_end,
+                'rows': rows,
+                'attempts': attempt,
+                'seconds': time.perf_counter() - started,
+            })
+        return result
+
+    def _run(self, fetch, manager, target, windows):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._fetch_window, fetch, manager, target, window_start, window_end)
+                       for window_start, window_end in windows]
+            # Порядок окон сохраняется, поэтому страницы склеиваются в порядке дат
+            return [future.result() for future in futures]
+
+    def fetch(self, manager, coordinates, date_start, date_end):
+        image_count = self.estimate_images(manager, coordinates, date_start, date_end)
+        windows = self.plan(date_start, date_end, image_count)
+        pages = [page for page in self._run(fetch_dataframe, manager, coordinates, windows)
+                 if page is not None and not page.empty]
+        if not pages:
+            return pd.DataFrame()
+        return pd.concat(pages, ignore_index=True)
+
+    def fetch_stations(self, manager, stations, date_start, date_end):
+        stations = normalize_stations(stations)
+        coordinates = [coords for station_id, coords in stations]
+        image_count = self.estimate_images(manager, coordinates, date_start, date_end)
+        windows = self.plan(date_start, date_end, image_count, points=len(stations))
+        station_frames = {station_id: [] for station_id, coords in stations}
+        for page in self._run(fetch_station_dataframes, manager, stations, windows):
+            for station_id, df in page.items():
+                if not df.empty:
+                    station_frames.setdefault(station_id, []).append(df)
+        return {station_id: pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+                for station_id, frames in station_frames.items()}
+
+    def timing_table(self):
+        with self._lock:
+            timings = pd.DataFrame(self.timings)
+        if timings.empty:
+            return timings
+        return timings.sort_values(['collection', 'window_start'], kind='mergesort').reset_index(drop=True)
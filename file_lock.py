@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock(handle):
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK сдаётся после 10 попыток по секунде
+                time.sleep(0.1)
+
+    def _unlock(handle):
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(handle):
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+    def _unlock(handle):
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock:
+    # Межпроцессная блокировка на файле рядом с общими данными (процессы batch_runner, потоки mission_fetch);
+    # повторный вход из того же потока не блокируется
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self._handle = open(self.path, 'a+b')
+                _lock(self._handle)
+            except BaseException:
+                if self._handle is not None:
+                    self._handle.close()
+                    self._handle = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                _unlock(self._handle)
+            finally:
+                self._handle.close()
+                self._handle = None
+        self._lock.release()
+        return False
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+GROUND_STATISTICS = ('mean', 'min', 'max', 'count')
+# Цели сопоставления: instant - ближайшее измерение, hourly/daily - агрегат часа или суток пролёта,
+# window - агрегат окна вокруг пролёта (± промежуток)
+GROUND_TARGETS = ('instant', 'hourly', 'daily', 'window')
+# Окно по умолчанию, если промежуток не задан (Landsat), мин
+DEFAULT_WINDOW_MINUTES = 30
+
+
+def _combine(partials, keys):
+    # Объединение частичных агрегатов (сумма, минимум, максимум, число) по ключам
+    grouped = partials.groupby(keys, sort=True).agg(sum=('sum', 'sum'), min=('min', 'min'), max=('max', 'max'),
+                                                     count=('count', 'sum'))
+    return _finish(grouped)
+
+
+def _finish(grouped):
+    grouped['mean'] = grouped['sum'] / grouped['count']
+    return grouped[list(GROUND_STATISTICS)]
+
+
+class GroundAggregates:
+    # Агрегаты очищенного наземного ряда: один groupby по часам даёт частичные суммы,
+    # из которых без повторного прохода по ряду собираются сутки и суточный ход
+    def __init__(self, ground):
+        times = ground['datetime'].to_numpy(dtype='datetime64[ns]')
+        values = ground['value'].to_numpy(dtype=np.float64)
+        valid = ~np.isnat(times) & np.isfinite(values)
+        times, values = times[valid], values[valid]
+        order = np.argsort(times, kind='mergesort')
+        self.times, self.values = times[order], values[order]
+
+        partials = pd.DataFrame({'hour': self.times.astype('datetime64[h]'), 'value': self.values})
+        partials = partials.groupby('hour', sort=True)['value'].agg(['sum', 'min', 'max', 'count'])
+        self.hourly = _finish(partials.copy())
+        self.daily = _combine(partials, partials.index.to_numpy().astype('datetime64[D]'))
+        self.daily.index = pd.DatetimeIndex(self.daily.index, name='date')
+        # Суточный ход: средний цикл по часам суток за весь период
+        self.diurnal = _combine(partials, pd.Index(partials.index.hour, name='hour'))
+
+    def __len__(self):
+        return len(self.values)
+
+    def window(self, moments, minutes=DEFAULT_WINDOW_MINUTES):
+        # Агрегаты измерений в окне [момент - minutes, момент + minutes] для каждого пролёта:
+        # границы окон - бинарный поиск, среднее - разность накопленных сумм, min/max - reduceat
+        moments = np.asarray(moments, dtype='datetime64[ns]')
+        half = np.timedelta64(int(minutes * 60 * 10 ** 9), 'ns')
+        starts = np.searchsorted(self.times, moments - half, side='left')
+        ends = np.searchsorted(self.times, moments + half, side='right')
+        counts = ends - starts
+        cumulative = np.concatenate([[0.0], np.cumsum(self.values)])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (cumulative[ends] - cumulative[starts]) / counts
+        minimum = np.full(len(moments), np.nan)
+        maximum = np.full(len(moments), np.nan)
+        filled = counts > 0
+        if filled.any():
+            # reduceat по парам (начало, конец) окна; значение за последним отсчётом - заглушка для конца ряда
+            padded = np.append(self.values, np.nan)
+            bounds = np.column_stack([starts[filled], ends[filled]]).ravel()
+            minimum[filled] = np.minimum.reduceat(padded, bounds)[::2]
+            maximum[filled] = np.maximum.reduceat(padded, bounds)[::2]
+        return pd.DataFrame({'mean': np.where(filled, means, np.nan), 'min': minimum, 'max': maximum,
+                             'count': counts})
+
+    def pair(self, satellite, target, time_interval_minutes=None, statistic='mean'):
+        # Пары пролёт - агрегат наземного ряда в формате match_nearest: datetime, value, ground_datetime,
+        # ground_value; ground_datetime - начало часа/суток пролёта или сам пролёт для окна
+        if target not in GROUND_TARGETS or target == 'instant':
+            raise ValueError(f"Invalid target {target!r}. Please select one of {', '.join(GROUND_TARGETS[1:])}.")
+        if statistic not in GROUND_STATISTICS:
+            raise ValueError(f"Invalid statistic {statistic!r}. "
+                             f"Please select one of {', '.join(GROUND_STATISTICS)}.")
+        satellite = satellite.dropna(subset=['datetime'])
+        moments = satellite['datetime'].to_numpy(dtype='datetime64[ns]')
+        if target == 'window':
+            minutes = DEFAULT_WINDOW_MINUTES if time_interval_minutes is None else time_interval_minutes
+            aggregates = self.window(moments, minutes)
+            ground_datetime = moments
+        else:
+            table = self.hourly if target == 'hourly' else self.daily
+            periods = moments.astype('datetime64[h]' if target == 'hourly' else 'datetime64[D]')
+            ground_datetime = periods.astype('datetime64[ns]')
+            aggregates = table.reindex(pd.DatetimeIndex(ground_datetime)).reset_index(drop=True)
+        paired = pd.DataFrame({
+            'datetime': moments,
+            'value': satellite['value'].to_numpy(dtype=np.float64),
+            'ground_datetime': ground_datetime,
+            'ground_value': aggregates[statistic].to_numpy(dtype=np.float64),
+        })
+        found = aggregates['count'].fillna(0).to_numpy() > 0
+        return paired[found].sort_values('datetime', kind='mergesort').reset_index(drop=True)
@@ -1,17 +1,71 @@
-import ee
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-from collections import defaultdict
+from ee_session import ee
+from satellite_data import SatelliteDataManager
 
-class LandsatDataManager:
+LANDSAT_COLLECTIONS = {
+    'landsat8': 'LANDSAT/LC08/C02/T1_L2',
+    'landsat9': 'LANDSAT/LC09/C02/T1_L2',
+}
+
+
+class LandsatDataManager(SatelliteDataManager):
     __instance = None
+    missions = ('landsat8',)
+    collection_id = LANDSAT_COLLECTIONS['landsat8']
+    columns = [
+        "system:time_start",
+        "ST_B10",
+        "ST_ATRAN",
+        "ST_CDIST",
+        "ST_DRAD",
+        "ST_EMIS",
+        "ST_EMSD",
+        "ST_QA",
+        "ST_TRAD",
+        "ST_URAD",
+        "platform",
+        "name"
+    ]
+    # Коэффициенты перевода DN в физические величины: значение = DN * scale + offset
+    scales = {
+        'ST_B10': (0.00341802, 149 - 273.15),
+        'ST_ATRAN': (0.0001, 0),
+        'ST_CDIST': (0.01, 0),
+        'ST_DRAD': (0.001, 0),
+        'ST_EMIS': (0.0001, 0),
+        'ST_EMSD': (0.0001, 0),
+        'ST_QA': (0.01, 0),
+        'ST_TRAD': (0.001, 0),
+        'ST_URAD': (0.001, 0),
+    }
+    time_offset_hours = 7
+    window_bands = ['ST_B10']
+    # Окрестность берётся в собственном разрешении 30 м (радиус 16 - около пикселя MODIS)
+    native_scale = 30
+
+    def __init__(self, missions=None, columns=None, neighborhood=None):
+        if missions is not None:
+            self.missions = tuple(sorted(m.lower() for m in missions))
+        unknown = [m for m in self.missions if m not in LANDSAT_COLLECTIONS]
+        if unknown:
+            raise ValueError(f"Invalid Landsat mission {unknown}. Please select 'landsat8' or 'landsat9'.")
+        # Одна миссия — прежний ID коллекции, несколько — составной ключ для кэша
+        self.collection_id = '+'.join(LANDSAT_COLLECTIONS[m] for m in self.missions)
+        super().__init__(columns, neighborhood)
 
     def get_image_collection(self, coordinates, date_start, date_end):
-        point = ee.Geometry.Point(coordinates)
-        lst = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2') \
-            .filterBounds(point) \
-            .filterDate(date_start, date_end)
+        point = self.region(coordinates)
+
+        def tag_platform(mission):
+            return lambda image: image.set('platform', mission)
+
+        # Landsat 8 и 9 объединяются в одну коллекцию, снимки помечаются миссией
+        lst = None
+        for mission in self.missions:
+            collection = ee.ImageCollection(LANDSAT_COLLECTIONS[mission]) \
+                .filterBounds(point) \
+                .filterDate(date_start, date_end) \
+                .map(tag_platform(mission))
+            lst = collection if lst is None else lst.merge(collection)
         return lst
 
     def mask_clouds(self, image):
@@ -22,80 +76,8 @@ class LandsatDataManager:
         return image.updateMask(combined_mask)
 
     def sample_image(self, image, point):
-        image = self.mask_clouds(image)
-        image = image.addBands(image.metadata("system:time_start"))
-        image = image.addBands(image.select('ST_B10').multiply(0.00341802).subtract(273.15).add(149), overwrite=True)
-        image = image.addBands(image.select('ST_ATRAN').multiply(0.0001), overwrite=True)
-        image = image.addBands(image.select('ST_CDIST').multiply(0.01), overwrite=True)
-        image = image.addBands(image.select('ST_DRAD').multiply(0.001), overwrite=True)
-        image = image.addBands(image.select('ST_EMIS').multiply(0.0001), overwrite=True)
-        image = image.addBands(image.select('ST_EMSD').multiply(0.0001), overwrite=True)
-        image = image.addBands(image.select('ST_QA').multiply(0.01), overwrite=True)
-        image = image.addBands(image.select('ST_TRAD').multiply(0.001), overwrite=True)
-        image = image.addBands(image.select('ST_URAD').multiply(0.001), overwrite=True)
-        image = image.addBands(image.select('QA_PIXEL'), overwrite=True)
-        return image.sampleRegions(collection=point, scale=1000)
-
-    def get_feature_collection(self, lst, point):
-        featureCollection = ee.FeatureCollection(lst.map(lambda image: self.sample_image(image, point))).flatten()
-        return featureCollection
-
-    def replace_numbers_by_strings(self, feature):
-        d = ee.Date(feature.get('system:time_start')).advance(7, 'hour').format('YYYY-MM-dd HH:mm:ss')
-        st_b10 = ee.Number(feature.get('ST_B10')).format('%6.2f')
-        st_atran = ee.Number(feature.get('ST_ATRAN')).format('%6.2f')
-        st_cdist = ee.Number(feature.get('ST_CDIST')).format('%6.2f')
-        st_drad = ee.Number(feature.get('ST_DRAD')).format('%6.2f')
-        st_emis = ee.Number(feature.get('ST_EMIS')).format('%6.2f')
-        st_emsd = ee.Number(feature.get('ST_EMSD')).format('%6.2f')
-        st_qa = ee.Number(feature.get('ST_QA')).format('%6.2f')
-        st_trad = ee.Number(feature.get('ST_TRAD')).format('%6.2f')
-        st_urad = ee.Number(feature.get('ST_URAD')).format('%6.2f')
-        return feature.set({
-            'date': d,
-            'ST_B10': st_b10,
-            'ST_ATRAN': st_atran,
-            'ST_CDIST': st_cdist,
-            'ST_DRAD': st_drad,
-            'ST_EMIS': st_emis,
-            'ST_EMSD': st_emsd,
-            'ST_QA': st_qa,
-            'ST_TRAD': st_trad,
-            'ST_URAD': st_urad
-        })
-
-    def get_datatable(self, featureCollection):
-        columns = [
-            "date",
-            "ST_B10",
-            "ST_ATRAN",
-            "ST_CDIST",
-            "ST_DRAD",
-            "ST_EMIS",
-            "ST_EMSD",
-            "ST_QA",
-            "ST_TRAD",
-            "ST_URAD",
-            "name"
-        ]
-
-        landsat_datatable = featureCollection.map(self.replace_numbers_by_strings).select(columns)
-        return landsat_datatable
-
-    def get_image_data(self, coordinates, date_start, date_end):
-        lst = self.get_image_collection(coordinates, date_start, date_end)
-        return lst
-
-    def get_feature_data(self, lst, coordinates):
-        point = ee.Geometry.Point(coordinates)
-        featureCollection = self.get_feature_collection(lst, point)
-        return featureCollection
-
-    def create_dataframe(self, featureCollection):
-        datatable = self.get_datatable(featureCollection)
-        if datatable is not None:
-            df = pd.DataFrame([feature['properties'] for feature in datatable.getInfo()['features']])
-            return df
-        else:
-            print("Feature collection is empty.")
-            return None
+        # Передаются исходные целочисленные DN, масштабирование выполняется на клиенте (scales);
+        # в выборку попадают только выбранные каналы и время съёмки
+        platform = image.get('platform')
+        samples = self.sample_bands(self.mask_clouds(image), point)
+        return samples.map(lambda feature: feature.set('platform', platform))
@@ -1,30 +1,17 @@
 import warnings
-import ee
-import pandas as pd
-import os
-from common_dates import CommonDates
-from excel_manager import ExcelManager
-from aqua_data import AquaDataManager
-from landsat_data import LandsatDataManager
-from rsme_mbe import calculate_rmse_mbe
-from plot_data import plot_data
-from map_viewer import MapViewer
-from output_maker import create_csv, create_excel
-from report import create_pdf_report
-from terra_data import TerraDataManager
+# Тяжёлые модули (pandas, matplotlib, scipy, reportlab, ee, geemap) импортируются на том шаге,
+# где они нужны; Earth Engine инициализируется при первом запросе, который не закрыл кэш
 warnings.filterwarnings('ignore')
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-def authenticate_ee():
-    ee.Authenticate()
-    ee.Initialize(project='ee-kosinova')
-
-
 def select_satellite():
     while True:
-        satellite_choice = input("Выберите спутник (modis/landsat): ").lower()
+        satellite_choice = input("Выберите спутник (modis/landsat/all): ").lower()
         if satellite_choice == "modis":
-            satellite_product = input("Выберите тип данных (Aqua/Terra): ").lower()
+            satellite_product = input("Выберите тип данных (Aqua/Terra/All): ").lower()
+            if satellite_product == "all":
+                # Все четыре комбинации Aqua/Terra x Day/Night одним запросом
+                return satellite_choice, satellite_product, None
             if satellite_product not in ["aqua", "terra"]:
                 print("Некорректный тип данных для MODIS.")
                 continue
@@ -33,13 +20,15 @@ def select_satellite():
                 print("Некорректный выбор Day или Night.")
                 continue
             return satellite_choice, satellite_product, day_or_night
-        elif satellite_choice == "landsat":
+        elif satellite_choice in ["landsat", "all"]:
+            # all - Landsat 8/9, Aqua и Terra одновременно, сопоставление одним проходом
             return satellite_choice, None, None
         else:
             print("Некорректный выбор спутника.")
 
 
 def select_excel_data():
+    from excel_manager import ExcelManager
     excel_manager = ExcelManager()
     excel_manager.select_excel_file()
     if not excel_manager.read_excel():
@@ -55,56 +44,138 @@ def get_coordinates():
     return coordinates
 
 
+def parse_time_intervals(text):
+    # "30" - один промежуток, "10,20,30,60" - подбор промежутка по таблице метрик
+    return [int(value) for value in text.replace(';', ',').split(',') if value.strip()]
+
+
+def input_time_intervals(prompt):
+    # Пустой или нечисловой ввод - запрос повторяется
+    while True:
+        try:
+            time_intervals = parse_time_intervals(input(prompt))
+        except ValueError:
+            time_intervals = []
+        if time_intervals:
+            return time_intervals
+        print("Некорректный временной промежуток.")
+
+
+def choose_time_interval(sweep, satellite_choice):
+    from plot_data import plot_tolerance_sweep
+    print(sweep.to_string(index=False))
+    plot_tolerance_sweep(sweep, satellite_choice)
+    while True:
+        try:
+            return int(input("Выберите временной промежуток для сопоставления: "))
+        except ValueError:
+            print("Некорректный временной промежуток.")
+
+
 def process_data(matches, daily_averages):
-    print("ID\tSatellite name\tSatellite value\tSatellite Datetime\tGround value\tGround Datetime")
-    for idx in range(0, len(matches), 2):
-        satellite_match = matches[idx]
-        ground_match = matches[idx + 1]
-        satellite_source = satellite_match['source']
-        satellite_datetime = satellite_match['datetime']
-        satellite_value = satellite_match['value']
-        ground_value = ground_match['value']
-        ground_datetime = ground_match['datetime']
-        if 'source' in satellite_match:
-            satellite_source = satellite_match['source']
-            if len(satellite_source.split(' - ')) > 1:
-                satellite_name = satellite_source.split(' - ')[1]
-            else:
-                satellite_name = "Landsat"
-        else:
-            satellite_name = "Landsat"
-        print(
-            f"{idx + 1}\t{satellite_name}\t{satellite_value}\t{satellite_datetime}\t{ground_value}\t{ground_datetime}")
+    from rsme_mbe import calculate_rmse_mbe
+    from validation_stats import match_statistics
+    if not matches:
+        print("No matches found.")
+        return
+    print(matches.display_frame().to_string(index=False))
 
     rmse, mbe = calculate_rmse_mbe(matches)
     print(f"RMSE: {rmse}")
     print(f"MBE: {mbe}")
+    statistics = match_statistics(matches)
+    print(f"MAE: {statistics['mae']:.3f}, R²: {statistics['r2']:.3f}, "
+          f"y = {statistics['slope']:.3f}x + {statistics['intercept']:.3f}")
+    print(f"Error quantiles (5/50/95%): {statistics['error_p05']:.2f} / {statistics['error_p50']:.2f} / "
+          f"{statistics['error_p95']:.2f}")
+    print(f"RMSE 95% CI: [{statistics['rmse_ci_low']:.3f}, {statistics['rmse_ci_high']:.3f}], "
+          f"MBE 95% CI: [{statistics['mbe_ci_low']:.3f}, {statistics['mbe_ci_high']:.3f}]")
 
 
-def save_table(df, matches, excel_data):
-    save_table = input("Хотите ли вы сохранить таблицу со значениями? (да/нет): ").lower()
-    if save_table == "да":
-        format_choice = input("Выберите формат для сохранения (csv/excel): ").lower()
-        if format_choice in ["csv", "excel"]:
-            matched_dates_df = pd.DataFrame(matches).rename(columns={'datetime': 'Common Date'})
-            df = pd.concat([df, matched_dates_df], axis=1)
-            excel_data = excel_data.rename(columns={'datetime': 'Ground Date', 'value': 'Ground Value'})
-            df = pd.concat([df, excel_data], axis=1)
-            os.makedirs("Tables", exist_ok=True)
-            if format_choice == "csv":
-                create_csv(df, folder="Tables")
-            else:
-                create_excel(df, folder="Tables")
-        else:
+def process_combinations(combination_matches, comparison, time_interval_minutes):
+    # Пары каждой комбинации (спутник, платформа, время суток): метрики и график, затем сравнение комбинаций
+    from match_table import MatchTable
+    from plot_data import plot_data
+    plot_images = []
+    for (satellite, platform, time_of_day), matches in combination_matches.items():
+        print(f"{platform.capitalize()} {(time_of_day or '').capitalize()}:")
+        process_data(matches, None)
+        plot_images.append(plot_data(satellite, matches, time_interval_minutes if satellite == 'modis' else None,
+                                     platform, time_of_day))
+    print(comparison.to_string(index=False))
+    return MatchTable.concat(combination_matches.values()), plot_images
+
+
+def save_table(df, matches, excel_data, export_format=None, compression=None):
+    from output_maker import EXPORT_DIRECTORY, EXPORT_FORMATS, TableExporter
+    if export_format is None:
+        save_table = input("Хотите ли вы сохранить таблицу со значениями? (да/нет): ").lower()
+        if save_table == "нет":
+            print("Таблица не сохранена.")
+            return
+        if save_table != "да":
+            print("Некорректный ответ.")
+            return
+        export_format = input(f"Выберите формат для сохранения ({'/'.join(EXPORT_FORMATS)}): ").lower()
+        if export_format not in EXPORT_FORMATS:
             print("Некорректный выбор формата.")
-    elif save_table == "нет":
-        print("Таблица не сохранена.")
-    else:
-        print("Некорректный ответ.")
+            return
+    # Спутниковая таблица, пары и наземный ряд имеют разную длину: отдельные таблицы (листы одной книги Excel)
+    tables = {
+        'satellite': df,
+        'matches': matches.display_frame(),
+        'ground': excel_data.rename(columns={'datetime': 'Ground Series Datetime', 'value': 'Ground Series Value'}),
+    }
+    TableExporter(EXPORT_DIRECTORY, compression).export_tables(tables, 'validation', export_format)
+
+
+def save_trace(tracer):
+    import tracing
+    from report import wait_for_reports
+    # Трасса запуска записывается после фонового отчёта, чтобы в неё попал и он
+    wait_for_reports()
+    tracing.disable()
+    print(tracing.summarize(tracer.spans).to_string(index=False))
+    print(f"Trace saved to {tracer.export(tracing.trace_path())}")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Валидация спутниковых данных по наземным измерениям")
+    parser.add_argument('--backend', choices=['live', 'record', 'replay', 'synthetic'], default=None,
+                        help="Источник данных Earth Engine (по умолчанию VALIDATE_EE_BACKEND или live)")
+    parser.add_argument('--recordings', default=None, help="Папка записанных ответов Earth Engine")
+    parser.add_argument('--trace', nargs='?', const='memory', choices=['memory', 'time'],
+                        help="Записать время, строки, размер ответов и пик памяти шагов в Traces/; "
+                             "time - без памяти")
+    parser.add_argument('--bands', choices=['full', 'required'], default='full',
+                        help="full - все колонки спутниковой таблицы (для сохранения и отчёта), "
+                             "required - только нужные сопоставлению")
+    parser.add_argument('--target', choices=['instant', 'hourly', 'daily', 'window'], default='instant',
+                        help="С чем сравнивать пролёт: instant - ближайшее наземное измерение, hourly/daily - "
+                             "среднее за час/сутки пролёта, window - среднее в окне ± промежуток")
+    parser.add_argument('--neighborhood', type=int, default=None,
+                        help="Радиус окна пикселей вокруг станции (1 - 3x3, 2 - 5x5; Landsat - в пикселях 30 м)")
+    parser.add_argument('--window-value', choices=['center', 'mean'], default='center',
+                        help="Значение спутника в режиме окрестности: центральный пиксель или среднее окна")
+    parser.add_argument('--min-valid-fraction', type=float, default=None,
+                        help="Минимальная доля валидных пикселей окна")
+    parser.add_argument('--export', choices=['csv', 'excel', 'parquet', 'feather'], default=None,
+                        help="Сохранять таблицы в Tables/ в этом формате без вопросов")
+    parser.add_argument('--compression', choices=['gzip', 'bz2', 'xz', 'zip'], default=None,
+                        help="Сжатие CSV-выгрузок")
+    args = parser.parse_args()
+    window = {'window_value': args.window_value, 'min_valid_fraction': args.min_valid_fraction} \
+        if args.neighborhood else {}
+    from ee_backend import make_backend, set_backend
+    set_backend(make_backend(args.backend, args.recordings))
+    import tracing
+    trace = tracing.trace_mode(args.trace)
+    from fetch_planner import FetchPlanner
+    from satellite_cache import SatelliteCache
+    fetch_planner = FetchPlanner()
+    satellite_cache = SatelliteCache(fetch=fetch_planner.fetch, fetch_stations=fetch_planner.fetch_stations)
     while True:
-        authenticate_ee()
+        tracer = tracing.enable(trace == 'memory') if trace else None
         excel_manager = select_excel_data()
         coordinates = get_coordinates()
         date_start = excel_manager.date_start.strftime('%Y-%m-%d')
@@ -112,32 +183,88 @@ if __name__ == "__main__":
         satellite_choice, satellite_product, day_or_night = select_satellite()
         satellite_data_manager = None
         time_interval_minutes = None
+        time_intervals = []
+        columns = None
+        if args.bands == 'required' and satellite_choice in ('modis', 'landsat'):
+            from common_dates import required_columns
+            columns = required_columns(satellite_choice, day_or_night)
 
         if satellite_choice == "modis":
-            if satellite_product in ["aqua", "terra"]:
-                time_interval_minutes = int(input("Введите временной промежуток: "))
-                satellite_data_manager = AquaDataManager() if satellite_product == "aqua" else TerraDataManager()
+            from aqua_data import AquaDataManager
+            from modis_data import ModisDataManager
+            from terra_data import TerraDataManager
+            if satellite_product in ["aqua", "terra", "all"]:
+                time_intervals = input_time_intervals(
+                    "Введите временной промежуток (несколько через запятую для подбора): ")
+                time_interval_minutes = time_intervals[0]
+                if satellite_product == "all":
+                    satellite_data_manager = ModisDataManager(columns=columns, neighborhood=args.neighborhood)
+                elif satellite_product == "aqua":
+                    satellite_data_manager = AquaDataManager(columns=columns, neighborhood=args.neighborhood)
+                else:
+                    satellite_data_manager = TerraDataManager(columns=columns, neighborhood=args.neighborhood)
         elif satellite_choice == "landsat":
-            satellite_data_manager = LandsatDataManager()
+            from landsat_data import LandsatDataManager
+            satellite_data_manager = LandsatDataManager(columns=columns, neighborhood=args.neighborhood)
             time_interval_minutes = None
+        elif satellite_choice == "all":
+            from mission_fetch import MissionFetcher
+            time_interval_minutes = input_time_intervals("Введите временной промежуток для MODIS: ")[0]
+            satellite_data_manager = MissionFetcher(satellite_cache, full_bands=args.bands == 'full',
+                                                    neighborhood=args.neighborhood)
 
-        if satellite_data_manager:
-            lst = satellite_data_manager.get_image_collection(coordinates, date_start, date_end)
-            featureCollection = satellite_data_manager.get_feature_data(lst, coordinates)
-            df = satellite_data_manager.create_dataframe(featureCollection)
+        if satellite_choice == "all":
+            from common_dates import match_missions
+            # Миссии запрашиваются параллельно, время - как у самой медленной
+            df = satellite_data_manager.fetch(coordinates, date_start, date_end)
+            excel_data = excel_manager.data
+            mission_matches, comparison = match_missions(df, excel_data, {'modis': time_interval_minutes},
+                                                         args.target, **window)
+            matches, plot_images = process_combinations(mission_matches, comparison, time_interval_minutes)
+        elif satellite_data_manager:
+            from common_dates import CommonDates, match_modis_all, sweep_modis_all
+            from plot_data import plot_data
+            df = satellite_cache.get_dataframe(satellite_data_manager, coordinates, date_start, date_end)
             excel_data = excel_manager.data
-            common_dates = CommonDates(df, excel_data, satellite_choice, satellite_product, day_or_night)
-
-            matches, daily_averages = common_dates.match_data(time_interval_minutes)
-            process_data(matches, daily_averages)
-            plot_data(satellite_choice, matches, time_interval_minutes, satellite_product, day_or_night)
-            map_viewer = MapViewer(coordinates, date_start, date_end)
-            map_viewer.display_map()
-            save_table(df, matches, excel_data)
-            create_pdf_report(df, matches, satellite_choice, date_start, date_end, coordinates, time_interval_minutes, satellite_product)
-
-            repeat = input("Хотите ли вы выполнить программу еще раз? (да/нет): ").lower()
-            if repeat != "да":
-                break
+            if satellite_product == "all":
+                if len(time_intervals) > 1:
+                    time_interval_minutes = choose_time_interval(
+                        sweep_modis_all(df, excel_data, time_intervals), satellite_choice)
+                modis_matches, comparison = match_modis_all(df, excel_data, time_interval_minutes, args.target,
+                                                            **window)
+                matches, plot_images = process_combinations(
+                    {('modis', *combination): combination_matches
+                     for combination, combination_matches in modis_matches.items()},
+                    comparison, time_interval_minutes)
+            else:
+                common_dates = CommonDates(df, excel_data, satellite_choice, satellite_product, day_or_night,
+                                           **window)
+                if len(time_intervals) > 1:
+                    time_interval_minutes = choose_time_interval(
+                        common_dates.sweep_tolerances(time_intervals), satellite_choice)
+
+                matches, daily_averages = common_dates.match_data(time_interval_minutes, args.target)
+                print("Удалено фильтрами (наземные данные):")
+                print(common_dates.ground_report.to_string(index=False))
+                print("Удалено фильтрами (пары):")
+                print(common_dates.match_report.to_string(index=False))
+                process_data(matches, daily_averages)
+                plot_images = [plot_data(satellite_choice, matches, time_interval_minutes, satellite_product,
+                                         day_or_night)]
         else:
             print("Некорректный выбор спутника.")
+            continue
+
+        from map_viewer import MapViewer
+        MapViewer(coordinates, date_start, date_end).display_map()
+        save_table(df, matches, excel_data, args.export, args.compression)
+        from report import create_pdf_report, wait_for_reports
+        create_pdf_report(df, matches, satellite_choice, date_start, date_end, coordinates, time_interval_minutes,
+                          satellite_product, day_or_night, plot_images=plot_images, background=True)
+
+        if tracer is not None:
+            save_trace(tracer)
+        repeat = input("Хотите ли вы выполнить программу еще раз? (да/нет): ").lower()
+        if repeat != "да":
+            wait_for_reports()
+            break
@@ -1,17 +1,107 @@
+import hashlib
+import json
 import os
+import time
 import webbrowser
-import ee
-import geemap
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from ee_backend import get_backend
+from ee_session import ee, lazy_import
+from tracing import traced
+
+geemap = lazy_import('geemap')
+
+MAP_CACHE_DIRECTORY = os.path.join(os.getcwd(), 'Cache', 'maps')
+# Ссылки на тайлы Earth Engine перестают работать через несколько часов
+URL_TTL_SECONDS = 6 * 3600
+# Число снимков за прошедший период почти не меняется
+SIZE_TTL_SECONDS = 7 * 24 * 3600
+REGION_BUFFER_METERS = 50000
+
+LST_PALETTE = ['040274', '040281', '0502a3', '0502b8', '0502ce', '0502e6',
+               '0602ff', '235cb1', '307ef3', '269db1', '30c8e2', '32d3ef',
+               '3be285', '3ff38f', '86e26f', '3ae237', 'b5e22e', 'd6e21f',
+               'fff705', 'ffd611', 'ffb613', 'ff8b13', 'ff6e08', 'ff500d',
+               'ff0000', 'de0101', 'c21301', 'a71001', '911003']
+
+# Слои карты: thumb - миниатюра медианного композита в буфере станции, tiles - тайлы Earth Engine;
+# optional - слой добавляется, только если в коллекции есть снимки за период
+MAP_LAYERS = [
+    {'name': 'MODIS MYD11A1', 'collection': 'MODIS/061/MYD11A1', 'mask': 'modis', 'band': 'LST_Day_1km',
+     'kind': 'thumb', 'composite': 'median', 'vis': {'min': -20, 'max': 40, 'palette': LST_PALETTE}},
+    {'name': 'Land Surface Temperature MODIS/061/MOD11A1', 'collection': 'MODIS/061/MOD11A1', 'mask': 'modis',
+     'band': 'LST_Day_1km', 'kind': 'tiles', 'composite': 'mosaic',
+     'vis': {'min': 13000.0, 'max': 16500.0, 'palette': LST_PALETTE}},
+    {'name': 'JAXA GCOM-C LST', 'collection': 'JAXA/GCOM-C/L3/LAND/LST/V2', 'mask': 'jaxa', 'band': 'LST_AVE',
+     'kind': 'tiles', 'composite': 'median', 'optional': True,
+     'vis': {'min': 0, 'max': 40, 'palette': ['blue', 'green', 'red']}},
+    {'name': 'Oxford MAP LST Day', 'collection': 'Oxford/MAP/LST_Day_5km_Monthly', 'mask': 'modis',
+     'band': 'LST_Day', 'kind': 'tiles', 'composite': 'median', 'optional': True,
+     'vis': {'min': 0, 'max': 50, 'palette': ['blue', 'green', 'red']}},
+    {'name': 'MODIS MOD21C3 LST Day', 'collection': 'MODIS/061/MOD21C3', 'mask': 'modis', 'band': 'LST_Day',
+     'kind': 'tiles', 'composite': 'median',
+     'vis': {'min': 0, 'max': 50, 'palette': ['purple', 'blue', 'green', 'yellow', 'orange', 'red']}},
+]
+SATELLITE_BASEMAP_URL = "https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}"
+
+
+class MapCache:
+    # Ссылки на миниатюры/тайлы и размеры коллекций с истечением срока, ключ - коллекция, район и даты
+    def __init__(self, cache_directory=MAP_CACHE_DIRECTORY):
+        self.cache_directory = cache_directory
+        self.index_path = os.path.join(self.cache_directory, 'index.json')
+        if not os.path.exists(self.cache_directory):
+            os.makedirs(self.cache_directory)
+
+    def cache_key(self, **params):
+        payload = json.dumps(params, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def get_many(self, keys):
+        now = time.time()
+        index = self._read_index()
+        return {key: index[key]['value'] for key in keys
+                if key in index and index[key].get('expires', 0) > now}
+
+    def set_many(self, values, ttl_seconds):
+        if not values:
+            return
+        now = time.time()
+        # Просроченные записи удаляются при каждой записи
+        index = {key: entry for key, entry in self._read_index().items() if entry.get('expires', 0) > now}
+        for key, value in values.items():
+            index[key] = {'value': value, 'expires': now + ttl_seconds}
+        self._write_index(index)
+
+    def clear(self):
+        self._write_index({})
+
 
 class MapViewer:
-    def __init__(self, coordinates, date_start, date_end):
+    def __init__(self, coordinates, date_start, date_end, map_cache=None, max_workers=4):
         if isinstance(coordinates, list):
             self.coordinates = coordinates
         else:
             self.coordinates = [float(coord.strip()) for coord in coordinates.split(',')]
         self.date_start = date_start
         self.date_end = date_end
+        self.map_cache = map_cache or MapCache()
+        self.max_workers = max_workers
         self.map_directory = os.path.join(os.getcwd(), 'Maps')  # Путь к папке с картами
         if not os.path.exists(self.map_directory):
             os.makedirs(self.map_directory)
@@ -26,76 +116,95 @@ class MapViewer:
         cloud_mask = qc.bitwiseAnd(1 << 0).eq(0)  # Предполагаем, что бит 0 - облака
         return image.updateMask(cloud_mask)
 
-    def create_map(self):
+    def _layer_key(self, layer, value):
+        params = dict(value=value, collection=layer['collection'], band=layer['band'], kind=layer['kind'],
+                      composite=layer['composite'], vis=layer['vis'],
+                      coordinates=[round(float(c), 6) for c in self.coordinates], buffer=REGION_BUFFER_METERS,
+                      date_start=str(self.date_start), date_end=str(self.date_end))
+        # Ссылки синтетического backend не смешиваются со ссылками Earth Engine
+        namespace = get_backend().cache_namespace
+        if namespace:
+            params['namespace'] = namespace
+        return self.map_cache.cache_key(**params)
+
+    def _station_point(self):
         point = ee.Geometry.Point(self.coordinates)
-        transformed_point = point.transform('SR-ORG:6974', 1000)
+        return point.transform('SR-ORG:6974', 1000)
 
-        lst_modis = ee.ImageCollection('MODIS/061/MYD11A1') \
-            .filterBounds(transformed_point) \
+    def _collection(self, layer, point):
+        mask = self.mask_jaxa_clouds if layer['mask'] == 'jaxa' else self.mask_modis_clouds
+        return ee.ImageCollection(layer['collection']) \
+            .filterBounds(point) \
             .filterDate(self.date_start, self.date_end) \
-            .map(self.mask_modis_clouds)
-
-        median_image = lst_modis.median()
-
-        region = transformed_point.buffer(50000)
-        image = median_image.clip(region)
-
-        tile_url = image.select('LST_Day_1km').getThumbUrl({
-            'min': -20, 'max': 40, 'palette': ['040274', '040281', '0502a3', '0502b8', '0502ce', '0502e6',
-                                               '0602ff', '235cb1', '307ef3', '269db1', '30c8e2', '32d3ef',
-                                               '3be285', '3ff38f', '86e26f', '3ae237', 'b5e22e', 'd6e21f',
-                                               'fff705', 'ffd611', 'ffb613', 'ff8b13', 'ff6e08', 'ff500d',
-                                               'ff0000', 'de0101', 'c21301', 'a71001', '911003']
-        })
-
+            .map(mask)
+
+    def _request(self, op, **params):
+        # Описание запроса для backend (ee_backend)
+        return {'op': op, 'coordinates': [round(float(c), 6) for c in self.coordinates],
+                'date_start': str(self.date_start), 'date_end': str(self.date_end), **params}
+
+    def _layer_url(self, layer):
+        # Граф строится только при промахе кэша; сетевой вызов один на слой
+        def live():
+            point = self._station_point()
+            collection = self._collection(layer, point)
+            if layer['kind'] == 'thumb':
+                image = collection.median().clip(point.buffer(REGION_BUFFER_METERS))
+                return image.select(layer['band']).getThumbUrl(layer['vis'])
+            composite = collection.mosaic() if layer['composite'] == 'mosaic' else collection.median()
+            return composite.select(layer['band']).getMapId(layer['vis'])['tile_fetcher'].url_format
+
+        request = self._request('layer_url', collection=layer['collection'], band=layer['band'],
+                                kind=layer['kind'], composite=layer['composite'], vis=layer['vis'])
+        return get_backend().call(request, live)
+
+    def _collection_sizes(self, layers):
+        # Все проверки наличия снимков одним запросом
+        def live():
+            point = self._station_point()
+            sizes = ee.Dictionary({layer['name']: self._collection(layer, point).size() for layer in layers})
+            return sizes.getInfo()
+
+        request = self._request('map_sizes', layers=[layer['name'] for layer in layers],
+                                collections=[layer['collection'] for layer in layers])
+        return get_backend().call(request, live)
+
+    @traced('map.layer_urls')
+    def layer_urls(self):
+        optional = [layer for layer in MAP_LAYERS if layer.get('optional')]
+        size_keys = {layer['name']: self._layer_key(layer, 'size') for layer in optional}
+        sizes = self.map_cache.get_many(size_keys.values())
+        missing_sizes = [layer for layer in optional if size_keys[layer['name']] not in sizes]
+        if missing_sizes:
+            fetched = self._collection_sizes(missing_sizes)
+            new_sizes = {size_keys[name]: size for name, size in fetched.items()}
+            self.map_cache.set_many(new_sizes, SIZE_TTL_SECONDS)
+            sizes.update(new_sizes)
+
+        layers = [layer for layer in MAP_LAYERS
+                  if not layer.get('optional') or sizes.get(size_keys[layer['name']], 0) > 0]
+        url_keys = {layer['name']: self._layer_key(layer, 'url') for layer in layers}
+        urls = self.map_cache.get_many(url_keys.values())
+        missing_urls = [layer for layer in layers if url_keys[layer['name']] not in urls]
+        if missing_urls:
+            # Слои запрашиваются параллельно: каждый getMapId/getThumbUrl - отдельный запрос
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                fetched = list(executor.map(self._layer_url, missing_urls))
+            new_urls = {url_keys[layer['name']]: url for layer, url in zip(missing_urls, fetched)}
+            self.map_cache.set_many(new_urls, URL_TTL_SECONDS)
+            urls.update(new_urls)
+        return [(layer['name'], urls[url_keys[layer['name']]]) for layer in layers]
+
+    @traced('map.create_map')
+    def create_map(self):
         map_center = [self.coordinates[1], self.coordinates[0]]
-        m = geemap.Map(center=map_center, zoom=12)
-
-        m.add_tile_layer(url=tile_url, name='MODIS MYD11A1')
-
-        modis = ee.ImageCollection('MODIS/061/MOD11A1') \
-            .filterBounds(transformed_point) \
-            .filterDate(self.date_start, self.date_end) \
-            .map(self.mask_modis_clouds)
-
-        temperature_image = modis.select('LST_Day_1km')
-
-        m.addLayer(temperature_image, {'min': 13000.0, 'max': 16500.0, 'palette': ['040274', '040281', '0502a3', '0502b8', '0502ce', '0502e6',
-                                                                                    '0602ff', '235cb1', '307ef3', '269db1', '30c8e2', '32d3ef',
-                                                                                    '3be285', '3ff38f', '86e26f', '3ae237', 'b5e22e', 'd6e21f',
-                                                                                    'fff705', 'ffd611', 'ffb613', 'ff8b13', 'ff6e08', 'ff500d',
-                                                                                    'ff0000', 'de0101', 'c21301', 'a71001', '911003']},
-                   'Land Surface Temperature MODIS/061/MOD11A1')
-
-        jaxa = ee.ImageCollection('JAXA/GCOM-C/L3/LAND/LST/V2') \
-            .filterBounds(transformed_point) \
-            .filterDate(self.date_start, self.date_end) \
-            .map(self.mask_jaxa_clouds)
-
-        if jaxa.size().getInfo() > 0:
-            jaxa_image = jaxa.median().select('LST_AVE')
-            m.addLayer(jaxa_image, {'min': 0, 'max': 40, 'palette': ['blue', 'green', 'red']}, 'JAXA GCOM-C LST')
-
-        oxford = ee.ImageCollection('Oxford/MAP/LST_Day_5km_Monthly') \
-            .filterBounds(transformed_point) \
-            .filterDate(self.date_start, self.date_end) \
-            .map(self.mask_modis_clouds)
-
-        if oxford.size().getInfo() > 0:
-            oxford_image = oxford.median().select('LST_Day')
-            m.addLayer(oxford_image, {'min': 0, 'max': 50, 'palette': ['blue', 'green', 'red']}, 'Oxford MAP LST Day')
-
-        mod21c3 = ee.ImageCollection('MODIS/061/MOD21C3') \
-            .filterBounds(transformed_point) \
-            .filterDate(self.date_start, self.date_end) \
-            .map(self.mask_modis_clouds)
-
-        mod21c3_image = mod21c3.median().select('LST_Day')
+        # Все слои добавляются готовыми ссылками, поэтому карте Earth Engine не нужен
+        m = geemap.Map(center=map_center, zoom=12, ee_initialize=False)
 
-        m.addLayer(mod21c3_image, {'min': 0, 'max': 50, 'palette': ['purple', 'blue', 'green', 'yellow', 'orange', 'red']}, 'MODIS MOD21C3 LST Day')
+        for name, url in self.layer_urls():
+            m.add_tile_layer(url=url, name=name)
 
-        landsat_tile_url = "https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}"
-        m.add_tile_layer(url=landsat_tile_url, name='Landsat')
+        m.add_tile_layer(url=SATELLITE_BASEMAP_URL, name='Landsat')
 
         return m
 
@@ -113,4 +222,4 @@ class MapViewer:
         elif save_map == "нет":
             print("Карта не сохранена.")
         else:
-            print("Некорректный ответ.")
\ No newline at end of file
+            print("Некорректный ответ.")
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+DISPLAY_COLUMNS = {
+    'satellite_name': 'Satellite Name',
+    'satellite_value': 'Satellite Value',
+    'satellite_datetime': 'Satellite Datetime',
+    'ground_value': 'Ground Value',
+    'ground_datetime': 'Ground Datetime',
+    'delta_minutes': 'Time Delta (min)',
+}
+
+
+def _categorical(value, size):
+    # Спутник, платформа и время суток хранятся кодами категорий, а не строкой на каждую пару
+    if value is None or isinstance(value, str):
+        return pd.Categorical.from_codes(np.zeros(size, dtype=np.int8), categories=[value or ''])
+    return pd.Categorical(value)
+
+
+class MatchTable:
+    # Пары спутник-земля в колонках NumPy: одна строка на пару вместо двух словарей
+    def __init__(self, satellite_datetime, satellite_value, ground_datetime, ground_value,
+                 satellite=None, platform=None, time_of_day=None):
+        self.satellite_datetime = np.asarray(satellite_datetime, dtype='datetime64[ns]')
+        self.satellite_value = np.asarray(satellite_value, dtype=np.float64)
+        self.ground_datetime = np.asarray(ground_datetime, dtype='datetime64[ns]')
+        self.ground_value = np.asarray(ground_value, dtype=np.float64)
+        size = len(self.satellite_value)
+        self.satellite = _categorical(satellite, size)
+        self.platform = _categorical(platform, size)
+        self.time_of_day = _categorical(time_of_day, size)
+
+    @classmethod
+    def from_paired(cls, paired, satellite=None, platform=None, time_of_day=None):
+        # Таблица match_nearest: datetime, value, ground_datetime, ground_value
+        return cls(paired['datetime'].to_numpy(dtype='datetime64[ns]'),
+                   paired['value'].to_numpy(dtype=np.float64),
+                   paired['ground_datetime'].to_numpy(dtype='datetime64[ns]'),
+                   paired['ground_value'].to_numpy(dtype=np.float64),
+                   satellite, platform, time_of_day)
+
+    @classmethod
+    def from_display_frame(cls, frame):
+        # Обратное display_frame: таблица пар, сохранённая в CSV/Excel
+        names = frame['Satellite Name'].astype(str).str.lower().str.split(' ', n=2, expand=True)
+        names = names.reindex(columns=range(3)).fillna('')
+        return cls(pd.to_datetime(frame['Satellite Datetime']).to_numpy(dtype='datetime64[ns]'),
+                   frame['Satellite Value'].to_numpy(dtype=np.float64),
+                   pd.to_datetime(frame['Ground Datetime']).to_numpy(dtype='datetime64[ns]'),
+                   frame['Ground Value'].to_numpy(dtype=np.float64),
+                   names[0].to_numpy(), names[1].to_numpy(), names[2].to_numpy())
+
+    @classmethod
+    def empty(cls, satellite=None, platform=None, time_of_day=None):
+        return cls([], [], [], [], satellite, platform, time_of_day)
+
+    @classmethod
+    def concat(cls, tables):
+        tables = list(tables)
+        if not tables:
+            return cls.empty()
+        return cls(np.concatenate([t.satellite_datetime for t in tables]),
+                   np.concatenate([t.satellite_value for t in tables]),
+                   np.concatenate([t.ground_datetime for t in tables]),
+                   np.concatenate([t.ground_value for t in tables]),
+                   pd.api.types.union_categoricals([t.satellite for t in tables]),
+                   pd.api.types.union_categoricals([t.platform for t in tables]),
+                   pd.api.types.union_categoricals([t.time_of_day for t in tables]))
+
+    def __len__(self):
+        return len(self.satellite_value)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    @property
+    def delta(self):
+        # Наземный отсчёт минус момент пролёта
+        return self.ground_datetime - self.satellite_datetime
+
+    @property
+    def difference(self):
+        return self.satellite_value - self.ground_value
+
+    def take(self, rows):
+        return MatchTable(self.satellite_datetime[rows], self.satellite_value[rows],
+                          self.ground_datetime[rows], self.ground_value[rows],
+                          self.satellite[rows], self.platform[rows], self.time_of_day[rows])
+
+    def labels(self):
+        # Подпись спутника для таблиц: "modis Aqua Day", "landsat"
+        parts = [pd.Series(self.satellite, dtype='category').astype(str)]
+        for column in (self.platform, self.time_of_day):
+            parts.append(pd.Series(column, dtype='category').astype(str).str.capitalize())
+        labels = parts[0] + ' ' + parts[1] + ' ' + parts[2]
+        return labels.str.strip().str.replace(r'\s+', ' ', regex=True)
+
+    def to_frame(self):
+        # Колонки ссылаются на массивы таблицы без копирования
+        return pd.DataFrame({
+            'satellite_datetime': self.satellite_datetime,
+            'satellite_value': self.satellite_value,
+            'ground_datetime': self.ground_datetime,
+            'ground_value': self.ground_value,
+            'satellite': self.satellite,
+            'platform': self.platform,
+            'time_of_day': self.time_of_day,
+        }, copy=False)
+
+    def display_frame(self):
+        # Таблица для консоли, CSV/Excel и отчёта с прежними заголовками
+        frame = pd.DataFrame({
+            'satellite_name': self.labels().to_numpy(),
+            'satellite_value': self.satellite_value,
+            'satellite_datetime': self.satellite_datetime,
+            'ground_value': self.ground_value,
+            'ground_datetime': self.ground_datetime,
+            'delta_minutes': self.delta / np.timedelta64(1, 'm'),
+        })
+        frame.insert(0, 'ID', np.arange(1, len(frame) + 1))
+        return frame.rename(columns=DISPLAY_COLUMNS)
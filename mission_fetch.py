@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+
+import pandas as pd
+
+from common_dates import required_columns
+from landsat_data import LandsatDataManager
+from modis_data import ModisDataManager
+from satellite_cache import SatelliteCache
+
+# Миссия -> спутник (набор колонок и правила сопоставления)
+MISSIONS = {
+    'landsat8': 'landsat',
+    'landsat9': 'landsat',
+    'aqua': 'modis',
+    'terra': 'modis',
+}
+# Одновременных запросов на миссию: медленная коллекция не должна занимать все потоки
+MISSION_CONCURRENCY = {'landsat8': 2, 'landsat9': 2, 'aqua': 2, 'terra': 2}
+
+
+def mission_manager(mission, columns=None, neighborhood=None):
+    if MISSIONS[mission] == 'landsat':
+        return LandsatDataManager([mission], columns, neighborhood)
+    return ModisDataManager([mission], columns, neighborhood)
+
+
+def tag_missions(frames):
+    # Таблицы миссий -> одна таблица с колонками satellite и platform, упорядоченная по дате съёмки
+    tagged = []
+    for mission, df in frames.items():
+        if df is None or df.empty:
+            continue
+        df = df.assign(satellite=MISSIONS[mission], platform=mission)
+        tagged.append(df)
+    if not tagged:
+        return pd.DataFrame(columns=['date', 'satellite', 'platform'])
+    tagged = pd.concat(tagged, ignore_index=True)
+    tagged = tagged.sort_values('date', kind='mergesort').reset_index(drop=True)
+    for column in ('satellite', 'platform'):
+        tagged[column] = tagged[column].astype('category')
+    return tagged
+
+
+class MissionFetcher:
+    # Все миссии станции запрашиваются одновременно (asyncio + потоки для синхронных запросов),
+    # поэтому общее время определяет самая медленная миссия, а не сумма
+    def __init__(self, satellite_cache=None, missions=tuple(MISSIONS), concurrency=None, full_bands=False,
+                 neighborhood=None):
+        unknown = [mission for mission in missions if mission not in MISSIONS]
+        if unknown:
+            raise ValueError(f"Invalid mission {unknown}. Please select from {', '.join(MISSIONS)}.")
+        self.satellite_cache = satellite_cache or SatelliteCache()
+        self.missions = tuple(missions)
+        self.concurrency = {**MISSION_CONCURRENCY, **(concurrency or {})}
+        self.managers = {mission: mission_manager(mission, None if full_bands else required_columns(MISSIONS[mission]),
+                                                  neighborhood)
+                         for mission in self.missions}
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def _get_dataframe(self, mission, coordinates, date_start, date_end):
+        started = time.perf_counter()
+        df = self.satellite_cache.get_dataframe(self.managers[mission], coordinates, date_start, date_end)
+        with self._lock:
+            self.timings.append({'mission': mission, 'coordinates': list(coordinates),
+                                 'rows': 0 if df is None else len(df), 'seconds': time.perf_counter() - started})
+        return df
+
+    async def _fetch_mission(self, semaphores, mission, coordinates, date_start, date_end):
+        async with semaphores[mission]:
+            return await asyncio.to_thread(self._get_dataframe, mission, coordinates, date_start, date_end)
+
+    async def fetch_stations_async(self, stations, date_start, date_end):
+        # stations: [(station_id, [lon, lat]), ...] -> {station_id: таблица всех миссий}
+        semaphores = {mission: asyncio.Semaphore(self.concurrency[mission]) for mission in self.missions}
+        keys = [(station_id, mission) for station_id, coordinates in stations for mission in self.missions]
+        frames = await asyncio.gather(*(
+            self._fetch_mission(semaphores, mission, coordinates, date_start, date_end)
+            for station_id, coordinates in stations for mission in self.missions))
+        by_station = {station_id: {} for station_id, coordinates in stations}
+        for (station_id, mission), df in zip(keys, frames):
+            by_station[station_id][mission] = df
+        return {station_id: tag_missions(missions) for station_id, missions in by_station.items()}
+
+    def fetch_stations(self, stations, date_start, date_end):
+        return asyncio.run(self.fetch_stations_async(stations, date_start, date_end))
+
+    def fetch(self, coordinates, date_start, date_end):
+        return self.fetch_stations([('station', coordinates)], date_start, date_end)['station']
+
+    def timing_table(self):
+        with self._lock:
+            return pd.DataFrame(self.timings, columns=['mission', 'coordinates', 'rows', 'seconds'])
@@ -0,0 +1,87 @@
+from ee_session import ee
+from satellite_data import SatelliteDataManager
+
+MODIS_COLLECTIONS = {
+    'aqua': 'MODIS/061/MYD11A1',
+    'terra': 'MODIS/061/MOD11A1',
+}
+
+
+class ModisDataManager(SatelliteDataManager):
+    __instance = None
+    platforms = ('aqua', 'terra')
+    columns = [
+        "LST_Day_1km",
+        "QC_Day",
+        "Day_view_time",
+        "Day_view_angle",
+        "LST_Night_1km",
+        "QC_Night",
+        "Night_view_time",
+        "Night_view_angle",
+        "Emis_31",
+        "Emis_32",
+        "Clear_day_cov",
+        "Clear_night_cov",
+        "system:time_start",
+        "platform",
+        "name"
+    ]
+    # Коэффициенты перевода DN в физические величины: значение = DN * scale + offset
+    scales = {
+        'LST_Day_1km': (0.02, -273.15),
+        'LST_Night_1km': (0.02, -273.15),
+        'Day_view_time': (0.1, 0),
+        'Night_view_time': (0.1, 0),
+        'Day_view_angle': (1, -65),
+        'Night_view_angle': (1, -65),
+        'Emis_31': (0.002, 0.49),
+        'Emis_32': (0.002, 0.49),
+        'Clear_day_cov': (0.0005, 0),
+        'Clear_night_cov': (0.0005, 0),
+    }
+    integer_columns = ['QC_Day', 'QC_Night']
+    view_time_columns = ['Day_view_time', 'Night_view_time']
+    window_bands = ['LST_Day_1km', 'LST_Night_1km']
+
+    def __init__(self, platforms=None, columns=None, neighborhood=None):
+        if platforms is not None:
+            self.platforms = tuple(sorted(p.lower() for p in platforms))
+        unknown = [p for p in self.platforms if p not in MODIS_COLLECTIONS]
+        if unknown:
+            raise ValueError(f"Invalid satellite_product {unknown}. Please select 'aqua' or 'terra'.")
+        # Одна коллекция — прежний ID, несколько — составной ключ для кэша
+        self.collection_id = '+'.join(MODIS_COLLECTIONS[p] for p in self.platforms)
+        super().__init__(columns, neighborhood)
+
+    def get_image_collection(self, coordinates, date_start, date_end):
+        point = self.region(coordinates)
+        transformed_point = point.transform('SR-ORG:6974', 1000)
+
+        def mask_clouds(image):
+            # Извлечение QC битов
+            qc = image.select('QC_Day')
+            cloud_mask = qc.bitwiseAnd(1 << 0).eq(0)  # Бит 0: облака
+            image = image.updateMask(cloud_mask)  # Применение маски облаков
+            return image
+
+        def tag_platform(platform):
+            return lambda image: image.set('platform', platform)
+
+        # Terra и Aqua объединяются в одну коллекцию, снимки помечаются платформой
+        lst = None
+        for platform in self.platforms:
+            collection = ee.ImageCollection(MODIS_COLLECTIONS[platform]) \
+                .filterBounds(transformed_point) \
+                .filterDate(date_start, date_end) \
+                .map(mask_clouds) \
+                .map(tag_platform(platform))
+            lst = collection if lst is None else lst.merge(collection)
+
+        return lst
+
+    def sample_image(self, image, point):
+        # Передаются исходные целочисленные DN, масштабирование выполняется на клиенте (scales);
+        # в выборку попадают только выбранные каналы и время съёмки
+        samples = self.sample_bands(image, point)
+        return samples.map(lambda feature: feature.set('platform', image.get('platform')))
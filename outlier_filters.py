@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+
+def _columns(column):
+    return (column,) if isinstance(column, str) else tuple(column)
+
+
+class OutlierFilter:
+    # Фильтр возвращает булеву маску оставляемых строк; несколько колонок
+    # (например, спутник и земля в парах) проверяются по общей статистике
+    name = 'filter'
+
+    def __init__(self, column='value'):
+        self.columns = _columns(column)
+
+    def bounds(self, values):
+        raise NotImplementedError
+
+    def mask(self, arrays):
+        pooled = np.concatenate([arrays[column] for column in self.columns])
+        low, high = self.bounds(pooled)
+        keep = np.ones(len(arrays[self.columns[0]]), dtype=bool)
+        for column in self.columns:
+            values = arrays[column]
+            keep &= (values >= low) & (values <= high)
+        return keep
+
+    def describe(self):
+        return f"{self.name}({', '.join(self.columns)})"
+
+
+class RangeFilter(OutlierFilter):
+    name = 'range'
+
+    def __init__(self, column='value', low=0.0, high=50.0):
+        super().__init__(column)
+        self.low = low
+        self.high = high
+
+    def bounds(self, values):
+        return self.low, self.high
+
+
+class SigmaFilter(OutlierFilter):
+    name = 'sigma'
+
+    def __init__(self, column='value', n_sigma=3.0, center=True):
+        super().__init__(column)
+        self.n_sigma = n_sigma
+        # center=False: граница n*std вокруг нуля (для модулей разностей)
+        self.center = center
+
+    def bounds(self, values):
+        if not np.isfinite(values).any():
+            return -np.inf, np.inf
+        std = np.nanstd(values)
+        mean = np.nanmean(values) if self.center else 0.0
+        return mean - self.n_sigma * std, mean + self.n_sigma * std
+
+
+class MadFilter(OutlierFilter):
+    name = 'mad'
+
+    def __init__(self, column='value', threshold=3.5):
+        super().__init__(column)
+        self.threshold = threshold
+
+    def bounds(self, values):
+        if not np.isfinite(values).any():
+            return -np.inf, np.inf
+        # Модифицированный z-score: 0.6745 * (x - медиана) / MAD
+        median = np.nanmedian(values)
+        mad = np.nanmedian(np.abs(values - median))
+        if mad == 0:
+            return median, median
+        spread = self.threshold * mad / 0.6745
+        return median - spread, median + spread
+
+
+class StepDiffFilter(OutlierFilter):
+    name = 'step'
+
+    def __init__(self, column='value', max_step=10.0):
+        super().__init__(column)
+        self.max_step = max_step
+
+    def mask(self, arrays):
+        # Скачок между соседними отсчётами ряда (ряд должен быть упорядочен по времени);
+        # последний отсчёт сравнивается с предыдущим
+        keep = None
+        for column in self.columns:
+            values = arrays[column]
+            if len(values) < 2:
+                column_keep = np.isfinite(values)
+            else:
+                step = np.abs(np.diff(values))
+                column_keep = np.append(step, step[-1]) <= self.max_step
+            keep = column_keep if keep is None else keep & column_keep
+        return keep
+
+
+class FilterChain:
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def run(self, df):
+        # Каждый этап работает над строками, оставшимися после предыдущего;
+        # результат - номера строк исходной таблицы и число удалённых на каждом этапе
+        columns = {column for stage in self.filters for column in stage.columns}
+        arrays = {column: df[column].to_numpy(dtype=np.float64) for column in columns}
+        rows = np.arange(len(df))
+        report = []
+        for stage in self.filters:
+            keep = stage.mask({column: values[rows] for column, values in arrays.items()})
+            report.append({'stage': stage.describe(), 'removed': int(len(rows) - keep.sum()),
+                           'remaining': int(keep.sum())})
+            rows = rows[keep]
+        return rows, pd.DataFrame(report, columns=['stage', 'removed', 'remaining'])
+
+    def mask(self, df):
+        rows, report = self.run(df)
+        keep = np.zeros(len(df), dtype=bool)
+        keep[rows] = True
+        return keep
+
+    def apply(self, df):
+        rows, report = self.run(df)
+        return df.iloc[rows], report
+
+
+def ground_filters(low=0.0, high=50.0, max_step=10.0, n_sigma=3.0):
+    # Допустимый диапазон температур, резкие скачки логгера, затем 3 сигмы
+    return FilterChain([
+        RangeFilter('value', low, high),
+        StepDiffFilter('value', max_step),
+        SigmaFilter('value', n_sigma),
+    ])
+
+
+def match_filters(n_sigma=3.0):
+    # Пары с выбросом в любом из значений, затем пары с аномальной разницей
+    return FilterChain([
+        SigmaFilter(('value', 'ground_value'), n_sigma),
+        SigmaFilter('abs_difference', n_sigma, center=False),
+    ])
@@ -1,21 +1,246 @@
 import os
+import re
+import threading
+import time
+import zipfile
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
-def create_csv(df):
-    file_name = input("Введите название файла CSV для сохранения (без расширения): ")
-    file_name += ".csv"
-    df.to_csv(file_name, index=False)
-    print(f"Таблица сохранена в {file_name}")
+from tracing import span
 
-def create_excel(df, folder=None):
-    file_name = input("Введите название файла Excel для сохранения (без расширения): ")
-    file_name += ".xlsx"
+EXPORT_FORMATS = ('csv', 'excel', 'parquet', 'feather')
+EXPORT_EXTENSIONS = {'csv': '.csv', 'excel': '.xlsx', 'parquet': '.parquet', 'feather': '.feather'}
+# Сжатие CSV (pandas compression) и расширение файла; gzip с уровнем 6 - вдвое быстрее уровня 9 по умолчанию
+CSV_COMPRESSION = {
+    'gzip': ({'method': 'gzip', 'compresslevel': 6}, '.gz'),
+    'bz2': ({'method': 'bz2'}, '.bz2'),
+    'xz': ({'method': 'xz'}, '.xz'),
+    'zip': ({'method': 'zip'}, '.zip'),
+}
+# Строк в одной порции записи CSV и XLSX: память не зависит от размера таблицы
+EXPORT_CHUNK_ROWS = 50_000
+# Строк данных на листе Excel (1 048 576 с заголовком); остальное - на следующих листах
+EXCEL_MAX_ROWS = 1_048_575
+EXCEL_SHEET_NAME_LENGTH = 31
+EXPORT_DIRECTORY = 'Tables'
 
-    if folder:
-        file_path = os.path.join(folder, file_name)
+
+# Дата Excel - число суток от 1899-12-30
+EXCEL_EPOCH = np.datetime64('1899-12-30', 'ns')
+# Символы, недопустимые в XML 1.0
+XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+XLSX_NAMESPACE = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_RELATIONSHIPS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XLSX_CONTENT_TYPES = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+XLSX_STYLES = (f'<styleSheet xmlns="{XLSX_NAMESPACE}">'
+               '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+               '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+               '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+               '<fill><patternFill patternType="gray125"/></fill></fills>'
+               '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+               '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+               '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+               '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+               '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+               '</styleSheet>')
+
+
+def _xml_text(values):
+    text = pd.Series(values, dtype=object).fillna('').astype(str)
+    text = text.str.replace('&', '&amp;', regex=False).str.replace('<', '&lt;', regex=False) \
+        .str.replace('>', '&gt;', regex=False).str.replace('"', '&quot;', regex=False)
+    return text.str.replace(XML_ILLEGAL, '', regex=True).to_numpy(dtype=object)
+
+
+def _excel_cells(column):
+    # XML ячеек колонки целиком, без обхода по ячейкам: числа и даты (сутки от 1899-12-30 со стилем даты)
+    # - <v>, остальное - строка inlineStr; NaN/NaT/inf - пустая ячейка
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        column = column.dt.tz_localize(None)
+    if pd.api.types.is_bool_dtype(column.dtype):
+        missing = column.isna().to_numpy()
+        text = np.where(column.fillna(False).to_numpy(dtype=bool), '1', '0').astype(object)
+        prefix, suffix = '<c t="b"><v>', '</v></c>'
+    elif pd.api.types.is_datetime64_any_dtype(column.dtype):
+        values = column.to_numpy(dtype='datetime64[ns]')
+        missing = np.isnat(values)
+        days = (values - EXCEL_EPOCH) / np.timedelta64(1, 'D')
+        text = np.round(days, 10).astype(str).astype(object)
+        prefix, suffix = '<c s="1"><v>', '</v></c>'
+    elif pd.api.types.is_integer_dtype(column.dtype) and not column.hasnans:
+        missing = np.zeros(len(column), dtype=bool)
+        text = column.to_numpy().astype(str).astype(object)
+        prefix, suffix = '<c><v>', '</v></c>'
+    elif pd.api.types.is_numeric_dtype(column.dtype):
+        values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing = ~np.isfinite(values)
+        text = values.astype(str).astype(object)
+        prefix, suffix = '<c><v>', '</v></c>'
     else:
-        file_path = file_name
+        missing = column.isna().to_numpy()
+        text = _xml_text(column.to_numpy(dtype=object))
+        prefix, suffix = '<c t="inlineStr"><is><t xml:space="preserve">', '</t></is></c>'
+    cells = prefix + text + suffix
+    cells[missing] = '<c/>'
+    return cells
+
+
+def _sheet_title(title, used):
+    title = re.sub(r'[\[\]:*?/\\]', '_', str(title))[:EXCEL_SHEET_NAME_LENGTH] or 'Sheet'
+    base, number = title, 2
+    while title.lower() in used:
+        suffix = f'_{number}'
+        title = base[:EXCEL_SHEET_NAME_LENGTH - len(suffix)] + suffix
+        number += 1
+    used.add(title.lower())
+    return title
+
+
+def write_excel(tables, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    # Потоковая запись XLSX: XML листа собирается порциями из колонок целиком и сразу сжимается в архив,
+    # поэтому память не зависит от размера таблицы (openpyxl тратит ~30 мкс на ячейку и держит дерево ячеек);
+    # tables - {лист: таблица}, строки сверх лимита Excel уходят на следующие листы
+    titles = []
+    used = set()
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for sheet_name, df in tables.items():
+            for part, sheet_start in enumerate(range(0, max(len(df), 1), EXCEL_MAX_ROWS)):
+                titles.append(_sheet_title(sheet_name if part == 0 else f'{sheet_name}_{part + 1}', used))
+                sheet_end = min(sheet_start + EXCEL_MAX_ROWS, len(df))
+                with archive.open(f'xl/worksheets/sheet{len(titles)}.xml', 'w', force_zip64=True) as sheet:
+                    sheet.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                                f'<worksheet xmlns="{XLSX_NAMESPACE}"><sheetData>'.encode('utf-8'))
+                    header = _excel_cells(pd.Series(df.columns.astype(str), dtype=object))
+                    sheet.write(('<row>' + ''.join(header) + '</row>\n').encode('utf-8'))
+                    for start in range(sheet_start, sheet_end, chunk_rows):
+                        chunk = df.iloc[start:min(start + chunk_rows, sheet_end)]
+                        rows = '<row>'
+                        for name in range(len(chunk.columns)):
+                            rows = rows + _excel_cells(chunk.iloc[:, name])
+                        sheet.write(('\n'.join(rows + '</row>') + '\n').encode('utf-8'))
+                    sheet.write(b'</sheetData></worksheet>')
+
+        sheets = ''.join(f'<sheet name="{_xml_text([title])[0]}" sheetId="{number}" r:id="rId{number}"/>'
+                         for number, title in enumerate(titles, 1))
+        archive.writestr('xl/workbook.xml', f'<workbook xmlns="{XLSX_NAMESPACE}" xmlns:r="{XLSX_RELATIONSHIPS}">'
+                                            f'<sheets>{sheets}</sheets></workbook>')
+        relationships = ''.join(
+            f'<Relationship Id="rId{number}" Type="{XLSX_RELATIONSHIPS}/worksheet" '
+            f'Target="worksheets/sheet{number}.xml"/>' for number in range(1, len(titles) + 1))
+        archive.writestr('xl/_rels/workbook.xml.rels',
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         f'{relationships}<Relationship Id="rId{len(titles) + 1}" '
+                         f'Type="{XLSX_RELATIONSHIPS}/styles" Target="styles.xml"/></Relationships>')
+        archive.writestr('xl/styles.xml', XLSX_STYLES)
+        archive.writestr('_rels/.rels',
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         f'<Relationship Id="rId1" Type="{XLSX_RELATIONSHIPS}/officeDocument" '
+                         'Target="xl/workbook.xml"/></Relationships>')
+        overrides = ''.join(f'<Override PartName="/xl/worksheets/sheet{number}.xml" '
+                            f'ContentType="{XLSX_CONTENT_TYPES}.worksheet+xml"/>'
+                            for number in range(1, len(titles) + 1))
+        archive.writestr('[Content_Types].xml',
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="rels" '
+                         'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                         '<Default Extension="xml" ContentType="application/xml"/>'
+                         f'<Override PartName="/xl/workbook.xml" ContentType="{XLSX_CONTENT_TYPES}.sheet.main+xml"/>'
+                         f'<Override PartName="/xl/styles.xml" ContentType="{XLSX_CONTENT_TYPES}.styles+xml"/>'
+                         f'{overrides}</Types>')
+
+
+def write_csv(df, path, chunk_rows=EXPORT_CHUNK_ROWS, compression=None):
+    options = CSV_COMPRESSION[compression][0] if compression else None
+    df.to_csv(path, index=False, chunksize=chunk_rows, compression=options)
+
+
+def write_table(df, path, export_format, chunk_rows=EXPORT_CHUNK_ROWS, compression=None):
+    if export_format == 'csv':
+        write_csv(df, path, chunk_rows, compression)
+    elif export_format == 'excel':
+        write_excel({'Sheet1': df}, path, chunk_rows)
+    elif export_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif export_format == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError(f"Invalid export format {export_format!r}. Please select one of {', '.join(EXPORT_FORMATS)}.")
+
+
+class TableExporter:
+    # Выгрузка таблиц без вопросов об имени файла: имя - название таблицы (с меткой времени при stamp=True);
+    # время записи и размер каждого файла сохраняются в records
+    def __init__(self, folder=EXPORT_DIRECTORY, compression=None, chunk_rows=EXPORT_CHUNK_ROWS, stamp=True):
+        if compression and compression not in CSV_COMPRESSION:
+            raise ValueError(f"Invalid compression {compression!r}. "
+                             f"Please select one of {', '.join(CSV_COMPRESSION)}.")
+        self.folder = folder
+        self.compression = compression
+        self.chunk_rows = chunk_rows
+        self.stamp = stamp
+        self.records = []
+        self._lock = threading.Lock()
+
+    def path(self, name, export_format):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Invalid export format {export_format!r}. "
+                             f"Please select one of {', '.join(EXPORT_FORMATS)}.")
+        extension = EXPORT_EXTENSIONS[export_format]
+        if export_format == 'csv' and self.compression:
+            extension += CSV_COMPRESSION[self.compression][1]
+        if self.stamp:
+            name = f'{name}_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}'
+        path = os.path.join(self.folder, f'{name}{extension}') if self.folder else f'{name}{extension}'
+        if not self.stamp:
+            return path
+        # Две выгрузки в одну секунду не перезаписывают друг друга
+        base, number = path[:-len(extension)], 2
+        while os.path.exists(path):
+            path = f'{base}_{number}{extension}'
+            number += 1
+        return path
+
+    def export(self, df, name, export_format):
+        return self._write({name: df}, name, export_format)
+
+    def export_tables(self, tables, name, export_format):
+        # Excel - одна книга с листом на таблицу, остальные форматы - файл на таблицу (<name>_<таблица>)
+        if export_format == 'excel':
+            return [self._write(tables, name, export_format)]
+        return [self._write({table: df}, f'{name}_{table}', export_format) for table, df in tables.items()]
+
+    def _write(self, tables, name, export_format):
+        if self.folder:
+            os.makedirs(self.folder, exist_ok=True)
+        path = self.path(name, export_format)
+        rows = sum(len(df) for df in tables.values())
+        with span('export', format=export_format, rows=rows) as export_span:
+            started = time.perf_counter()
+            if export_format == 'excel':
+                write_excel(tables, path, self.chunk_rows)
+            else:
+                write_table(next(iter(tables.values())), path, export_format, self.chunk_rows, self.compression)
+            seconds = time.perf_counter() - started
+            size = os.path.getsize(path)
+            export_span.set(bytes=size)
+        with self._lock:
+            self.records.append({'table': name, 'format': export_format, 'path': path, 'rows': rows,
+                                 'columns': sum(len(df.columns) for df in tables.values()), 'bytes': size,
+                                 'seconds': seconds})
+        print(f"Table saved to {path} ({rows} rows, {size / 2 ** 20:.2f} MB, {seconds:.2f} s)")
+        return path
+
+    def timing_table(self):
+        with self._lock:
+            return pd.DataFrame(self.records, columns=['table', 'format', 'path', 'rows', 'columns', 'bytes',
+                                                       'seconds'])
+
+
+def create_csv(df, folder=None, file_name='table', compression=None):
+    return TableExporter(folder, compression).export(df, file_name, 'csv')
+
 
-    df.to_excel(file_path, index=False)
-    print(f"Таблица сохранена в {file_path}")
+def create_excel(df, folder=None, file_name='table'):
+    return TableExporter(folder).export(df, file_name, 'excel')
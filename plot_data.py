@@ -1,40 +1,98 @@
+import argparse
+import glob
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
 import numpy as np
-from scipy.stats import linregress
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from match_table import MatchTable
+from tracing import traced
 
 
-def plot_data(satellite_name, matches, time_interval_minutes=None, satellite_product=None, time_of_day=None):
+# Больше точек на временных панелях не различимо глазом: ряды прореживаются
+MAX_PLOT_POINTS = 2000
+# Выше этого числа пар диаграмма рассеяния рисуется как hexbin (плотность)
+HEXBIN_THRESHOLD = 5000
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: из каждой корзины берётся точка, образующая наибольший
+    # треугольник с предыдущей выбранной точкой и средним следующей корзины
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x).astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = [0]
+    previous = 0
+    for i in range(len(edges) - 1):
+        start, end = edges[i], edges[i + 1]
+        if end <= start:
+            continue
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        average_x, average_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected.append(previous)
+    selected.append(n - 1)
+    return np.asarray(selected)
+
+
+def minmax_indices(x, y, n_out):
+    # Минимум и максимум в каждой корзине: сохраняет пики ряда, полностью векторно
+    n = len(y)
+    buckets = max(1, n_out // 2)
+    if n_out >= n:
+        return np.arange(n)
+    size = int(np.ceil(n / buckets))
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    valid = ~np.all(np.isnan(padded), axis=1)
+    padded, offsets = padded[valid], offsets[valid]
+    indices = np.concatenate([offsets + np.nanargmin(padded, axis=1), offsets + np.nanargmax(padded, axis=1)])
+    return np.unique(indices)
+
+
+def downsample(x, y, max_points=MAX_PLOT_POINTS, method='lttb'):
+    if max_points is None or len(y) <= max_points:
+        return np.arange(len(y))
+    if method == 'minmax':
+        return minmax_indices(x, y, max_points)
+    return lttb_indices(x, y, max_points)
+
+
+@traced('plot_data')
+def plot_data(satellite_name, matches, time_interval_minutes=None, satellite_product=None, time_of_day=None,
+              save_path=None, show=True, headless=False, max_points=MAX_PLOT_POINTS,
+              hexbin_threshold=HEXBIN_THRESHOLD, downsample_method='lttb'):
+    # headless: Figure без pyplot - ни окон, ни вопросов; подходит для рабочих процессов
+    from scipy.stats import linregress
     if matches:
-        if satellite_name.lower() == 'landsat':
-            fig, axes = plt.subplots(nrows=2, ncols=1, figsize=(12, 8), gridspec_kw={'hspace': 0.5})
+        nrows, figsize = (2, (12, 8)) if satellite_name.lower() == 'landsat' else (3, (12, 12))
+        if headless:
+            fig = Figure(figsize=figsize)
+            axes = fig.subplots(nrows=nrows, ncols=1, gridspec_kw={'hspace': 0.5})
         else:
-            fig, axes = plt.subplots(nrows=3, ncols=1, figsize=(12, 12), gridspec_kw={'hspace': 0.5})
+            import matplotlib.pyplot as plt
+            fig, axes = plt.subplots(nrows=nrows, ncols=1, figsize=figsize, gridspec_kw={'hspace': 0.5})
 
         # First plot: Ground vs Satellite data comparison
         ax1 = axes[0]
-        satellite_x = []  # Satellite data
-        satellite_y = []
-        ground_x = []  # Ground measurement data
-        ground_y = []
-
-        for match in matches:
-            if match['source'].startswith('Satellite'):
-                satellite_x.append(pd.to_datetime(match['datetime']))
-                satellite_y.append(float(match['value']))
-            else:
-                ground_x.append(pd.to_datetime(match['datetime']))
-                ground_y.append(float(match['value']))
-
-        min_len = min(len(satellite_x), len(ground_x), len(satellite_y), len(ground_y))
-        satellite_x = satellite_x[:min_len]
-        satellite_y = satellite_y[:min_len]
-        ground_x = ground_x[:min_len]
-        ground_y = ground_y[:min_len]
-
-        ax1.plot(satellite_x, satellite_y, marker='o', linestyle='', color='red', label='Satellite')
-        ax1.plot(ground_x, ground_y, marker='o', linestyle='', color='blue', label='Ground Measurement')
+        satellite_x = matches.satellite_datetime  # Satellite data
+        satellite_y = matches.satellite_value
+        ground_x = matches.ground_datetime  # Ground measurement data
+        ground_y = matches.ground_value
+        satellite_rows = downsample(satellite_x, satellite_y, max_points, downsample_method)
+        ground_rows = downsample(ground_x, ground_y, max_points, downsample_method)
+
+        ax1.plot(satellite_x[satellite_rows], satellite_y[satellite_rows], marker='o', linestyle='', color='red',
+                 label='Satellite')
+        ax1.plot(ground_x[ground_rows], ground_y[ground_rows], marker='o', linestyle='', color='blue',
+                 label='Ground Measurement')
         ax1.set_ylabel('Temperature (°C)')
         ax1.set_title('Comparison of Ground Measurement with Satellites')
         ax1.grid(True)
@@ -44,17 +102,23 @@ def plot_data(satellite_name, matches, time_interval_minutes=None, satellite_pro
         if satellite_name.lower() == 'modis' and satellite_product and time_of_day:
             satellite_info += f'\nType: {satellite_product.capitalize()} {time_of_day.capitalize()}'
             satellite_info += f'\nTime Interval: {time_interval_minutes} minutes'
+        if len(satellite_rows) < len(matches):
+            satellite_info += f'\nShown: {len(satellite_rows)} of {len(matches)} points'
 
         ax1.text(0.05, 0.95, satellite_info, transform=ax1.transAxes,
                  verticalalignment='top', bbox=dict(facecolor='white', alpha=0.5))
 
-        # Second plot: Scatter plot
+        # Second plot: Scatter plot (density above the threshold)
         ax2 = axes[1]
 
-        ax2.scatter(ground_y, satellite_y, color='green', alpha=0.5)
-        ax2.axhline((max(satellite_y) + min(satellite_y)) / 2, color='black', linestyle='--')
-        ax2.axvline((max(ground_y) + min(ground_y)) / 2, color='black', linestyle='--')
-        ax2.plot([min(ground_y), max(ground_y)], [min(satellite_y), max(satellite_y)], color='gray', linestyle='--')
+        if hexbin_threshold is not None and len(matches) > hexbin_threshold:
+            density = ax2.hexbin(ground_y, satellite_y, gridsize=60, mincnt=1, cmap='viridis')
+            fig.colorbar(density, ax=ax2, label='Matches')
+        else:
+            ax2.scatter(ground_y, satellite_y, color='green', alpha=0.5)
+        ax2.axhline((satellite_y.max() + satellite_y.min()) / 2, color='black', linestyle='--')
+        ax2.axvline((ground_y.max() + ground_y.min()) / 2, color='black', linestyle='--')
+        ax2.plot([ground_y.min(), ground_y.max()], [satellite_y.min(), satellite_y.max()], color='gray', linestyle='--')
 
         slope, intercept, r_value, p_value, std_err = linregress(ground_y, satellite_y)
         regression_eqn = f'Regression Line: y = {slope:.2f}x + {intercept:.2f}\nR-squared: {r_value ** 2:.2f}'
@@ -71,38 +135,139 @@ def plot_data(satellite_name, matches, time_interval_minutes=None, satellite_pro
         if satellite_name.lower() != 'landsat':
             ax3 = axes[2]
 
-            all_temperatures = ground_y + satellite_y
+            all_temperatures = np.concatenate([ground_y, satellite_y])
             mode_all = pd.Series(all_temperatures).mode()[0]
 
-            ax3.plot(ground_x + satellite_x, [mode_all] * (len(ground_x) + len(satellite_x)), linestyle='--',
+            # Горизонтальная линия и линейные тренды: достаточно крайних точек по времени
+            all_times = np.concatenate([ground_x, satellite_x])
+            ax3.plot([all_times.min(), all_times.max()], [mode_all, mode_all], linestyle='--',
                      color='black', label=f'Mode: {mode_all}')
 
-            trend_ground = np.polyfit(range(len(ground_y)), ground_y, 1)
-            trend_satellite = np.polyfit(range(len(satellite_y)), satellite_y, 1)
-            ax3.plot(ground_x, np.polyval(trend_ground, range(len(ground_y))), linestyle=':', color='blue',
-                     label='Ground Trend')
-            ax3.plot(satellite_x, np.polyval(trend_satellite, range(len(satellite_y))), linestyle=':', color='red',
-                     label='Satellite Trend')
+            positions = np.arange(len(matches))
+            trend_ground = np.polyfit(positions, ground_y, 1)
+            trend_satellite = np.polyfit(positions, satellite_y, 1)
+            ax3.plot(ground_x[ground_rows], np.polyval(trend_ground, positions[ground_rows]), linestyle=':',
+                     color='blue', label='Ground Trend')
+            ax3.plot(satellite_x[satellite_rows], np.polyval(trend_satellite, positions[satellite_rows]),
+                     linestyle=':', color='red', label='Satellite Trend')
 
             ax3.set_ylabel('Temperature (°C)')
             ax3.set_title('Mode and Trend of Ground vs. Satellite Temperature')
             ax3.grid(True)
             ax3.legend()
 
-        # Prompt user to save the plot
-        save_plot = input("Хотите сохранить график? (да/нет): ").strip().lower()
-        if save_plot == 'да':
+        # Без пути сохранения спрашиваем пользователя, иначе сохраняем молча (пакетный режим)
+        if save_path is None and headless:
+            os.makedirs('Graphics', exist_ok=True)
+            current_time = pd.Timestamp.now().strftime("%Y-%m-%d_%H-%M-%S")
+            save_path = f'Graphics/{satellite_name}_comparison_{satellite_product}_{time_of_day}_{time_interval_minutes}_{current_time}.png'
+        if save_path is not None:
+            fig.savefig(save_path)
+            print(f"Plot saved as {save_path}")
+        elif input("Хотите сохранить график? (да/нет): ").strip().lower() == 'да':
             if not os.path.exists('Graphics'):
                 os.makedirs('Graphics')
             current_time = pd.Timestamp.now().strftime("%Y-%m-%d_%H-%M-%S")
-            plt.savefig(
-                f'Graphics/{satellite_name}_comparison_{satellite_product}_{time_of_day}_{time_interval_minutes}_{current_time}.png')
-            print(
-                f"Plot saved as Graphics/{satellite_name}_comparison_{satellite_product}_{time_of_day}_{time_interval_minutes}_{current_time}.png")
+            # Путь возвращается, чтобы отчёт вставил этот же график
+            save_path = f'Graphics/{satellite_name}_comparison_{satellite_product}_{time_of_day}_{time_interval_minutes}_{current_time}.png'
+            fig.savefig(save_path)
+            print(f"Plot saved as {save_path}")
 
-        plt.show()
-        plt.close(fig)
+        if not headless:
+            if show:
+                plt.show()
+            plt.close(fig)
+        return save_path
     else:
         print("No matches found.")
+        return None
+
+
+def plot_tolerance_sweep(sweep, satellite_name='', save_path=None, show=True):
+    # RMSE/MBE и число пар в зависимости от временного промежутка; для MODIS All - линия на комбинацию
+    if sweep.empty:
+        print("No matches found.")
+        return None
+    import matplotlib.pyplot as plt
+    fig, (ax1, ax2) = plt.subplots(nrows=2, ncols=1, figsize=(10, 8), sharex=True, gridspec_kw={'hspace': 0.3})
+    if 'Platform' in sweep.columns:
+        groups = sweep.groupby(['Platform', 'Time of Day'], sort=False)
+    else:
+        groups = [((satellite_name.capitalize(),), sweep)]
+    for key, group in groups:
+        label = ' '.join(key)
+        line, = ax1.plot(group['tolerance'], group['rmse'], marker='o', label=f'RMSE {label}')
+        ax1.plot(group['tolerance'], group['mbe'], marker='s', linestyle='--', color=line.get_color(),
+                 label=f'MBE {label}')
+        ax2.plot(group['tolerance'], group['matches'], marker='o', color=line.get_color(), label=label)
+    ax1.axhline(0, color='black', linewidth=0.8)
+    ax1.set_ylabel('Temperature (°C)')
+    ax1.set_title('RMSE and MBE by Time Interval')
+    ax1.grid(True)
+    ax1.legend()
+    ax2.set_xlabel('Time Interval (minutes)')
+    ax2.set_ylabel('Matches')
+    ax2.grid(True)
+    ax2.legend()
+
+    if save_path is not None:
+        fig.savefig(save_path)
+        print(f"Plot saved as {save_path}")
+    if show:
+        plt.show()
+    plt.close(fig)
+    return save_path
+
+
+def _render_task(task):
+    matches = MatchTable.from_display_frame(pd.read_csv(task['matches_file']))
+    return plot_data(task['satellite_name'], matches, task.get('time_interval_minutes'),
+                     task.get('satellite_product'), task.get('time_of_day'), save_path=task['save_path'],
+                     show=False, headless=True, max_points=task.get('max_points', MAX_PLOT_POINTS),
+                     hexbin_threshold=task.get('hexbin_threshold', HEXBIN_THRESHOLD))
+
+
+def batch_plot_tasks(output_dir):
+    # Задания перерисовки для папки пакетного запуска: <станция>/matches_<прогон>.csv
+    tasks = []
+    for matches_file in sorted(glob.glob(os.path.join(output_dir, '*', 'matches_*.csv'))):
+        job_dir = os.path.dirname(matches_file)
+        label = os.path.basename(matches_file)[len('matches_'):-len('.csv')]
+        parts = label.split('_') + [None, None]
+        tolerance = None
+        metrics_file = os.path.join(job_dir, 'metrics.csv')
+        if os.path.exists(metrics_file):
+            metrics = pd.read_csv(metrics_file)
+            tolerance = metrics.loc[metrics['run'] == label, 'tolerance'].dropna()
+            tolerance = int(tolerance.iloc[0]) if len(tolerance) else None
+        tasks.append({'matches_file': matches_file, 'satellite_name': parts[0], 'satellite_product': parts[1],
+                      'time_of_day': parts[2], 'time_interval_minutes': tolerance,
+                      'save_path': os.path.join(job_dir, f'plot_{label}.png')})
+    return tasks
+
+
+def render_plots(tasks, workers=None):
+    # Графики многих станций рисуются параллельно в отдельных процессах (без pyplot)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_task, tasks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перерисовка графиков пакетного запуска без окон")
+    parser.add_argument('output_dir', help="Папка результатов batch_runner")
+    parser.add_argument('--workers', type=int, default=None, help="Число процессов")
+    parser.add_argument('--max-points', type=int, default=MAX_PLOT_POINTS,
+                        help="Максимум точек на временных панелях")
+    parser.add_argument('--hexbin-threshold', type=int, default=HEXBIN_THRESHOLD,
+                        help="Число пар, начиная с которого рисуется hexbin")
+    args = parser.parse_args()
+
+    tasks = batch_plot_tasks(args.output_dir)
+    for task in tasks:
+        task.update(max_points=args.max_points, hexbin_threshold=args.hexbin_threshold)
+    render_plots(tasks, args.workers)
+    print(f"Rendered {len(tasks)} plots")
 
 
+if __name__ == "__main__":
+    main()
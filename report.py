@@ -1,31 +1,78 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet
-from rsme_mbe import calculate_rmse_mbe
-
-def create_pdf_report(df, matches, satellite_name, start_date, end_date, coordinates, time_interval_minutes=None,
-                      satellite_product=None, time_of_day=None):
-    # Prompt user if they want to save the report
-    save_report = input("Хотите сохранить отчёт? (да/нет) ").strip().lower()
-    if save_report != 'да':
-        print("Report generation canceled.")
-        return
-
-    # Create Reports and Graphics directories if they do not exist
-    if not os.path.exists('Reports'):
-        os.makedirs('Reports')
-    if not os.path.exists('Graphics'):
-        os.makedirs('Graphics')
-
-    # Generate a timestamped filename for the PDF report
+from tracing import span, traced
+from validation_stats import GroupedStats, match_statistics
+
+# Сколько пар попадает в таблицу отчёта; полный набор сохраняется в таблицы CSV/Excel
+MAX_TABLE_ROWS = 200
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+# Отчёты строятся в фоне по одному, чтобы консоль не ждала reportlab
+_report_executor = None
+_pending_reports = []
+
+
+def _long_table(frame, float_format='{:.3f}'):
+    # LongTable с повтором заголовка переносится на следующие страницы
+    rows = [[float_format.format(value) if isinstance(value, (float, np.floating)) else str(value)
+             for value in row] for row in frame.itertuples(index=False)]
+    table = LongTable([list(map(str, frame.columns))] + rows, repeatRows=1)
+    table.setStyle(TABLE_STYLE)
+    return table
+
+
+def satellite_summary(df):
+    # Сводка по колонкам спутниковой таблицы вместо вывода всех строк
+    numeric = df.select_dtypes('number')
+    if numeric.empty:
+        return pd.DataFrame(columns=['Column', 'Count', 'Mean', 'Std', 'Min', 'Max'])
+    summary = numeric.describe().T[['count', 'mean', 'std', 'min', 'max']].reset_index()
+    summary.columns = ['Column', 'Count', 'Mean', 'Std', 'Min', 'Max']
+    summary['Count'] = summary['Count'].astype(int)
+    return summary
+
+
+def _timeseries_image(matches, satellite_name, graphics_dir, current_time):
+    # Запасной график, если plot_data не сохранял изображений; Figure без pyplot безопасна в потоке
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.plot(matches.satellite_datetime, matches.satellite_value, label='Satellite', marker='o', linestyle='-',
+            color='red')
+    ax.plot(matches.satellite_datetime, matches.ground_value, label='Ground', marker='o', linestyle='-',
+            color='blue')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Value')
+    ax.set_title(f'{satellite_name} vs Ground Values')
+    ax.legend()
+    ax.grid(True)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    plot_file_name = os.path.join(graphics_dir, f"{satellite_name}_plot_{current_time}.png")
+    fig.savefig(plot_file_name)
+    return plot_file_name
+
+
+@traced('create_pdf_report')
+def build_pdf_report(pdf_file_name, df, matches, satellite_name, start_date, end_date, coordinates,
+                     time_interval_minutes=None, satellite_product=None, time_of_day=None, plot_images=None,
+                     max_rows=MAX_TABLE_ROWS, graphics_dir='Graphics'):
     current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    pdf_file_name = f"Reports/{satellite_name}_report_{start_date}_{end_date}_{current_time}.pdf"
 
     # Setup the PDF document
     doc = SimpleDocTemplate(pdf_file_name, pagesize=letter)
@@ -38,98 +85,102 @@ def create_pdf_report(df, matches, satellite_name, start_date, end_date, coordin
 
     satellite_info = f"Satellite: {satellite_name.capitalize()}"
     if satellite_product:
-        satellite_info += f"\nType: {satellite_product.capitalize()}"
+        satellite_info += f"<br/>Type: {satellite_product.capitalize()}"
     if time_of_day:
-        satellite_info += f"\nTime of Day: {time_of_day.capitalize()}"
+        satellite_info += f"<br/>Time of Day: {time_of_day.capitalize()}"
     if time_interval_minutes:
-        satellite_info += f"\nTime Interval: {time_interval_minutes} minutes"
-    satellite_info += f"\nCoordinates: {coordinates}"
-    satellite_info += f"\nDate Range: {start_date} to {end_date}"
+        satellite_info += f"<br/>Time Interval: {time_interval_minutes} minutes"
+    satellite_info += f"<br/>Coordinates: {coordinates}"
+    satellite_info += f"<br/>Date Range: {start_date} to {end_date}"
     elements.append(Paragraph(satellite_info, styles['Normal']))
     elements.append(Spacer(1, 12))
 
-    # Add DataFrame content to the PDF
-    columns = list(df.columns)
-    for i in range(0, len(columns), 7):
-        subset = columns[i:i + 7]
-        df_table_data = [subset] + df[subset].values.tolist()
-        df_table = Table(df_table_data)
-        df_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        elements.append(df_table)
-        elements.append(Spacer(1, 12))
-
-    # Add the matches table
-    matches_table_data = [
-        ['ID', 'Satellite Name', 'Satellite Value', 'Satellite Datetime', 'Ground Value', 'Ground Datetime']]
-    for idx in range(0, len(matches), 2):
-        if idx + 1 < len(matches):
-            match_sat = matches[idx]
-            match_gnd = matches[idx + 1]
-            matches_table_data.append([
-                idx // 2 + 1,
-                match_sat.get('source', '').split(' - ')[1] if 'source' in match_sat and ' - ' in match_sat[
-                    'source'] else 'N/A',
-                match_sat.get('value', 'N/A'),
-                match_sat.get('datetime', 'N/A'),
-                match_gnd.get('value', 'N/A'),
-                match_gnd.get('datetime', 'N/A')
-            ])
-
-    matches_table = Table(matches_table_data)
-    matches_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    elements.append(matches_table)
+    # Satellite data: summary statistics instead of every row
+    elements.append(Paragraph(f"Satellite data: {len(df)} rows", styles['Heading2']))
+    elements.append(_long_table(satellite_summary(df)))
     elements.append(Spacer(1, 12))
 
-    # Calculate RMSE and MBE
-    rmse, mbe = calculate_rmse_mbe(matches)
-    elements.append(Paragraph(f"RMSE: {rmse}", styles['Normal']))
-    elements.append(Paragraph(f"MBE: {mbe}", styles['Normal']))
-    elements.append(Spacer(1, 12))
+    # Validation metrics
+    elements.append(Paragraph(f"Matches: {len(matches)}", styles['Heading2']))
+    if matches:
+        statistics = match_statistics(matches)
+        metrics = pd.DataFrame({'Metric': list(statistics), 'Value': list(statistics.values())})
+        elements.append(_long_table(metrics))
+        elements.append(Spacer(1, 12))
+
+        grouping = {'modis': ['platform', 'time_of_day', 'month'],
+                    'all': ['satellite', 'platform', 'time_of_day', 'month']}.get(satellite_name.lower(), ['month'])
+        monthly = GroupedStats().update(matches).table(grouping)
+        monthly = monthly[grouping + ['matches', 'rmse', 'mbe', 'mae', 'r2']]
+        elements.append(Paragraph("Metrics by month", styles['Heading3']))
+        elements.append(_long_table(monthly))
+        elements.append(Spacer(1, 12))
 
-    # Create and save the plot only if the satellite is not Landsat
-    if satellite_name.lower() != 'landsat':
-        fig, ax = plt.subplots(figsize=(10, 6))
-        satellite_values = [float(matches[i]['value']) for i in range(0, len(matches), 2)]
-        ground_values = [float(matches[i + 1]['value']) for i in range(0, len(matches), 2)]
-        dates = [matches[i]['datetime'] for i in range(0, len(matches), 2)]
-
-        ax.plot(dates, satellite_values, label='Satellite', marker='o', linestyle='-', color='red')
-        ax.plot(dates, ground_values, label='Ground', marker='o', linestyle='-', color='blue')
-        ax.set_xlabel('Date')
-        ax.set_ylabel('Value')
-        ax.set_title(f'{satellite_name} vs Ground Values')
-        ax.legend()
-        ax.grid(True)
-        plt.xticks(rotation=45)
-
-        plot_file_name = f"Graphics/{satellite_name}_plot_{current_time}.png"
-        plt.savefig(plot_file_name)
-        plt.close(fig)
-
-        # Add plot to the PDF
-        elements.append(Image(plot_file_name, width=640, height=480))
+        # Add the matches table (capped)
+        matches_frame = matches.display_frame().drop(columns='Time Delta (min)')
+        if max_rows is not None and len(matches_frame) > max_rows:
+            elements.append(Paragraph(f"First {max_rows} of {len(matches_frame)} matches "
+                                      f"(save the table to get all of them)", styles['Normal']))
+            matches_frame = matches_frame.head(max_rows)
+        elements.append(_long_table(matches_frame, '{:.2f}'))
         elements.append(Spacer(1, 12))
 
+        # Графики, уже сохранённые plot_data, вставляются без повторной отрисовки
+        images = [path for path in (plot_images or []) if path and os.path.exists(path)]
+        if not images and satellite_name.lower() != 'landsat':
+            os.makedirs(graphics_dir, exist_ok=True)
+            images = [_timeseries_image(matches, satellite_name, graphics_dir, current_time)]
+        for path in images:
+            image = Image(path)
+            # Вписываем в ширину страницы с сохранением пропорций
+            scale = min(1.0, doc.width / image.imageWidth, doc.height / image.imageHeight)
+            image.drawWidth, image.drawHeight = image.imageWidth * scale, image.imageHeight * scale
+            elements.append(image)
+            elements.append(Spacer(1, 12))
+
     # Save the PDF report
-    doc.build(elements)
+    with span('report.build', rows=len(matches)) as s:
+        doc.build(elements)
+        s.set(bytes=os.path.getsize(pdf_file_name))
     print(f"PDF report saved to {pdf_file_name}")
+    return pdf_file_name
 
 
+def create_pdf_report(df, matches, satellite_name, start_date, end_date, coordinates, time_interval_minutes=None,
+                      satellite_product=None, time_of_day=None, pdf_file_name=None, graphics_dir='Graphics',
+                      plot_images=None, max_rows=MAX_TABLE_ROWS, background=False):
+    global _report_executor
+    # Prompt user if they want to save the report (batch runs pass the file name instead)
+    if pdf_file_name is None:
+        save_report = input("Хотите сохранить отчёт? (да/нет) ").strip().lower()
+        if save_report != 'да':
+            print("Report generation canceled.")
+            return
 
-
+    # Generate a timestamped filename for the PDF report
+    if pdf_file_name is None:
+        if not os.path.exists('Reports'):
+            os.makedirs('Reports')
+        current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        pdf_file_name = f"Reports/{satellite_name}_report_{start_date}_{end_date}_{current_time}.pdf"
+
+    args = (pdf_file_name, df, matches, satellite_name, start_date, end_date, coordinates, time_interval_minutes,
+            satellite_product, time_of_day, plot_images, max_rows, graphics_dir)
+    if not background:
+        return build_pdf_report(*args)
+    if _report_executor is None:
+        _report_executor = ThreadPoolExecutor(max_workers=1)
+    future = _report_executor.submit(build_pdf_report, *args)
+    _pending_reports.append(future)
+    print(f"PDF report is being built in the background: {pdf_file_name}")
+    return future
+
+
+def wait_for_reports():
+    # Дождаться фоновых отчётов перед выходом и показать ошибки, если они были
+    while _pending_reports:
+        future = _pending_reports.pop(0)
+        try:
+            future.result()
+        except Exception as e:
+            print("Error building PDF report:", e)
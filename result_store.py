@@ -0,0 +1,274 @@
+import argparse
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from match_table import MatchTable
+from validation_stats import METRIC_COLUMNS, ErrorAccumulator
+
+STORE_PATH = os.path.join(os.getcwd(), 'Results', 'results.sqlite')
+# Допуск "ближайшее измерение без ограничения" (Landsat) хранится как -1: в ключах нет NULL
+NO_TOLERANCE = -1.0
+# Запас перед границей прежних данных: пролёты рядом с ней сопоставляются заново,
+# новое наземное измерение может оказаться ближе (для допуска без ограничения - сутки)
+DEFAULT_MARGIN_MINUTES = 24 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ground (
+    station TEXT NOT NULL, datetime INTEGER NOT NULL, value REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS ground_station ON ground (station, datetime);
+CREATE TABLE IF NOT EXISTS satellite (
+    station TEXT NOT NULL, satellite TEXT NOT NULL, platform TEXT NOT NULL, time_of_day TEXT NOT NULL,
+    datetime INTEGER NOT NULL, value REAL);
+CREATE INDEX IF NOT EXISTS satellite_station ON satellite (station, satellite, platform, time_of_day, datetime);
+CREATE TABLE IF NOT EXISTS matches (
+    station TEXT NOT NULL, satellite TEXT NOT NULL, platform TEXT NOT NULL, time_of_day TEXT NOT NULL,
+    tolerance REAL NOT NULL, satellite_datetime INTEGER NOT NULL, satellite_value REAL NOT NULL,
+    ground_datetime INTEGER NOT NULL, ground_value REAL NOT NULL, kept INTEGER NOT NULL DEFAULT 1);
+CREATE INDEX IF NOT EXISTS matches_combination ON matches (satellite, platform, time_of_day, satellite_datetime);
+CREATE INDEX IF NOT EXISTS matches_station
+    ON matches (station, satellite, platform, time_of_day, tolerance, satellite_datetime);
+CREATE TABLE IF NOT EXISTS runs (
+    station TEXT NOT NULL, satellite TEXT NOT NULL, platform TEXT NOT NULL, time_of_day TEXT NOT NULL,
+    tolerance REAL NOT NULL, ground_end INTEGER NOT NULL, updated REAL NOT NULL,
+    PRIMARY KEY (station, satellite, platform, time_of_day, tolerance));
+CREATE TABLE IF NOT EXISTS metrics (
+    station TEXT NOT NULL, satellite TEXT NOT NULL, platform TEXT NOT NULL, time_of_day TEXT NOT NULL,
+    tolerance REAL NOT NULL, updated REAL NOT NULL, {metrics},
+    PRIMARY KEY (station, satellite, platform, time_of_day, tolerance));
+""".format(metrics=', '.join(f'{column} REAL' for column in METRIC_COLUMNS))
+
+
+def tolerance_key(time_interval_minutes):
+    return NO_TOLERANCE if time_interval_minutes is None else float(time_interval_minutes)
+
+
+def _ns(values):
+    return np.asarray(values, dtype='datetime64[ns]').astype(np.int64)
+
+
+def _timestamp_ns(value):
+    return int(pd.Timestamp(value).as_unit('ns').value)
+
+
+class ResultStore:
+    # Результаты всех запусков в одном файле SQLite: очищенные наземные ряды, значения спутника,
+    # пары до фильтра выбросов (kept - прошла ли пара фильтр) и метрики; ключи - станция,
+    # спутник, платформа, время суток и допуск, время хранится в наносекундах
+    def __init__(self, path=STORE_PATH, timeout=60.0):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Рабочие процессы пакетного запуска пишут в один файл: WAL и ожидание блокировки
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @staticmethod
+    def combination_key(station, satellite, platform=None, time_of_day=None):
+        return station, satellite, platform or '', time_of_day or ''
+
+    def watermark(self, station, satellite, platform=None, time_of_day=None, time_interval_minutes=None):
+        # Последнее наземное измерение, учтённое в сохранённых парах комбинации; None - комбинации ещё нет
+        row = self.connection.execute(
+            'SELECT ground_end FROM runs WHERE station = ? AND satellite = ? AND platform = ? AND time_of_day = ? '
+            'AND tolerance = ?',
+            (*self.combination_key(station, satellite, platform, time_of_day),
+             tolerance_key(time_interval_minutes))).fetchone()
+        return None if row is None else pd.Timestamp(row[0], unit='ns')
+
+    def resume_from(self, station, satellite, platform=None, time_of_day=None, time_interval_minutes=None,
+                    ground_end=None):
+        # Начало окна пересчёта для новых наземных данных; None - пересчитать всё,
+        # False - новых данных нет
+        watermark = self.watermark(station, satellite, platform, time_of_day, time_interval_minutes)
+        if watermark is None:
+            return None
+        if ground_end is not None and pd.Timestamp(ground_end) <= watermark:
+            return False
+        margin = DEFAULT_MARGIN_MINUTES if time_interval_minutes is None else 2 * time_interval_minutes
+        return watermark - pd.Timedelta(minutes=margin)
+
+    def replace_ground(self, station, ground, since=None):
+        since_ns = None if since is None else _timestamp_ns(since)
+        datetimes = _ns(ground['datetime'])
+        values = ground['value'].to_numpy(dtype=np.float64)
+        if since_ns is not None:
+            keep = datetimes >= since_ns
+            datetimes, values = datetimes[keep], values[keep]
+        with self.connection:
+            self.connection.execute('DELETE FROM ground WHERE station = ? AND datetime >= ?',
+                                    (station, since_ns if since_ns is not None else np.iinfo(np.int64).min))
+            self.connection.executemany('INSERT INTO ground VALUES (?, ?, ?)',
+                                        zip([station] * len(values), datetimes.tolist(), values.tolist()))
+
+    def replace_satellite(self, station, satellite, platform, time_of_day, frame, since=None):
+        # frame: datetime, value - спутниковый ряд комбинации, по которому ищутся пары
+        key = self.combination_key(station, satellite, platform, time_of_day)
+        since_ns = np.iinfo(np.int64).min if since is None else _timestamp_ns(since)
+        datetimes = _ns(frame['datetime'])
+        values = frame['value'].to_numpy(dtype=np.float64)
+        keep = datetimes >= since_ns
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM satellite WHERE station = ? AND satellite = ? AND platform = ? AND time_of_day = ? '
+                'AND datetime >= ?', (*key, since_ns))
+            self.connection.executemany('INSERT INTO satellite VALUES (?, ?, ?, ?, ?, ?)',
+                                        ((*key, d, v) for d, v in zip(datetimes[keep].tolist(),
+                                                                      values[keep].tolist())))
+
+    def replace_matches(self, station, satellite, platform, time_of_day, time_interval_minutes, matches,
+                        since=None, ground_end=None):
+        # Пары (до фильтра выбросов) с момента since заменяются новыми; отметка ground_end сдвигается
+        key = self.combination_key(station, satellite, platform, time_of_day)
+        tolerance = tolerance_key(time_interval_minutes)
+        since_ns = np.iinfo(np.int64).min if since is None else _timestamp_ns(since)
+        satellite_ns = _ns(matches.satellite_datetime)
+        keep = satellite_ns >= since_ns
+        rows = zip(satellite_ns[keep].tolist(), matches.satellite_value[keep].tolist(),
+                   _ns(matches.ground_datetime)[keep].tolist(), matches.ground_value[keep].tolist())
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM matches WHERE station = ? AND satellite = ? AND platform = ? AND time_of_day = ? '
+                'AND tolerance = ? AND satellite_datetime >= ?', (*key, tolerance, since_ns))
+            self.connection.executemany('INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)',
+                                        ((*key, tolerance, *row) for row in rows))
+            if ground_end is not None:
+                self.connection.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        (*key, tolerance, _timestamp_ns(ground_end), time.time()))
+
+    def _where(self, station=None, satellite=None, platform=None, time_of_day=None, time_interval_minutes=...,
+               start=None, end=None, kept=True):
+        conditions, params = [], []
+        for column, value in (('station', station), ('satellite', satellite), ('platform', platform),
+                              ('time_of_day', time_of_day)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if time_interval_minutes is not ...:
+            conditions.append('tolerance = ?')
+            params.append(tolerance_key(time_interval_minutes))
+        if start is not None:
+            conditions.append('satellite_datetime >= ?')
+            params.append(_timestamp_ns(start))
+        if end is not None:
+            conditions.append('satellite_datetime < ?')
+            params.append(_timestamp_ns(end))
+        if kept is not None:
+            conditions.append('kept = ?')
+            params.append(int(kept))
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def query_matches(self, station=None, satellite=None, platform=None, time_of_day=None,
+                      time_interval_minutes=..., start=None, end=None, kept=True):
+        # Пары из всех запусков: например, все Aqua Night за 2023 год -
+        # query_matches(satellite='modis', platform='aqua', time_of_day='night', start='2023', end='2024')
+        where, params = self._where(station, satellite, platform, time_of_day, time_interval_minutes, start, end,
+                                    kept)
+        rows = self.connection.execute(
+            'SELECT rowid, station, satellite, platform, time_of_day, tolerance, satellite_datetime, '
+            f'satellite_value, ground_datetime, ground_value, kept FROM matches{where} '
+            'ORDER BY satellite_datetime', params).fetchall()
+        columns = ['rowid', 'station', 'satellite', 'platform', 'time_of_day', 'tolerance', 'satellite_datetime',
+                   'satellite_value', 'ground_datetime', 'ground_value', 'kept']
+        frame = pd.DataFrame.from_records(rows, columns=columns)
+        for column in ('satellite_datetime', 'ground_datetime'):
+            frame[column] = frame[column].astype(np.int64).astype('datetime64[ns]')
+        frame['tolerance'] = frame['tolerance'].astype(np.float64).replace(NO_TOLERANCE, np.nan)
+        for column in ('station', 'satellite', 'platform', 'time_of_day'):
+            frame[column] = frame[column].astype('category')
+        return frame
+
+    def matches(self, **query):
+        frame = self.query_matches(**query)
+        # Платформа и время суток без значения хранятся пустой строкой, как в MatchTable
+        return MatchTable(frame['satellite_datetime'], frame['satellite_value'], frame['ground_datetime'],
+                          frame['ground_value'], frame['satellite'].to_numpy(), frame['platform'].to_numpy(),
+                          frame['time_of_day'].to_numpy())
+
+    def apply_filters(self, station, satellite, platform, time_of_day, time_interval_minutes, match_filter_chain):
+        # Фильтр выбросов пар работает по всем сохранённым парам комбинации, как в полном пересчёте;
+        # результат - пары, прошедшие фильтр, и отчёт фильтров
+        key = self.combination_key(station, satellite, platform, time_of_day)
+        frame = self.query_matches(*key, time_interval_minutes, kept=None)
+        paired = pd.DataFrame({
+            'value': frame['satellite_value'].to_numpy(),
+            'ground_value': frame['ground_value'].to_numpy(),
+        })
+        paired['abs_difference'] = (paired['value'] - paired['ground_value']).abs()
+        rows, report = match_filter_chain.run(paired)
+        kept = np.zeros(len(frame), dtype=np.int64)
+        kept[rows] = 1
+        with self.connection:
+            self.connection.executemany('UPDATE matches SET kept = ? WHERE rowid = ?',
+                                        zip(kept.tolist(), frame['rowid'].tolist()))
+        matches = MatchTable(frame['satellite_datetime'].to_numpy()[rows], paired['value'].to_numpy()[rows],
+                             frame['ground_datetime'].to_numpy()[rows], paired['ground_value'].to_numpy()[rows],
+                             satellite, platform, time_of_day)
+        return matches, report
+
+    def store_metrics(self, station, satellite, platform, time_of_day, time_interval_minutes, metrics):
+        values = [float(metrics.get(column, np.nan)) for column in METRIC_COLUMNS]
+        with self.connection:
+            self.connection.execute(
+                f'INSERT OR REPLACE INTO metrics VALUES ({", ".join("?" * (6 + len(METRIC_COLUMNS)))})',
+                (*self.combination_key(station, satellite, platform, time_of_day),
+                 tolerance_key(time_interval_minutes),
+                 time.time(), *values))
+
+    def metrics(self, station=None, satellite=None, platform=None, time_of_day=None):
+        where, params = self._where(station, satellite, platform, time_of_day, kept=None)
+        frame = pd.read_sql_query(f'SELECT * FROM metrics{where} ORDER BY station, satellite, platform, '
+                                  'time_of_day, tolerance', self.connection, params=params)
+        frame['tolerance'] = frame['tolerance'].replace(NO_TOLERANCE, np.nan)
+        frame['updated'] = pd.to_datetime(frame['updated'], unit='s')
+        return frame
+
+    def summary(self, **query):
+        # Метрики по выборке пар из всех запусков без повторного сопоставления
+        matches = self.matches(**query)
+        return ErrorAccumulator().update_matches(matches).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запрос пар и метрик из хранилища результатов")
+    parser.add_argument('store', nargs='?', default=STORE_PATH, help="Файл хранилища SQLite")
+    parser.add_argument('--station')
+    parser.add_argument('--satellite')
+    parser.add_argument('--platform')
+    parser.add_argument('--time-of-day')
+    parser.add_argument('--start', help="Начало периода, например 2023-01-01")
+    parser.add_argument('--end', help="Конец периода (не включается)")
+    parser.add_argument('--metrics', action='store_true', help="Показать сохранённые метрики")
+    args = parser.parse_args()
+
+    with ResultStore(args.store) as store:
+        if args.metrics:
+            print(store.metrics(args.station, args.satellite, args.platform, args.time_of_day).to_string(index=False))
+            return
+        started = time.perf_counter()
+        query = dict(station=args.station, satellite=args.satellite, platform=args.platform,
+                     time_of_day=args.time_of_day, start=args.start, end=args.end)
+        frame = store.query_matches(**query)
+        elapsed = time.perf_counter() - started
+        print(frame.drop(columns=['rowid', 'kept']).to_string(index=False, max_rows=40))
+        print(f"{len(frame)} matches in {elapsed * 1000:.1f} ms")
+        if len(frame):
+            print(store.summary(**query))
+
+
+if __name__ == "__main__":
+    main()
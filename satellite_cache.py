@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+import pandas as pd
+
+from ee_backend import get_backend
+from file_lock import FileLock
+from satellite_data import normalize_stations
+from tracing import span
+
+CACHE_DIRECTORY = os.path.join(os.getcwd(), 'Cache', 'satellite')
+# Меняется вместе с форматом таблиц менеджеров, чтобы не читать записи старого формата
+CACHE_FORMAT = 2
+
+
+def fetch_dataframe(manager, coordinates, date_start, date_end):
+    # Earth Engine инициализируется backend'ом только когда кэш не может ответить
+    return manager.fetch_dataframe(coordinates, date_start, date_end)
+
+
+def fetch_station_dataframes(manager, stations, date_start, date_end):
+    return manager.fetch_station_dataframes(stations, date_start, date_end)
+
+
+def _to_date(value):
+    return date.fromisoformat(str(value)[:10])
+
+
+def merge_ranges(ranges):
+    # Объединение пересекающихся и смежных интервалов [начало, конец)
+    merged = []
+    for start, end in sorted((_to_date(s), _to_date(e)) for s, e in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [[s.isoformat(), e.isoformat()] for s, e in merged]
+
+
+def missing_ranges(date_start, date_end, covered):
+    # Части запрошенного интервала, которых ещё нет в кэше
+    start, end = _to_date(date_start), _to_date(date_end)
+    missing = []
+    for covered_start, covered_end in merge_ranges(covered):
+        covered_start, covered_end = _to_date(covered_start), _to_date(covered_end)
+        if covered_end <= start or covered_start >= end:
+            continue
+        if covered_start > start:
+            missing.append([start.isoformat(), covered_start.isoformat()])
+        start = max(start, covered_end)
+        if start >= end:
+            break
+    if start < end:
+        missing.append([start.isoformat(), end.isoformat()])
+    return missing
+
+
+class SatelliteCache:
+    def __init__(self, cache_directory=CACHE_DIRECTORY, max_size_mb=512, fetch=fetch_dataframe,
+                 fetch_stations=fetch_station_dataframes):
+        self.cache_directory = cache_directory
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.fetch = fetch
+        self.fetch_stations = fetch_stations
+        self.index_path = os.path.join(self.cache_directory, 'index.json')
+        if not os.path.exists(self.cache_directory):
+            os.makedirs(self.cache_directory)
+        # Индекс общий для потоков (mission_fetch) и процессов (batch_runner): запись таблиц, изменение
+        # индекса и вытеснение идут под блокировкой файла index.lock
+        self._lock = FileLock(os.path.join(self.cache_directory, 'index.lock'))
+
+    def cache_key(self, collection_id, coordinates, bands, sampling=None):
+        params = {
+            'format': CACHE_FORMAT,
+            'collection': collection_id,
+            'coordinates': [round(float(c), 6) for c in coordinates],
+            'bands': sorted(bands),
+        }
+        # Таблицы режима окрестности (окно пикселей, другой масштаб) хранятся отдельно
+        if sampling:
+            params['sampling'] = sampling
+        # Синтетические данные хранятся отдельно от данных Earth Engine
+        namespace = get_backend().cache_namespace
+        if namespace:
+            params['namespace'] = namespace
+        payload = json.dumps(params, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        # Атомарная замена, чтобы параллельные процессы не читали недописанный файл
+        tmp_path = f'{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def _read_frame(self, entry):
+        if not entry.get('file'):
+            return pd.DataFrame()
+        path = os.path.join(self.cache_directory, entry['file'])
+        try:
+            return pd.read_parquet(path)
+        except OSError:
+            # Таблицу вытеснил другой процесс
+            return None
+
+    def _write_frame(self, key, df):
+        if df.empty:
+            return None, 0
+        file_name = f'{key}.parquet'
+        path = os.path.join(self.cache_directory, file_name)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        return file_name, os.path.getsize(path)
+
+    def _lookup(self, manager, coordinates):
+        key = self.cache_key(manager.collection_id, coordinates, manager.columns, manager.sampling)
+        index = self._read_index()
+        entry = index.get(key)
+        # Только таблица с тем же набором каналов: sampleRegions отбрасывает точку, если замаскирован любой
+        # из выбранных каналов, поэтому в таблице с лишними каналами строк может быть меньше
+        cached = self._read_frame(entry) if entry else None
+        if cached is None:
+            return key, [], pd.DataFrame()
+        return key, entry['ranges'], cached
+
+    def _update_entry(self, key, entry):
+        with self._lock:
+            index = self._read_index()
+            entry = entry or index.get(key)
+            if entry is None:
+                return
+            entry['last_access'] = time.time()
+            index[key] = entry
+            self._evict(index, keep=key)
+            self._write_index(index)
+
+    def _store(self, key, manager, coordinates, covered, missing, frames):
+        with self._lock:
+            # Пока шли запросы, другой процесс мог дополнить ту же таблицу: его строки и интервалы
+            # объединяются с новыми, а не затираются
+            entry = self._read_index().get(key)
+            if entry and merge_ranges(entry['ranges']) != merge_ranges(covered):
+                stored = self._read_frame(entry)
+                if stored is not None:
+                    frames = [stored, *frames]
+                    covered = covered + entry['ranges']
+            non_empty = [frame for frame in frames if frame is not None and not frame.empty]
+            merged = pd.concat(non_empty, ignore_index=True) if non_empty else pd.DataFrame()
+            if not merged.empty:
+                merged = merged.drop_duplicates().sort_values('date', kind='mergesort').reset_index(drop=True)
+            file_name, size = self._write_frame(key, merged)
+            self._update_entry(key, {
+                'collection': manager.collection_id,
+                'coordinates': list(coordinates),
+                'bands': list(manager.columns),
+                'namespace': get_backend().cache_namespace,
+                'sampling': manager.sampling,
+                'ranges': merge_ranges(covered + missing),
+                'file': file_name,
+                'size': size,
+            })
+        return merged
+
+    def _select(self, cached, date_start, date_end):
+        if cached.empty:
+            return cached
+        # Строки отбираются по дате съёмки, как и filterDate: конец не включается
+        dates = pd.to_datetime(cached['date']).dt.normalize()
+        selected = (dates >= pd.Timestamp(_to_date(date_start))) & (dates < pd.Timestamp(_to_date(date_end)))
+        return cached[selected].reset_index(drop=True)
+
+    def get_dataframe(self, manager, coordinates, date_start, date_end):
+        with span('satellite_cache.get_dataframe', collection=manager.collection_id) as s:
+            key, covered, cached = self._lookup(manager, coordinates)
+
+            # Запрашиваем у Earth Engine только недостающие поддиапазоны дат
+            missing = missing_ranges(date_start, date_end, covered)
+            if missing:
+                frames = [cached]
+                for range_start, range_end in missing:
+                    frames.append(self.fetch(manager, coordinates, range_start, range_end))
+                cached = self._store(key, manager, coordinates, covered, missing, frames)
+            else:
+                self._update_entry(key, None)
+            selected = self._select(cached, date_start, date_end)
+            s.set(rows=len(selected), missing_ranges=len(missing))
+            return selected
+
+    def get_station_dataframes(self, manager, stations, date_start, date_end):
+        stations = normalize_stations(stations)
+        lookups = {station_id: self._lookup(manager, coordinates) for station_id, coordinates in stations}
+
+        # Станции с одинаковыми недостающими интервалами запрашиваются одним многоточечным запросом
+        groups = defaultdict(list)
+        for station_id, coordinates in stations:
+            missing = missing_ranges(date_start, date_end, lookups[station_id][1])
+            groups[tuple(tuple(r) for r in missing)].append((station_id, coordinates))
+
+        station_frames = {}
+        for missing, group in groups.items():
+            fetched = [self.fetch_stations(manager, group, range_start, range_end)
+                       for range_start, range_end in missing]
+            for station_id, coordinates in group:
+                key, covered, cached = lookups[station_id]
+                if missing:
+                    frames = [cached] + [frames_by_station.get(station_id) for frames_by_station in fetched]
+                    cached = self._store(key, manager, coordinates, covered, [list(r) for r in missing], frames)
+                else:
+                    self._update_entry(key, None)
+                station_frames[station_id] = self._select(cached, date_start, date_end)
+        return station_frames
+
+    def _remove_orphans(self, index):
+        # Таблицы без записи в индексе (индекс, перезаписанный другим процессом до блокировки)
+        # не учитываются в размере кэша и удаляются
+        referenced = {entry.get('file') for entry in index.values()}
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith('.parquet') and file_name not in referenced:
+                try:
+                    os.remove(os.path.join(self.cache_directory, file_name))
+                except OSError:
+                    pass
+
+    def _evict(self, index, keep=None):
+        self._remove_orphans(index)
+        total = sum(entry.get('size', 0) for entry in index.values())
+        for key, entry in sorted(index.items(), key=lambda item: item[1].get('last_access', 0)):
+            if total <= self.max_size_bytes:
+                break
+            if key == keep:
+                continue
+            if entry.get('file'):
+                path = os.path.join(self.cache_directory, entry['file'])
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= entry.get('size', 0)
+            del index[key]
+
+    def clear(self):
+        with self._lock:
+            for entry in self._read_index().values():
+                if entry.get('file'):
+                    path = os.path.join(self.cache_directory, entry['file'])
+                    if os.path.exists(path):
+                        os.remove(path)
+            self._write_index({})
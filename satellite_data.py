@@ -0,0 +1,288 @@
+from ee_session import ee, ensure_initialized
+import numpy as np
+import pandas as pd
+from ee_backend import get_backend
+from tracing import payload_bytes, span
+
+STATION_ID = 'station_id'
+# Полный набор колонок менеджера (таблицы для отчётов и сохранения)
+FULL_BANDS = 'full'
+# Колонки, без которых таблица не собирается: время съёмки и платформа снимка
+KEY_COLUMNS = ('system:time_start', 'platform')
+# Свойства точек, а не каналы снимка
+NON_BAND_COLUMNS = ('system:time_start', 'platform', 'name', STATION_ID)
+# Режим окрестности: DN маскированных пикселей окна (0 - значение заполнения LST MODIS и ST_B10 Landsat)
+FILL_DN = 0
+
+
+def normalize_stations(stations):
+    # Станции: {id: [lon, lat]}, [(id, [lon, lat]), ...] или [{'station_id': id, 'coordinates': [lon, lat]}, ...]
+    if isinstance(stations, dict):
+        stations = list(stations.items())
+    normalized = []
+    for station in stations:
+        if isinstance(station, dict):
+            station_id, coordinates = station[STATION_ID], station['coordinates']
+        else:
+            station_id, coordinates = station
+        normalized.append((str(station_id), [float(c) for c in coordinates]))
+    return normalized
+
+
+def stations_feature_collection(stations):
+    if isinstance(stations, ee.FeatureCollection):
+        return stations
+    return ee.FeatureCollection([
+        ee.Feature(ee.Geometry.Point(coordinates), {STATION_ID: station_id})
+        for station_id, coordinates in normalize_stations(stations)
+    ])
+
+
+def _rounded(coordinates):
+    # Координаты для ключа запроса: точка или список точек, 6 знаков
+    if len(coordinates) and isinstance(coordinates[0], (list, tuple)):
+        return [_rounded(point) for point in coordinates]
+    return [round(float(c), 6) for c in coordinates]
+
+
+def split_by_station(df):
+    if df is None or df.empty or STATION_ID not in df.columns:
+        return {}
+    return {
+        station_id: group.drop(columns=STATION_ID).reset_index(drop=True)
+        for station_id, group in df.groupby(STATION_ID, sort=False, observed=True)
+    }
+
+
+def window_statistics(df, bands, scales, fill_value=FILL_DN):
+    # Массивы окрестности k x k (getInfo отдаёт вложенные списки) -> DN центрального пикселя в колонке канала
+    # и статистики окна в физических величинах; строки без единого валидного пикселя отбрасываются
+    df = df.copy()
+    any_valid = np.zeros(len(df), dtype=bool)
+    for band in bands:
+        if band not in df.columns:
+            continue
+        cells = df[band].to_numpy()
+        present = np.array([isinstance(cell, list) for cell in cells], dtype=bool)
+        if not present.any():
+            continue
+        arrays = np.array(cells[present].tolist(), dtype=np.float64)
+        windows = np.full((len(df),) + arrays.shape[1:], np.nan)
+        windows[present] = arrays
+        valid = np.isfinite(windows) & (windows != fill_value)
+        scale, offset = scales.get(band, (1, 0))
+        values = np.where(valid, windows * scale + offset, 0.0)
+        counts = valid.sum(axis=(1, 2))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = values.sum(axis=(1, 2)) / counts
+            deviations = np.where(valid, values - mean[:, None, None], 0.0)
+            std = np.sqrt((deviations ** 2).sum(axis=(1, 2)) / counts)
+        row, column = windows.shape[1] // 2, windows.shape[2] // 2
+        centre = np.where(valid[:, row, column], windows[:, row, column], np.nan)
+        df[band] = centre
+        df[f'{band}_mean'] = mean.astype(np.float32)
+        df[f'{band}_std'] = std.astype(np.float32)
+        df[f'{band}_valid_fraction'] = np.where(present, counts / valid[0].size, np.nan).astype(np.float32)
+        any_valid |= counts > 0
+    return df[any_valid].reset_index(drop=True)
+
+
+def scale_dataframe(df, scales, integer_columns=(), view_time_columns=(), time_offset_hours=0):
+    # DN -> физические величины векторно на клиенте: float32, datetime64 и категории вместо строк
+    df = df.copy()
+    for column, (scale, offset) in scales.items():
+        if column in df.columns:
+            values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+            df[column] = (values * scale + offset).astype(np.float32)
+    for column in integer_columns:
+        if column in df.columns and df[column].notna().all():
+            df[column] = pd.to_numeric(df[column], downcast='unsigned')
+
+    if 'system:time_start' in df.columns:
+        acquired = pd.to_datetime(df.pop('system:time_start'), unit='ms')
+        df.insert(0, 'date', acquired + pd.Timedelta(hours=time_offset_hours))
+        # Время пролёта MODIS в часах -> момент пролёта с точностью до минуты
+        for column in view_time_columns:
+            if column in df.columns:
+                minutes = np.floor(np.round(df[column].to_numpy(dtype=np.float64) * 60, 6))
+                df[column] = df['date'].dt.normalize() + pd.to_timedelta(minutes, unit='m')
+
+    for column in ('name', 'platform', STATION_ID):
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+class SatelliteDataManager:
+    collection_id = None
+    columns = []
+    scales = {}
+    integer_columns = []
+    view_time_columns = []
+    time_offset_hours = 0
+    # Каналы, для которых в режиме окрестности запрашивается окно пикселей, и собственное разрешение, м
+    window_bands = []
+    native_scale = 1000
+    # Масштаб выборки в точке станции (прежний режим)
+    sample_scale = 1000
+
+    def __init__(self, columns=None, neighborhood=None):
+        self.select_columns(columns)
+        self.set_neighborhood(neighborhood)
+
+    def set_neighborhood(self, radius=None):
+        # Окрестность станции: радиус в пикселях собственного разрешения (1 - окно 3x3, 2 - 5x5);
+        # None - один пиксель в точке, как раньше
+        if radius is not None and (int(radius) != radius or radius < 1):
+            raise ValueError(f"Invalid neighborhood radius {radius!r}. Please use a whole number of pixels >= 1.")
+        self.neighborhood = None if radius is None else int(radius)
+        return self
+
+    @property
+    def sampling(self):
+        # Параметры выборки для ключей запросов и кэша; None - прежняя выборка в точке
+        if self.neighborhood is None:
+            return None
+        return {'neighborhood': self.neighborhood, 'scale': self.native_scale}
+
+    def select_columns(self, columns=None):
+        # Проекция: в граф выборки и в ответ getInfo попадают только нужные вызывающему колонки;
+        # None или 'full' - все колонки менеджера
+        declared = type(self).columns
+        if columns is None or columns == FULL_BANDS:
+            self.columns = list(declared)
+            return self
+        unknown = [column for column in columns if column not in declared]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown} for {self.collection_id}.")
+        self.columns = [column for column in declared if column in columns or column in KEY_COLUMNS]
+        return self
+
+    @property
+    def bands(self):
+        return [column for column in self.columns if column not in NON_BAND_COLUMNS]
+
+    def region(self, coordinates):
+        # Точка станции, несколько точек или коллекция станций
+        if isinstance(coordinates, ee.FeatureCollection):
+            return coordinates.geometry()
+        if len(coordinates) and isinstance(coordinates[0], (list, tuple)):
+            return ee.Geometry.MultiPoint(coordinates)
+        return ee.Geometry.Point(coordinates)
+
+    def sample_bands(self, image, point):
+        # Выбранные каналы и время съёмки в точках; в режиме окрестности каналы окна приходят массивами
+        # (2r+1)x(2r+1) (neighborhoodToArray) в том же sampleRegions, без отдельных запросов на пиксель
+        window = [band for band in self.bands if band in self.window_bands]
+        if self.neighborhood is None or not window:
+            image = image.select(self.bands).addBands(image.metadata("system:time_start"))
+            return image.sampleRegions(collection=point, scale=self.sample_scale)
+        kernel = ee.Kernel.square(self.neighborhood, 'pixels')
+        arrays = image.select(window).unmask(FILL_DN, False).neighborhoodToArray(kernel)
+        others = [band for band in self.bands if band not in window]
+        image = image.select(others).addBands(arrays).addBands(image.metadata("system:time_start"))
+        return image.sampleRegions(collection=point, scale=self.native_scale)
+
+    def get_feature_collection(self, lst, point):
+        featureCollection = ee.FeatureCollection(lst.map(lambda image: self.sample_image(image, point))).flatten()
+        return featureCollection
+
+    def get_datatable(self, featureCollection, columns=None):
+        datatable = featureCollection.select(columns or self.columns)
+        return datatable
+
+    def to_dataframe(self, features):
+        with span('satellite.to_dataframe', collection=self.collection_id, rows=len(features)):
+            df = pd.DataFrame([feature['properties'] for feature in features])
+            if self.neighborhood is not None:
+                df = window_statistics(df, self.window_bands, self.scales)
+            return scale_dataframe(df, self.scales, self.integer_columns, self.view_time_columns,
+                                   self.time_offset_hours)
+
+    def get_image_data(self, coordinates, date_start, date_end):
+        lst = self.get_image_collection(coordinates, date_start, date_end)
+        return lst
+
+    def get_feature_data(self, lst, coordinates):
+        point = ee.Geometry.Point(coordinates)
+        featureCollection = self.get_feature_collection(lst, point)
+        return featureCollection
+
+    def create_dataframe(self, featureCollection):
+        datatable = self.get_datatable(featureCollection)
+        if datatable is not None:
+            return self.to_dataframe(datatable.getInfo()['features'])
+        else:
+            print("Feature collection is empty.")
+            return None
+
+    def get_stations_feature_data(self, lst, stations):
+        # Все станции в одном sampleRegions на снимок; station_id переносится в свойства точек
+        featureCollection = self.get_feature_collection(lst, stations_feature_collection(stations))
+        return featureCollection
+
+    def create_station_dataframes(self, featureCollection):
+        datatable = self.get_datatable(featureCollection, self.columns + [STATION_ID])
+        return split_by_station(self.to_dataframe(datatable.getInfo()['features']))
+
+    def ee_request(self, op, date_start, date_end, coordinates=None, stations=None, columns=None):
+        # Описание запроса для backend (ee_backend): по нему записываются и воспроизводятся ответы
+        request = {'op': op, 'collection': self.collection_id, 'date_start': str(date_start)[:10],
+                   'date_end': str(date_end)[:10]}
+        if coordinates is not None:
+            request['coordinates'] = _rounded(coordinates)
+        if stations is not None:
+            request['stations'] = [[station_id, _rounded(coords)] for station_id, coords in stations]
+        if columns is not None:
+            request['columns'] = list(columns)
+        if self.sampling is not None:
+            request['sampling'] = self.sampling
+        return request
+
+    def call_backend(self, request, fn):
+        # Все getInfo менеджера: время, строки и размер ответа попадают в трассу (tracing)
+        with span('ee.getInfo', op=request['op'], collection=self.collection_id) as s:
+            response = get_backend().call(request, fn)
+            if s:
+                s.set(rows=len(response) if isinstance(response, list) else 1, bytes=payload_bytes(response))
+        return response
+
+    def count_images(self, coordinates, date_start, date_end):
+        request = self.ee_request('size', date_start, date_end, coordinates=coordinates)
+        return self.call_backend(
+            request, lambda: self.get_image_collection(coordinates, date_start, date_end).size().getInfo())
+
+    def fetch_dataframe(self, coordinates, date_start, date_end):
+        def live():
+            lst = self.get_image_collection(coordinates, date_start, date_end)
+            featureCollection = self.get_feature_data(lst, coordinates)
+            return self.get_datatable(featureCollection).getInfo()['features']
+
+        request = self.ee_request('features', date_start, date_end, coordinates=coordinates, columns=self.columns)
+        return self.to_dataframe(self.call_backend(request, live))
+
+    def fetch_station_dataframes(self, stations, date_start, date_end):
+        if not isinstance(stations, (dict, list, tuple)):
+            # Готовая ee.FeatureCollection станций не описывается запросом, она идёт только в Earth Engine
+            return self._fetch_station_collection(stations, date_start, date_end)
+
+        stations = normalize_stations(stations)
+
+        def live():
+            collection = stations_feature_collection(stations)
+            lst = self.get_image_collection(collection, date_start, date_end)
+            featureCollection = self.get_stations_feature_data(lst, collection)
+            return self.get_datatable(featureCollection, self.columns + [STATION_ID]).getInfo()['features']
+
+        request = self.ee_request('station_features', date_start, date_end, stations=stations,
+                                  columns=self.columns + [STATION_ID])
+        station_frames = split_by_station(self.to_dataframe(self.call_backend(request, live)))
+        for station_id, coordinates in stations:
+            station_frames.setdefault(station_id, pd.DataFrame())
+        return station_frames
+
+    def _fetch_station_collection(self, collection, date_start, date_end):
+        ensure_initialized()
+        lst = self.get_image_collection(collection, date_start, date_end)
+        featureCollection = self.get_stations_feature_data(lst, collection)
+        return self.create_station_dataframes(featureCollection)
@@ -0,0 +1,330 @@
+import numpy as np
+import pandas as pd
+
+from common_dates import CommonDates, match_nearest
+from excel_manager import GROUND_CHUNK_ROWS, iter_ground_chunks, rejected_table
+from match_table import MatchTable
+from outlier_filters import RangeFilter, SigmaFilter, StepDiffFilter, ground_filters, match_filters
+from tracing import span
+
+
+class RunningMoments:
+    # Среднее и дисперсия по частям (Уэлфорд/Чан): статистика сигма-фильтра без всего ряда в памяти
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        n = len(values)
+        if n == 0:
+            return self
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        total = self.n + n
+        delta = mean - self.mean
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.n) if self.n else np.nan
+
+
+class _Stage:
+    # Этап цепочки фильтров для потока частей: на вход - оставшиеся строки части, на выход - прошедшие
+    def __init__(self, stage):
+        self.stage = stage
+        self.columns = stage.columns
+        self.kept = 0
+
+    def _arrays(self, df):
+        return {column: df[column].to_numpy(dtype=np.float64) for column in self.columns}
+
+    def process(self, df):
+        df = df[self.stage.mask(self._arrays(df))]
+        self.kept += len(df)
+        return df
+
+    def finish(self):
+        return None
+
+
+class _BoundsStage(_Stage):
+    # Сигма-фильтр: границы по всему ряду из предыдущего прохода (RunningMoments), дальше - построчно
+    def __init__(self, stage):
+        super().__init__(stage)
+        self.moments = RunningMoments()
+        self.bounds = None
+
+    def accumulate(self, df):
+        for values in self._arrays(df).values():
+            self.moments.update(values)
+
+    def set_bounds(self):
+        if self.moments.n == 0:
+            self.bounds = -np.inf, np.inf
+        else:
+            mean = self.moments.mean if self.stage.center else 0.0
+            spread = self.stage.n_sigma * self.moments.std
+            self.bounds = mean - spread, mean + spread
+
+    def process(self, df):
+        low, high = self.bounds
+        keep = np.ones(len(df), dtype=bool)
+        for values in self._arrays(df).values():
+            keep &= (values >= low) & (values <= high)
+        df = df[keep]
+        self.kept += len(df)
+        return df
+
+
+class _StepStage(_Stage):
+    # Скачок до следующего отсчёта: последняя строка части ждёт первую строку следующей части
+    def __init__(self, stage):
+        super().__init__(stage)
+        self.carry = None
+        self.previous = None
+
+    def process(self, df):
+        if self.carry is not None:
+            df = pd.concat([self.carry, df])
+        if len(df) == 0:
+            return df
+        head, self.carry = df.iloc[:-1], df.iloc[-1:]
+        keep = np.ones(len(head), dtype=bool)
+        for column in self.columns:
+            values = df[column].to_numpy(dtype=np.float64)
+            keep &= np.abs(np.diff(values)) <= self.stage.max_step
+        if len(head):
+            self.previous = head[list(self.columns)].iloc[-1].to_numpy(dtype=np.float64)
+        head = head[keep]
+        self.kept += len(head)
+        return head
+
+    def finish(self):
+        # Последний отсчёт ряда сравнивается с предыдущим, как в StepDiffFilter
+        carry, self.carry = self.carry, None
+        if carry is None:
+            return None
+        values = carry[list(self.columns)].iloc[0].to_numpy(dtype=np.float64)
+        if self.previous is None:
+            keep = np.isfinite(values).all()
+        else:
+            keep = (np.abs(values - self.previous) <= self.stage.max_step).all()
+        if keep:
+            self.kept += 1
+            return carry
+        return carry.iloc[:0]
+
+
+def _streaming_stages(chain):
+    stages = []
+    for stage in chain.filters:
+        if isinstance(stage, SigmaFilter):
+            stages.append(_BoundsStage(stage))
+        elif isinstance(stage, StepDiffFilter):
+            stages.append(_StepStage(stage))
+        elif isinstance(stage, RangeFilter):
+            stages.append(_Stage(stage))
+        else:
+            # MAD и другие фильтры по медиане требуют весь ряд
+            raise ValueError(f"Filter {stage.describe()} cannot run on a stream. "
+                             "Use range, step and sigma filters.")
+    return stages
+
+
+class StreamingMatcher:
+    # Сопоставление многолетних рядов частями: память ограничена частью ряда и буфером
+    # на допуск назад, а не длиной записи. Очистка наземных данных - те же фильтры
+    # (диапазон, скачок, сигма), статистика сигма-фильтров - из отдельного прохода по частям
+    def __init__(self, chunks, ground_filter_chain=None, match_filter_chain=None):
+        # chunks: функция без аргументов, которая каждый раз отдаёт новый итератор частей по времени
+        self.chunks = chunks
+        self.ground_filter_chain = ground_filter_chain or ground_filters()
+        self.match_filter_chain = match_filter_chain or match_filters()
+        self.stages = _streaming_stages(self.ground_filter_chain)
+        self.rows = 0
+        self.date_start = None
+        self.date_end = None
+        self.ground_report = None
+        self.match_report = None
+        # Неразобранные строки файла (from_file): заполняются при каждом проходе по частям
+        self._rejected = []
+        self._prepared = False
+
+    @classmethod
+    def from_file(cls, file_path, chunk_rows=GROUND_CHUNK_ROWS, **kwargs):
+        matcher = cls(None, **kwargs)
+        matcher.chunks = lambda: iter_ground_chunks(file_path, chunk_rows, matcher._rejected)
+        return matcher
+
+    @property
+    def rejected(self):
+        return rejected_table(self._rejected)
+
+    def _ordered_chunks(self):
+        last = None
+        for chunk in self.chunks():
+            if chunk.empty:
+                continue
+            times = chunk['datetime'].to_numpy(dtype='datetime64[ns]')
+            if not (times[1:] >= times[:-1]).all():
+                chunk = chunk.sort_values('datetime', kind='mergesort')
+                times = chunk['datetime'].to_numpy(dtype='datetime64[ns]')
+            if last is not None and times[0] < last:
+                raise ValueError("Ground records must be in time order to be matched as a stream.")
+            last = times[-1]
+            yield chunk
+
+    def _run_stages(self, stages, df):
+        for stage in stages:
+            if df is None or df.empty:
+                return df
+            df = stage.process(df)
+        return df
+
+    def _finish_stages(self, stages):
+        # Отложенные строки этапов (последний отсчёт для фильтра скачков) проходят оставшиеся этапы
+        tail = []
+        for index, stage in enumerate(stages):
+            carry = stage.finish()
+            if carry is not None and len(carry):
+                tail.append(self._run_stages(stages[index + 1:], carry))
+        tail = [df for df in tail if df is not None and len(df)]
+        return pd.concat(tail) if tail else None
+
+    def prepare(self):
+        # Проходы статистики: по одному на каждый сигма-фильтр наземной цепочки; первый проход
+        # заодно даёт число строк и период записи
+        with span('stream.prepare') as s:
+            bounds_stages = [index for index, stage in enumerate(self.stages) if isinstance(stage, _BoundsStage)]
+            passes = bounds_stages or [None]
+            for index in passes:
+                before = self._fresh(self.stages[:index] if index is not None else [])
+                for chunk in self._ordered_chunks():
+                    if index == passes[0]:
+                        self._scan(chunk)
+                    if index is None:
+                        continue
+                    df = self._run_stages(before, chunk)
+                    if df is not None and len(df):
+                        self.stages[index].accumulate(df)
+                if index is not None:
+                    tail = self._finish_stages(before)
+                    if tail is not None:
+                        self.stages[index].accumulate(tail)
+                    self.stages[index].set_bounds()
+            s.set(rows=self.rows, passes=len(passes))
+        self._prepared = True
+        return self
+
+    def _scan(self, chunk):
+        self.rows += len(chunk)
+        start, end = chunk['datetime'].iloc[0], chunk['datetime'].iloc[-1]
+        self.date_start = start if self.date_start is None else min(self.date_start, start)
+        self.date_end = end if self.date_end is None else max(self.date_end, end)
+
+    def _fresh(self, stages):
+        # Этапы для нового прохода: счётчики и отложенные строки обнуляются, границы сохраняются
+        fresh = []
+        for stage in stages:
+            copy = type(stage)(stage.stage)
+            if isinstance(stage, _BoundsStage):
+                copy.moments, copy.bounds = stage.moments, stage.bounds
+            fresh.append(copy)
+        return fresh
+
+    def cleaned_chunks(self):
+        # Очищенный наземный ряд частями по времени; отчёт фильтров - после полного прохода
+        if not self._prepared:
+            self.prepare()
+        stages = self._fresh(self.stages)
+        for chunk in self._ordered_chunks():
+            df = self._run_stages(stages, chunk)
+            if df is not None and len(df):
+                yield df
+        tail = self._finish_stages(stages)
+        if tail is not None:
+            yield tail
+        remaining = self.rows
+        report = []
+        for stage in stages:
+            report.append({'stage': stage.stage.describe(), 'removed': int(remaining - stage.kept),
+                           'remaining': int(stage.kept)})
+            remaining = stage.kept
+        self.ground_report = pd.DataFrame(report, columns=['stage', 'removed', 'remaining'])
+
+    def match_frames(self, targets):
+        # targets: {ключ: (пролёты datetime, value; допуск, мин)} - все комбинации за один проход по ряду.
+        # Пролёты небольшие и держатся целиком; пролёт сопоставляется, когда прочитаны все наземные отсчёты
+        # до момента пролёта + допуск; в буфере остаются только отсчёты не раньше (ожидающий пролёт - допуск)
+        states = {}
+        for key, (satellite, time_interval_minutes) in targets.items():
+            satellite = satellite.dropna(subset=['datetime']).sort_values('datetime', kind='mergesort')
+            tolerance = None if time_interval_minutes is None else np.timedelta64(
+                int(time_interval_minutes * 60 * 10 ** 9), 'ns')
+            states[key] = {'satellite': satellite, 'times': satellite['datetime'].to_numpy(dtype='datetime64[ns]'),
+                           'minutes': time_interval_minutes, 'tolerance': tolerance, 'position': 0, 'paired': []}
+        buffer = None
+        self.buffer_rows = 0
+        for chunk in self.cleaned_chunks():
+            window = chunk if buffer is None else pd.concat([buffer, chunk], ignore_index=True)
+            window_times = window['datetime'].to_numpy(dtype='datetime64[ns]')
+            ground_end = window_times[-1]
+            keep_from = len(window) - 1
+            for state in states.values():
+                times, tolerance, position = state['times'], state['tolerance'], state['position']
+                # Пролёты, ближайший отсчёт которых уже не может прийти в следующих частях
+                limit = ground_end if tolerance is None else ground_end - tolerance
+                ready = position + np.searchsorted(times[position:], limit, side='left')
+                if ready > position:
+                    state['paired'].append(match_nearest(state['satellite'].iloc[position:ready], window,
+                                                         state['minutes']))
+                    state['position'] = position = ready
+                if tolerance is not None:
+                    pending = times[position] if position < len(times) else ground_end
+                    keep_from = min(keep_from, np.searchsorted(window_times, min(pending, ground_end) - tolerance,
+                                                               side='left'))
+            buffer = window.iloc[keep_from:].reset_index(drop=True)
+            self.buffer_rows = max(self.buffer_rows, len(buffer))
+
+        results = {}
+        for key, state in states.items():
+            paired = state['paired']
+            if state['position'] < len(state['times']) and buffer is not None:
+                paired.append(match_nearest(state['satellite'].iloc[state['position']:], buffer, state['minutes']))
+            paired = [frame for frame in paired if len(frame)]
+            results[key] = pd.concat(paired, ignore_index=True) if paired else \
+                match_nearest(state['satellite'].iloc[:0], pd.DataFrame({'datetime': pd.Series(dtype='datetime64[ns]'),
+                                                                         'value': pd.Series(dtype=np.float64)}))
+        return results
+
+    def match_runs(self, runs):
+        # runs: [(таблица менеджера, спутник, продукт, время суток, допуск), ...] -> [(MatchTable, отчёт фильтров)]
+        # в порядке runs, как у CommonDates.match_data, но без наземного ряда в памяти
+        with span('stream.match', runs=len(runs)) as s:
+            targets = {}
+            for index, (df, satellite, satellite_product, time_of_day, time_interval_minutes) in enumerate(runs):
+                common_dates = CommonDates(df, None, satellite, satellite_product, time_of_day,
+                                           ground_filter_chain=self.ground_filter_chain,
+                                           match_filter_chain=self.match_filter_chain)
+                targets[index] = (common_dates._satellite_frame(), time_interval_minutes)
+            frames = self.match_frames(targets)
+            results = []
+            for index, (df, satellite, satellite_product, time_of_day, time_interval_minutes) in enumerate(runs):
+                paired = frames[index]
+                paired['abs_difference'] = (paired['value'] - paired['ground_value']).abs()
+                paired, report = self.match_filter_chain.apply(paired)
+                results.append((MatchTable.from_paired(paired, satellite, satellite_product, time_of_day), report))
+            s.set(rows=sum(len(matches) for matches, report in results), buffer_rows=self.buffer_rows)
+            return results
+
+    def match(self, df, satellite, satellite_product=None, time_of_day=None, time_interval_minutes=None):
+        matches, self.match_report = self.match_runs(
+            [(df, satellite, satellite_product, time_of_day, time_interval_minutes)])[0]
+        return matches
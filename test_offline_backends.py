@@ -0,0 +1,82 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ee_backend
+import ee_session
+from common_dates import CommonDates, required_columns
+from ee_backend import ReplayBackend, SyntheticBackend, request_key
+from fetch_planner import FetchPlanner
+from modis_data import ModisDataManager
+from satellite_cache import SatelliteCache
+
+COORDINATES = [82.9, 55.0]
+DATE_START, DATE_END = '2020-01-01', '2020-07-01'
+
+
+class SyntheticRecorder(SyntheticBackend):
+    # Синтетические ответы в формате записей RecordBackend - источник для ReplayBackend без Earth Engine
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def call(self, request, fn):
+        response = super().call(request, fn)
+        with open(os.path.join(self.directory, f'{request_key(request)}.json'), 'w', encoding='utf-8') as f:
+            json.dump({'request': request, 'response': response}, f, default=str)
+        return response
+
+
+@pytest.fixture
+def without_ee(monkeypatch):
+    # Модули получают заглушку, как при неустановленном earthengine-api
+    missing = ee_session.MissingModule('ee')
+    for module in list(sys.modules.values()):
+        if getattr(module, 'ee', None) is ee_session.ee:
+            monkeypatch.setattr(module, 'ee', missing)
+    ee_session.ee_exceptions.cache_clear()
+    yield
+    ee_session.ee_exceptions.cache_clear()
+
+
+def ground_series():
+    times = pd.date_range(DATE_START, DATE_END, freq='h', inclusive='left')
+    day_of_year = times.dayofyear.to_numpy()
+    hours = times.hour.to_numpy()
+    values = 8 + 18 * np.sin(2 * np.pi * (day_of_year - 110) / 365.25) + 4 * np.sin(2 * np.pi * (hours - 8) / 24)
+    return pd.DataFrame({'datetime': times, 'value': values.round(2)})
+
+
+def match(backend, cache_directory, monkeypatch):
+    monkeypatch.setattr(ee_backend, '_backend', backend)
+    planner = FetchPlanner(max_elements=50, backoff_seconds=0)
+    satellite_cache = SatelliteCache(str(cache_directory), fetch=planner.fetch, fetch_stations=planner.fetch_stations)
+    manager = ModisDataManager(['aqua'], required_columns('modis', 'day'))
+    df = satellite_cache.get_dataframe(manager, COORDINATES, DATE_START, DATE_END)
+    matches, daily_averages = CommonDates(df, ground_series(), 'modis', 'aqua', 'day').match_data(60)
+    return matches.display_frame()
+
+
+def test_synthetic_and_replay_runs_match_without_ee(without_ee, tmp_path, monkeypatch):
+    recordings = tmp_path / 'recordings'
+    recordings.mkdir()
+    synthetic = match(SyntheticRecorder(str(recordings)), tmp_path / 'synthetic', monkeypatch)
+    replayed = match(ReplayBackend(str(recordings)), tmp_path / 'replay', monkeypatch)
+    assert len(synthetic) > 0
+    pd.testing.assert_frame_equal(synthetic, replayed)
+
+
+def test_replay_miss_raises_lookup_error(without_ee, tmp_path, monkeypatch):
+    recordings = tmp_path / 'recordings'
+    recordings.mkdir()
+    match(SyntheticRecorder(str(recordings)), tmp_path / 'synthetic', monkeypatch)
+    # Оценка размера есть в записях, ответов окон нет: промах в окне FetchPlanner
+    for path in recordings.iterdir():
+        if json.loads(path.read_text(encoding='utf-8'))['request']['op'] != 'size':
+            path.unlink()
+    with pytest.raises(LookupError):
+        match(ReplayBackend(str(recordings)), tmp_path / 'replay', monkeypatch)
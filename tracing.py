@@ -0,0 +1,207 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+TRACE_ENV = 'VALIDATE_TRACE'
+# memory - время, строки, байты и пик памяти (tracemalloc заметно замедляет Python), time - без памяти
+TRACE_MODES = ('memory', 'time')
+TRACE_DIRECTORY = 'Traces'
+
+# Активный трассировщик; None - трассировка выключена, span() отдаёт пустой участок
+_tracer = None
+
+
+class _NullSpan:
+    # Пустой участок: выключенная трассировка стоит одной проверки и одного вызова
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self.child_peak = 0
+
+    def __bool__(self):
+        return True
+
+    def set(self, **attrs):
+        # rows, bytes и любые другие величины участка
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.thread = threading.current_thread().name
+        if self.tracer.memory:
+            # Пик tracemalloc общий для процесса: перед участком сбрасывается, пик родителя
+            # восстанавливается из пиков вложенных участков
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent.child_peak = max(self.parent.child_peak, peak)
+            self.memory_start = current
+            tracemalloc.reset_peak()
+        self.started = time.time()
+        self.perf_started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.perf_started
+        record = {'name': self.name, 'start': self.started, 'seconds': seconds, 'thread': self.thread,
+                  'parent': self.parent.name if self.parent is not None else None, **self.attrs}
+        if self.tracer.memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            record['peak_bytes'] = max(0, peak - self.memory_start)
+            if self.parent is not None:
+                self.parent.child_peak = max(self.parent.child_peak, peak)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        stack = self.tracer._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.tracer._record(record)
+        return False
+
+
+class Tracer:
+    def __init__(self, memory=True, **metadata):
+        self.memory = memory
+        self.metadata = metadata
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracemalloc = False
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        return self
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return self
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def export(self, path):
+        # Трасса запуска: метаданные и участки в порядке завершения
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            spans = list(self.spans)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'metadata': self.metadata, 'memory': self.memory, 'spans': spans}, f, ensure_ascii=False,
+                      indent=1, default=str)
+        return path
+
+    def summary(self):
+        return summarize(self.spans)
+
+
+def summarize(spans):
+    # Сводка по шагам: число вызовов, суммарное и максимальное время, строки, байты, пик памяти
+    import pandas as pd
+    columns = ['name', 'calls', 'seconds', 'max_seconds', 'rows', 'bytes', 'peak_mb']
+    if not spans:
+        return pd.DataFrame(columns=columns)
+    frame = pd.DataFrame(spans)
+    for column in ('rows', 'bytes', 'peak_bytes'):
+        if column not in frame.columns:
+            frame[column] = float('nan')
+    summary = frame.groupby('name', sort=False).agg(
+        calls=('seconds', 'size'), seconds=('seconds', 'sum'), max_seconds=('seconds', 'max'),
+        rows=('rows', 'sum'), bytes=('bytes', 'sum'), peak_bytes=('peak_bytes', 'max')).reset_index()
+    summary['peak_mb'] = summary.pop('peak_bytes') / 2 ** 20
+    return summary[columns].sort_values('seconds', ascending=False).reset_index(drop=True)
+
+
+def enable(memory=True, **metadata):
+    global _tracer
+    disable()
+    _tracer = Tracer(memory, **metadata).start()
+    return _tracer
+
+
+def disable():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.stop()
+    return tracer
+
+
+def active():
+    return _tracer
+
+
+def span(name, **attrs):
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, **attrs)
+
+
+def traced(name):
+    # Декоратор: участок на весь вызов функции
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def payload_bytes(value):
+    # Размер ответа getInfo в JSON; считается только при включённой трассировке
+    return len(json.dumps(value, default=str))
+
+
+def trace_mode(option=None):
+    # Режим из аргумента --trace или переменной VALIDATE_TRACE; None - трассировка выключена
+    mode = option or os.environ.get(TRACE_ENV)
+    if not mode or mode.lower() in ('0', 'off', 'no'):
+        return None
+    return 'time' if mode.lower() == 'time' else 'memory'
+
+
+def trace_path(directory=TRACE_DIRECTORY, prefix='trace'):
+    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    return os.path.join(directory, f'{prefix}_{current_time}.json')
@@ -0,0 +1,222 @@
+import numpy as np
+import pandas as pd
+
+from tracing import traced
+
+SEASONS = {12: 'DJF', 1: 'DJF', 2: 'DJF', 3: 'MAM', 4: 'MAM', 5: 'MAM',
+           6: 'JJA', 7: 'JJA', 8: 'JJA', 9: 'SON', 10: 'SON', 11: 'SON'}
+GROUP_KEYS = ('station', 'satellite', 'platform', 'time_of_day', 'month')
+# Предел числа элементов в одной партии бутстрепа (batch x n)
+BOOTSTRAP_ELEMENTS = 5_000_000
+METRIC_COLUMNS = ['matches', 'rmse', 'mbe', 'mae', 'r2', 'slope', 'intercept', 'error_p05', 'error_p50',
+                  'error_p95']
+
+
+class ErrorHistogram:
+    # Приближённые квантили ошибки: разреженная гистограмма с фиксированным шагом
+    # (хранятся только занятые корзины), части складываются без исходных пар
+    def __init__(self, bin_width=0.01, limit=100.0):
+        self.bin_width = bin_width
+        self.limit = limit
+        self.bins = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def _add(self, bins, counts):
+        bins, inverse = np.unique(np.concatenate([self.bins, bins]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts])).astype(np.int64)
+        self.bins = bins
+
+    def update(self, errors):
+        bins = np.rint(np.clip(errors, -self.limit, self.limit) / self.bin_width).astype(np.int64)
+        self._add(bins, np.ones(len(bins), dtype=np.int64))
+        return self
+
+    def merge(self, other):
+        self._add(other.bins, other.counts)
+        return self
+
+    def quantile(self, q):
+        total = self.counts.sum()
+        if total == 0:
+            return np.full(np.shape(q), np.nan)
+        cumulative = np.cumsum(self.counts)
+        positions = np.searchsorted(cumulative, np.asarray(q) * total, side='left')
+        return self.bins[np.minimum(positions, len(self.bins) - 1)] * self.bin_width
+
+
+class ErrorAccumulator:
+    # Однопроходные метрики пар спутник-земля: средние и ко-моменты по Уэлфорду,
+    # части объединяются формулами Чана, поэтому пары не нужно держать в памяти
+    def __init__(self, bin_width=0.01):
+        self.n = 0
+        self.mean_ground = 0.0
+        self.mean_satellite = 0.0
+        self.m2_ground = 0.0
+        self.m2_satellite = 0.0
+        self.co_moment = 0.0
+        self.sum_error = 0.0
+        self.sum_abs_error = 0.0
+        self.sum_sq_error = 0.0
+        self.histogram = ErrorHistogram(bin_width)
+
+    def _combine(self, n, mean_ground, mean_satellite, m2_ground, m2_satellite, co_moment):
+        total = self.n + n
+        delta_ground = mean_ground - self.mean_ground
+        delta_satellite = mean_satellite - self.mean_satellite
+        weight = self.n * n / total
+        self.m2_ground += m2_ground + delta_ground ** 2 * weight
+        self.m2_satellite += m2_satellite + delta_satellite ** 2 * weight
+        self.co_moment += co_moment + delta_ground * delta_satellite * weight
+        self.mean_ground += delta_ground * n / total
+        self.mean_satellite += delta_satellite * n / total
+        self.n = total
+
+    def update(self, satellite_values, ground_values):
+        satellite_values = np.asarray(satellite_values, dtype=np.float64)
+        ground_values = np.asarray(ground_values, dtype=np.float64)
+        valid = np.isfinite(satellite_values) & np.isfinite(ground_values)
+        satellite_values, ground_values = satellite_values[valid], ground_values[valid]
+        n = len(satellite_values)
+        if n == 0:
+            return self
+        mean_ground, mean_satellite = ground_values.mean(), satellite_values.mean()
+        ground_centered = ground_values - mean_ground
+        satellite_centered = satellite_values - mean_satellite
+        self._combine(n, mean_ground, mean_satellite, ground_centered @ ground_centered,
+                      satellite_centered @ satellite_centered, ground_centered @ satellite_centered)
+        errors = satellite_values - ground_values
+        self.sum_error += errors.sum()
+        self.sum_abs_error += np.abs(errors).sum()
+        self.sum_sq_error += errors @ errors
+        self.histogram.update(errors)
+        return self
+
+    def update_matches(self, matches):
+        return self.update(matches.satellite_value, matches.ground_value)
+
+    def merge(self, other):
+        if other.n:
+            self._combine(other.n, other.mean_ground, other.mean_satellite, other.m2_ground,
+                          other.m2_satellite, other.co_moment)
+            self.sum_error += other.sum_error
+            self.sum_abs_error += other.sum_abs_error
+            self.sum_sq_error += other.sum_sq_error
+            self.histogram.merge(other.histogram)
+        return self
+
+    @property
+    def rmse(self):
+        return np.sqrt(self.sum_sq_error / self.n) if self.n else np.nan
+
+    @property
+    def mbe(self):
+        return self.sum_error / self.n if self.n else np.nan
+
+    @property
+    def mae(self):
+        return self.sum_abs_error / self.n if self.n else np.nan
+
+    @property
+    def slope(self):
+        # Регрессия спутника на землю, как на диаграмме рассеяния plot_data
+        return self.co_moment / self.m2_ground if self.m2_ground else np.nan
+
+    @property
+    def intercept(self):
+        return self.mean_satellite - self.slope * self.mean_ground
+
+    @property
+    def r2(self):
+        if not (self.m2_ground and self.m2_satellite):
+            return np.nan
+        return self.co_moment ** 2 / (self.m2_ground * self.m2_satellite)
+
+    def quantiles(self, q=(0.05, 0.5, 0.95)):
+        return self.histogram.quantile(q)
+
+    def result(self):
+        p05, p50, p95 = self.quantiles()
+        return {'matches': self.n, 'rmse': float(self.rmse), 'mbe': float(self.mbe), 'mae': float(self.mae),
+                'r2': float(self.r2), 'slope': float(self.slope), 'intercept': float(self.intercept),
+                'error_p05': float(p05), 'error_p50': float(p50), 'error_p95': float(p95)}
+
+
+def match_keys(matches, station=None):
+    # Ключи группировки для каждой пары: станция, спутник, платформа, время суток, месяц пролёта
+    months = matches.satellite_datetime.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    return pd.DataFrame({
+        'station': np.full(len(matches), station or ''),
+        'satellite': np.asarray(matches.satellite).astype(str),
+        'platform': np.asarray(matches.platform).astype(str),
+        'time_of_day': np.asarray(matches.time_of_day).astype(str),
+        'month': months,
+    })
+
+
+class GroupedStats:
+    # Аккумуляторы по самым мелким группам; крупные (сезон, платформа, ...) получаются их слиянием
+    def __init__(self, bin_width=0.01):
+        self.bin_width = bin_width
+        self.groups = {}
+
+    def update(self, matches, station=None):
+        if not matches:
+            return self
+        keys = match_keys(matches, station)
+        for key, rows in keys.groupby(list(GROUP_KEYS), sort=False).indices.items():
+            accumulator = self.groups.setdefault(key, ErrorAccumulator(self.bin_width))
+            accumulator.update(matches.satellite_value[rows], matches.ground_value[rows])
+        return self
+
+    def merge(self, other):
+        for key, accumulator in other.groups.items():
+            self.groups.setdefault(key, ErrorAccumulator(self.bin_width)).merge(accumulator)
+        return self
+
+    def table(self, by=('platform', 'time_of_day')):
+        # by: любые из station, satellite, platform, time_of_day, month, season; пустой - общий итог
+        by = list(by)
+        merged = {}
+        for key, accumulator in self.groups.items():
+            values = dict(zip(GROUP_KEYS, key))
+            values['season'] = SEASONS[int(values['month'])]
+            group = tuple(values[column] for column in by)
+            merged.setdefault(group, ErrorAccumulator(self.bin_width)).merge(accumulator)
+        rows = [{**dict(zip(by, group)), **accumulator.result()} for group, accumulator in merged.items()]
+        table = pd.DataFrame(rows, columns=by + METRIC_COLUMNS)
+        return table.sort_values(by).reset_index(drop=True) if by else table
+
+
+def bootstrap_ci(satellite_values, ground_values, n_boot=1000, confidence=0.95, batch_size=250, seed=0):
+    # Бутстреп RMSE/MBE/MAE: индексы выборок генерируются матрицей (партия x n),
+    # размер партии ограничен, чтобы большие наборы пар не занимали всю память
+    errors = np.asarray(satellite_values, dtype=np.float64) - np.asarray(ground_values, dtype=np.float64)
+    errors = errors[np.isfinite(errors)]
+    n = len(errors)
+    if n == 0:
+        return pd.DataFrame(columns=['metric', 'low', 'high'])
+    rng = np.random.default_rng(seed)
+    batch_size = max(1, min(batch_size, BOOTSTRAP_ELEMENTS // n))
+    samples = {'rmse': [], 'mbe': [], 'mae': []}
+    for start in range(0, n_boot, batch_size):
+        resampled = errors[rng.integers(0, n, size=(min(batch_size, n_boot - start), n))]
+        samples['rmse'].append(np.sqrt(np.mean(resampled ** 2, axis=1)))
+        samples['mbe'].append(resampled.mean(axis=1))
+        samples['mae'].append(np.abs(resampled).mean(axis=1))
+    alpha = (1 - confidence) / 2
+    rows = []
+    for metric, values in samples.items():
+        low, high = np.quantile(np.concatenate(values), [alpha, 1 - alpha])
+        rows.append({'metric': metric, 'low': low, 'high': high})
+    return pd.DataFrame(rows)
+
+
+@traced('match_statistics')
+def match_statistics(matches, n_boot=1000, confidence=0.95):
+    # Метрики одного набора пар и доверительные интервалы для консоли и отчёта
+    metrics = ErrorAccumulator().update_matches(matches).result()
+    intervals = bootstrap_ci(matches.satellite_value, matches.ground_value, n_boot, confidence)
+    for row in intervals.itertuples(index=False):
+        metrics[f'{row.metric}_ci_low'] = row.low
+        metrics[f'{row.metric}_ci_high'] = row.high
+    return metrics